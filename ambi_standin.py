@@ -0,0 +1,375 @@
+"""
+AMBI の代わりに応答するローカルサーバ (オフラインでの動作確認・性能計測用)
+
+    python ambi_standin.py --port 8900 --total 250 --latency 0.2 --error-rate 0.05
+    AMBI_BASE_URL=http://127.0.0.1:8900 uvicorn main:app
+
+応答は standin_fixtures/ のHTMLを元に生成する。
+デバッグ記録 (AMBI_DEBUG_CAPTURE) で保存した実際の応答を import-capture でフィクスチャに取り込める:
+
+    python ambi_standin.py import-capture debug_captures/xxx_response_first_page_200.json.gz search_list
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import secrets
+import sys
+import time
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin_fixtures")
+
+LOGIN_PATH = "/company_login/login/"
+
+_GENDERS = ["男性", "女性"]
+_LOCATIONS = ["東京都", "大阪府", "神奈川県", "愛知県", "福岡県"]
+_COMPANIES = ["株式会社サンプル", "テスト商事株式会社", "エグザンプル株式会社"]
+_SCHOOLS = ["東京大学 工学部", "京都大学 経済学部", "早稲田大学 商学部"]
+_JOBS = ["法人営業", "Webエンジニア", "経営企画", "マーケティング"]
+
+
+class StandinConfig:
+    """
+    スタンドインサーバの挙動の設定
+    - latency / jitter: 各応答に加える遅延 (秒) とそのゆらぎ
+    - login_latency: ログインPOSTに加える遅延 (秒)
+    - error_rate / error_status: 指定割合で error_status を返す (error_paths で対象を絞れる)
+    - total / per_page: 検索のヒット件数と1ページの件数
+    - pager_window: ページ下部のリンクに表示する前後のページ数 (0 なら全ページ)
+    - compress: Accept-Encoding に応じて応答を圧縮する
+    - username / password: 指定した場合のみ認証情報を照合する
+    - session_ttl: セッションの有効期限 (秒、0 なら無期限)。切れるとログイン画面へリダイレクトする
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        login_latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        error_paths: Optional[Set[str]] = None,
+        total: int = 120,
+        per_page: int = 50,
+        pager_window: int = 4,
+        compress: bool = True,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        session_ttl: float = 0.0,
+        fixture_dir: str = FIXTURE_DIR
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.login_latency = login_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_paths = error_paths
+        self.total = total
+        self.per_page = per_page
+        self.pager_window = pager_window
+        self.compress = compress
+        self.username = username
+        self.password = password
+        self.session_ttl = session_ttl
+        self.fixture_dir = fixture_dir
+
+
+def _load_fixtures(directory: str) -> Dict[str, str]:
+    fixtures = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            fixtures[os.path.splitext(name)[0]] = f.read()
+    return fixtures
+
+
+def _fill(template: str, values: Dict[str, object]) -> str:
+    for key, value in values.items():
+        template = template.replace("{{" + key + "}}", str(value))
+    return template
+
+
+class StandinServer:
+    def __init__(self, config: StandinConfig):
+        self.config = config
+        self.fixtures = _load_fixtures(config.fixture_dir)
+        # PHPSESSID -> (C13CT, ログイン時刻)
+        self.sessions: Dict[str, tuple] = {}
+        # 受け付けたリクエスト数 (パス別)
+        self.hits: Dict[str, int] = {}
+        self.scouts_sent = 0
+
+    # ----------------------------------------
+    # 共通処理
+    # ----------------------------------------
+    @web.middleware
+    async def shape(self, request: web.Request, handler):
+        """
+        遅延とエラーを注入する
+        """
+        path = request.path
+        if path.startswith("/__standin/"):
+            return await handler(request)
+        self.hits[path] = self.hits.get(path, 0) + 1
+
+        delay = self.config.latency
+        if self.config.jitter:
+            delay = max(0.0, delay + random.uniform(-self.config.jitter, self.config.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+
+        targeted = self.config.error_paths is None or path in self.config.error_paths
+        if targeted and self.config.error_rate and random.random() < self.config.error_rate:
+            return web.Response(status=self.config.error_status, text="stand-in: injected error")
+        response = await handler(request)
+        if self.config.compress and isinstance(response, web.Response):
+            response.enable_compression()
+        return response
+
+    def _session(self, request: web.Request) -> Optional[str]:
+        sid = request.cookies.get("PHPSESSID")
+        if sid is None or sid not in self.sessions:
+            return None
+        _, logged_in_at = self.sessions[sid]
+        if self.config.session_ttl and time.monotonic() - logged_in_at > self.config.session_ttl:
+            del self.sessions[sid]
+            return None
+        return sid
+
+    def _login_redirect(self) -> web.HTTPFound:
+        return web.HTTPFound(f"{LOGIN_PATH}?PK=CC1E9D")
+
+    def _html(self, body: str) -> web.Response:
+        return web.Response(text=body, content_type="text/html", charset="utf-8")
+
+    async def _form_token(self, request: web.Request, sid: str) -> bool:
+        data = await request.post()
+        return data.get("C13CT") == self.sessions[sid][0]
+
+    # ----------------------------------------
+    # ログイン
+    # ----------------------------------------
+    async def login_form(self, request: web.Request) -> web.Response:
+        return self._html(self.fixtures["login"])
+
+    async def login_submit(self, request: web.Request) -> web.Response:
+        if self.config.login_latency:
+            await asyncio.sleep(self.config.login_latency)
+        data = await request.post()
+        if (
+            (self.config.username is not None and data.get("accLoginID") != self.config.username)
+            or (self.config.password is not None and data.get("accLoginPW") != self.config.password)
+        ):
+            # 認証失敗時はログイン画面のまま
+            return self._html(self.fixtures["login"])
+
+        sid = secrets.token_hex(16)
+        self.sessions[sid] = (secrets.token_hex(16), time.monotonic())
+        response = web.HTTPFound("/company/top/")
+        response.set_cookie("PHPSESSID", sid, path="/")
+        response.set_cookie("C13CC", secrets.token_hex(8), path="/")
+        raise response
+
+    async def top(self, request: web.Request) -> web.Response:
+        if self._session(request) is None:
+            raise self._login_redirect()
+        return self._html(self.fixtures["top"])
+
+    # ----------------------------------------
+    # 検索
+    # ----------------------------------------
+    async def index(self, request: web.Request) -> web.Response:
+        sid = self._session(request)
+        if sid is None:
+            raise self._login_redirect()
+        return self._html(_fill(self.fixtures["index"], {"C13CT": self.sessions[sid][0]}))
+
+    @staticmethod
+    def _candidate_values(n: int) -> Dict[str, object]:
+        rnd = random.Random(n)
+        return {
+            "sid": 1000000 + n,
+            "no": 500000 + n,
+            "gender": rnd.choice(_GENDERS),
+            "age": rnd.randint(24, 60),
+            "location": rnd.choice(_LOCATIONS),
+            "company": rnd.choice(_COMPANIES),
+            "sub": f"{rnd.choice(_JOBS)} / 年収{rnd.randint(4, 15) * 100}万円",
+            "school": rnd.choice(_SCHOOLS),
+            "change": f"{rnd.randint(0, 5)}回",
+            "pastjob": rnd.choice(_JOBS),
+            "language": "英語：ビジネス会話",
+            "summary": f"候補者{n}の職務要約です。" * 5,
+        }
+
+    def _candidate(self, n: int) -> str:
+        return _fill(self.fixtures["candidate"], self._candidate_values(n))
+
+    async def search_list(self, request: web.Request) -> web.Response:
+        sid = self._session(request)
+        if sid is None:
+            raise self._login_redirect()
+        if not await self._form_token(request, sid):
+            return web.Response(status=403, text="stand-in: invalid C13CT")
+
+        try:
+            offset = int(request.query.get("per_page", "0"))
+        except ValueError:
+            offset = 0
+        per_page = self.config.per_page
+        start = min(offset, self.config.total)
+        end = min(start + per_page, self.config.total)
+
+        # 実際のAMBIと同様に、現在ページの前後のリンクだけを表示する
+        offsets = range(per_page, self.config.total, per_page)
+        window = self.config.pager_window
+        if window:
+            current = start // per_page
+            offsets = [o for o in offsets if abs(o // per_page - current) <= window]
+        pagination = "".join(
+            f'<li><a class="link" href="/company/scout/search_list/?PK=3FFFF4&amp;per_page={o}">'
+            f'{o // per_page + 1}</a></li>\n'
+            for o in offsets
+        )
+        body = _fill(self.fixtures["search_list"], {
+            "total": f"{self.config.total:,}",
+            "candidates": "".join(self._candidate(n) for n in range(start, end)),
+            "pagination": pagination,
+        })
+        return self._html(body)
+
+    async def candidate_detail(self, request: web.Request) -> web.Response:
+        if self._session(request) is None:
+            raise self._login_redirect()
+        try:
+            n = int(request.query.get("SID", "")) - 1000000
+        except ValueError:
+            n = -1
+        if not 0 <= n < self.config.total:
+            return web.Response(status=404, text="stand-in: unknown candidate")
+
+        values = self._candidate_values(n)
+        rnd = random.Random(-n - 1)
+        values.update({
+            "resume": f"候補者{n}の職務経歴の全文です。" * 20,
+            "previous_company": rnd.choice(_COMPANIES),
+            "previous_job": rnd.choice(_JOBS),
+            "self_pr": f"候補者{n}の自己PRです。" * 5,
+            "toeic": rnd.randint(50, 99) * 10,
+            "desired_salary": rnd.randint(4, 15) * 100,
+        })
+        return self._html(_fill(self.fixtures["candidate_detail"], values))
+
+    # ----------------------------------------
+    # スカウト送信
+    # ----------------------------------------
+    async def scout_list_message_frame(self, request: web.Request) -> web.Response:
+        sid = self._session(request)
+        if sid is None:
+            raise self._login_redirect()
+        if not await self._form_token(request, sid):
+            return web.Response(status=403, text="stand-in: invalid C13CT")
+        return self._html(self.fixtures["scout_list_message_frame"])
+
+    async def scout_send(self, request: web.Request) -> web.Response:
+        sid = self._session(request)
+        if sid is None:
+            raise self._login_redirect()
+        if not await self._form_token(request, sid):
+            return web.Response(status=403, text="stand-in: invalid C13CT")
+        self.scouts_sent += 1
+        return web.Response(text=self.fixtures["scout_send"], content_type="application/json")
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "hits": self.hits,
+            "sessions": len(self.sessions),
+            "scouts_sent": self.scouts_sent,
+        })
+
+
+def create_app(config: Optional[StandinConfig] = None) -> web.Application:
+    server = StandinServer(config or StandinConfig())
+    app = web.Application(middlewares=[server.shape])
+    app["standin"] = server
+    app.router.add_get(LOGIN_PATH, server.login_form)
+    app.router.add_post(LOGIN_PATH, server.login_submit)
+    app.router.add_get("/company/top/", server.top)
+    app.router.add_get("/company/scout/index/action/", server.index)
+    app.router.add_post("/company/scout/search_list/", server.search_list)
+    app.router.add_get("/company/scout/detail/", server.candidate_detail)
+    app.router.add_post(
+        "/company/api/scout_list_message_frame/index/scoutfolder/", server.scout_list_message_frame
+    )
+    app.router.add_post("/company/api/scout_send/run", server.scout_send)
+    app.router.add_get("/__standin/stats", server.stats)
+    return app
+
+
+def import_capture(capture_path: str, fixture_name: str, fixture_dir: str = FIXTURE_DIR) -> str:
+    """
+    デバッグ記録 (gzip JSON) の応答本文をフィクスチャとして保存する
+    """
+    with gzip.open(capture_path, "rt", encoding="utf-8") as f:
+        record = json.load(f)
+    ext = ".json" if fixture_name == "scout_send" else ".html"
+    path = os.path.join(fixture_dir, fixture_name + ext)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(record["body"])
+    return path
+
+
+def main(argv=None) -> None:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == "import-capture":
+        parser = argparse.ArgumentParser(prog="ambi_standin.py import-capture")
+        parser.add_argument("capture", help="debug_captures/ 内の .json.gz")
+        parser.add_argument("fixture", help="保存先のフィクスチャ名 (search_list, index, candidate_detail など)")
+        args = parser.parse_args(argv[1:])
+        print(import_capture(args.capture, args.fixture))
+        return
+
+    parser = argparse.ArgumentParser(description="AMBI スタンドインサーバ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="各応答の遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延のゆらぎ (秒)")
+    parser.add_argument("--login-latency", type=float, default=0.0, help="ログインの遅延 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラーを返す割合")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--error-paths", default="", help="エラー注入の対象パス (カンマ区切り、省略時は全パス)")
+    parser.add_argument("--total", type=int, default=120, help="検索のヒット件数")
+    parser.add_argument("--per-page", type=int, default=50, help="1ページの件数")
+    parser.add_argument("--pager-window", type=int, default=4, help="ページリンクに表示する前後のページ数 (0 で全ページ)")
+    parser.add_argument("--no-compress", action="store_true", help="応答を圧縮しない")
+    parser.add_argument("--username", default=None)
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--session-ttl", type=float, default=0.0, help="セッションの有効期限 (秒)")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR)
+    args = parser.parse_args(argv)
+
+    config = StandinConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        login_latency=args.login_latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        error_paths={p for p in args.error_paths.split(",") if p} or None,
+        total=args.total,
+        per_page=args.per_page,
+        pager_window=args.pager_window,
+        compress=not args.no_compress,
+        username=args.username,
+        password=args.password,
+        session_ttl=args.session_ttl,
+        fixture_dir=args.fixtures
+    )
+    web.run_app(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ import pandas as pd
 from typing import Dict, Any
 import io
 import csv
+import time
 from datetime import datetime
 
 # 環境変数の読み込み
@@ -215,6 +216,7 @@ def scout_message_tool(api_base_url: str):
     # APIサーバーURL (適宜変更)
     # =========================================
     api_base_url = "https://ambi-service-1077541053369.asia-northeast1.run.app/"
+    job_api_base = api_base_url.rstrip("/")
 
     # =========================================
     # サイドバーで「単体送信」 or 「一括送信」 を選択
@@ -476,35 +478,29 @@ def scout_message_tool(api_base_url: str):
                 st.warning("テーブルが空です。送信データがありません。")
                 return
 
-            st.info("一括送信を開始します。")
+            st.info("一括送信ジョブを登録します。")
 
-            scout_api_url = f"{api_base_url}/scout/send"
-            results = []
-            progress_bar = st.progress(0)
-            total = len(rows)
+            items = []
+            invalid_rows = []
 
-            # 一行ずつ送信
-            for i, row in enumerate(rows):
+            # 一行ずつ送信アイテムを組み立て
+            for row in rows:
                 # ID, 件名, 本文 を取り出し
                 # ID列が空 or null の場合は0になる可能性があるのでチェック
-                uid = row.get("ID", 0)  
+                uid = row.get("ID", 0)
                 title_str = str(row.get("件名", "")).strip()
                 body_str = str(row.get("本文", "")).strip()
 
                 if uid <= 0 or not title_str or not body_str:
-                    results.append({
+                    invalid_rows.append({
                         "ID": uid,
                         "Title": title_str,
                         "status": "error",
                         "message": "ID(>0)/件名/本文 のいずれかが不正または空です"
                     })
-                    progress_bar.progress(int((i+1)/total*100))
                     continue
 
-                # リクエストボディ
-                payload = {
-                    "username": st.session_state.AMBI_USERNAME,
-                    "password": st.session_state.AMBI_PASSWORD,
+                item = {
                     "UID": int(uid),
                     "ScoutType": scout_type,
                     "attachedWorkIDs": attachedWorkIDs,
@@ -515,75 +511,103 @@ def scout_message_tool(api_base_url: str):
                 # オプションパラメータ
                 if reply_deadline is not None:
                     formatted_date = reply_deadline.strftime("%Y年%m月%d日")
-                    payload["ReplyDeadline"] = formatted_date
+                    item["ReplyDeadline"] = formatted_date
 
                 if is_scout is not None:
-                    payload["isScout"] = is_scout
+                    item["isScout"] = is_scout
 
                 if send_page > 0:
-                    payload["sendPage"] = send_page
+                    item["sendPage"] = send_page
 
                 if rescout is not None:
-                    payload["rescout"] = rescout
+                    item["rescout"] = rescout
 
                 if retransmission is not None:
-                    payload["retransmission"] = retransmission
+                    item["retransmission"] = retransmission
 
                 if rescout_trans_select is not None:
-                    payload["rescoutTransSelect"] = rescout_trans_select
+                    item["rescoutTransSelect"] = rescout_trans_select
 
                 if rescout_title.strip():
-                    payload["rescoutTitle"] = rescout_title.strip()
+                    item["rescoutTitle"] = rescout_title.strip()
 
                 if rescout_body.strip():
-                    payload["rescoutBody"] = rescout_body.strip()
+                    item["rescoutBody"] = rescout_body.strip()
 
                 if search_id > 0:
-                    payload["search_id"] = search_id
+                    item["search_id"] = search_id
 
-                # 送信実行
-                try:
-                    response = requests.post(scout_api_url, json=payload, timeout=60)
-                    if response.status_code == 200:
-                        resp_json = response.json()
-                        if resp_json.get("status") == "success":
-                            results.append({
-                                "ID": uid,
-                                "Title": title_str,
-                                "status": "success",
-                                "message": resp_json.get("message")
-                            })
-                        else:
-                            results.append({
-                                "ID": uid,
-                                "Title": title_str,
-                                "status": "error",
-                                "message": resp_json.get("message")
-                            })
-                    else:
-                        results.append({
-                            "ID": uid,
-                            "Title": title_str,
-                            "status": "error",
-                            "message": f"HTTPエラー: {response.status_code}"
-                        })
-                except Exception as e:
-                    results.append({
-                        "ID": uid,
-                        "Title": title_str,
-                        "status": "error",
-                        "message": str(e)
-                    })
+                items.append(item)
 
-                progress_bar.progress(int((i+1)/total*100))
+            if invalid_rows:
+                st.warning(f"{len(invalid_rows)}件の行は不正なため送信対象から除外しました。")
+                st.dataframe(pd.DataFrame(invalid_rows))
 
-            # 集計
-            success_count = sum(1 for r in results if r["status"] == "success")
-            error_count = len(results) - success_count
+            if not items:
+                st.error("送信可能な行がありません。")
+                return
 
-            st.success(f"一括送信が完了しました。 成功: {success_count}件 / 失敗: {error_count}件")
-            # st.write("送信結果一覧:")
-            # st.write(results)
+            # ジョブ登録 (送信自体はサーバー側で非同期に行われる)
+            payload = {
+                "username": st.session_state.AMBI_USERNAME,
+                "password": st.session_state.AMBI_PASSWORD,
+                "items": items
+            }
+            try:
+                response = requests.post(f"{job_api_base}/scout/jobs", json=payload, timeout=60)
+                response.raise_for_status()
+                resp_json = response.json()
+            except Exception as e:
+                st.exception(e)
+                return
+
+            if resp_json.get("status") != "success":
+                st.error(f"ジョブ登録エラー: {resp_json.get('message')}")
+                return
+
+            st.session_state.scout_job_id = resp_json["job_id"]
+            st.success(f"ジョブを登録しました (ジョブID: {resp_json['job_id']})。このページを閉じても送信は継続されます。")
+
+        # =========================================
+        # ジョブの進捗確認 (ページを再読み込みしてもジョブIDで確認可能)
+        # =========================================
+        st.markdown("#### 一括送信ジョブの進捗")
+        job_id = st.text_input("ジョブID", value=st.session_state.get("scout_job_id", ""))
+        if job_id:
+            show_scout_job_progress(job_api_base, job_id)
+
+def show_scout_job_progress(job_api_base: str, job_id: str, poll_interval: float = 2.0):
+    """
+    /jobs/{job_id} をポーリングしてジョブの進捗と送信結果を表示する。
+    """
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+
+    while True:
+        try:
+            response = requests.get(f"{job_api_base}/jobs/{job_id}", timeout=30)
+            response.raise_for_status()
+            job = response.json()
+        except Exception as e:
+            st.error(f"ジョブ状況の取得に失敗しました: {e}")
+            return
+
+        if job.get("status") != "success":
+            st.error(job.get("message"))
+            return
+
+        total = job.get("total", 0) or 1
+        done = job.get("succeeded", 0) + job.get("failed", 0)
+        progress_bar.progress(int(done / total * 100))
+        status_text.write(f"状態: {job.get('state')} / {job.get('message')}")
+
+        if job.get("state") == "done":
+            break
+        time.sleep(poll_interval)
+
+    # 集計
+    st.success(f"一括送信が完了しました。 成功: {job.get('succeeded')}件 / 失敗: {job.get('failed')}件")
+    st.dataframe(pd.DataFrame(job.get("items", [])))
 
 def ambi_ai_search_tool():
     """
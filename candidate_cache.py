@@ -0,0 +1,120 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from models import CandidateData
+
+# テンプレート差し込み用の候補者情報も他の状態と同じローカル状態DBに置く (全ワーカープロセスで共有)
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+# 保持する候補者数の上限 (全アカウント合計。古いものから破棄)
+CANDIDATE_CACHE_SIZE = int(os.getenv("AMBI_CANDIDATE_CACHE_SIZE", "10000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS template_candidates (
+    username     TEXT NOT NULL,
+    candidate_id INTEGER NOT NULL,
+    variables    TEXT NOT NULL,
+    updated_at   REAL NOT NULL,
+    PRIMARY KEY (username, candidate_id)
+);
+"""
+
+
+def _to_variables(candidate: CandidateData) -> Dict[str, str]:
+    """
+    候補者の項目をテンプレート変数にする。
+    past_jobs などのリストは「、」区切りで連結し、値が無い項目は含めない。
+    候補者詳細の sections (見出しごとの全項目) は resume などと重複するため含めない。
+    """
+    variables = {}
+    for name, value in candidate.dict().items():
+        if value is None or value == [] or isinstance(value, dict):
+            continue
+        if isinstance(value, list):
+            value = "、".join(value)
+        variables[name] = str(value)
+    return variables
+
+
+class CandidateCache:
+    """
+    /search・/candidates/details で取得した候補者の項目を (アカウント, 候補者ID) ごとに保存し、
+    テンプレート送信の差し込み変数として再利用する。
+    アカウントをまたいでは共有しない (ほかのアカウントで取得した履歴書などを差し込まないため)。
+    同じ候補者を検索と詳細取得の両方で取得した場合は、項目を合わせて保持する。
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE, size: int = CANDIDATE_CACHE_SIZE):
+        self.size = size
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def remember(self, username: str, candidates: List[CandidateData]) -> None:
+        now = time.time()
+        rows = [
+            (username, c.id, json.dumps(_to_variables(c), ensure_ascii=False), now)
+            for c in candidates if c.id is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO template_candidates VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(username, candidate_id) DO UPDATE SET "
+                    "variables = json_patch(template_candidates.variables, excluded.variables), "
+                    "updated_at = excluded.updated_at",
+                    rows
+                )
+                self._conn.execute(
+                    "DELETE FROM template_candidates WHERE rowid IN ("
+                    " SELECT rowid FROM template_candidates ORDER BY updated_at DESC LIMIT -1 OFFSET ?"
+                    ")",
+                    (self.size,)
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def template_variables(self, username: str, candidate_id: int) -> Dict[str, str]:
+        """
+        アカウントが取得した候補者の項目をテンプレート変数として返す (無ければ空)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT variables FROM template_candidates WHERE username = ? AND candidate_id = ?",
+                (username, candidate_id)
+            ).fetchone()
+        return {} if row is None else json.loads(row[0])
+
+
+_cache: Optional[CandidateCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CandidateCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CandidateCache()
+    return _cache
+
+
+def remember(username: str, candidates: List[CandidateData]) -> None:
+    """
+    アカウントが取得した候補者をキャッシュに登録する (テンプレート差し込み等で再利用)。
+    """
+    get_cache().remember(username, candidates)
+
+
+def template_variables(username: str, candidate_id: int) -> Dict[str, str]:
+    return get_cache().template_variables(username, candidate_id)
@@ -0,0 +1,56 @@
+from typing import Any, Callable, List
+
+from models import CandidateData, CandidatePredicate
+
+OPERATORS = ("eq", "ne", "contains", "not_contains", "in", "gte", "lte")
+
+
+def _contains(actual: Any, expected: Any) -> bool:
+    # past_jobs などリストの項目は、いずれかの要素が部分一致すればよい
+    if isinstance(actual, list):
+        return any(str(expected) in str(item) for item in actual)
+    return str(expected) in str(actual)
+
+
+def _compile_one(predicate: CandidatePredicate) -> Callable[[CandidateData], bool]:
+    if predicate.field not in CandidateData.__fields__:
+        raise ValueError(f"絞り込み条件の項目が不正です: {predicate.field}")
+    if predicate.op not in OPERATORS:
+        raise ValueError(f"絞り込み条件の演算子が不正です: {predicate.op} (使用可能: {', '.join(OPERATORS)})")
+    if predicate.op == "in" and not isinstance(predicate.value, list):
+        raise ValueError(f"in の値はリストで指定してください: {predicate.field}")
+
+    field, op, expected = predicate.field, predicate.op, predicate.value
+
+    def match(candidate: CandidateData) -> bool:
+        actual = getattr(candidate, field)
+        # 値が取れていない項目は ne / not_contains 以外では一致しない扱い
+        if actual is None or actual == []:
+            return op in ("ne", "not_contains")
+        if op == "eq":
+            return actual == expected
+        if op == "ne":
+            return actual != expected
+        if op == "contains":
+            return _contains(actual, expected)
+        if op == "not_contains":
+            return not _contains(actual, expected)
+        if op == "in":
+            return actual in expected
+        try:
+            if op == "gte":
+                return actual >= expected
+            return actual <= expected
+        except TypeError:
+            return False
+
+    return match
+
+
+def compile_predicates(predicates: List[CandidatePredicate]) -> Callable[[CandidateData], bool]:
+    """
+    絞り込み条件を候補者1件ごとの判定関数にまとめる (すべての条件を満たせば True)。
+    条件が不正な場合はページを取得する前に ValueError を送出する。
+    """
+    matchers = [_compile_one(p) for p in predicates]
+    return lambda candidate: all(m(candidate) for m in matchers)
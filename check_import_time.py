@@ -0,0 +1,80 @@
+"""
+main の import 時間の予算チェック (起動時間の劣化を防ぐ。CI などで実行する)
+
+    python check_import_time.py            # 既定の予算 (AMBI_IMPORT_BUDGET_MS)
+    python check_import_time.py --budget-ms 400
+
+- `python -X importtime -c "import main"` を別プロセスで実行し、main の累積 import 時間が予算内か
+- ヘルスチェックに不要な重いモジュール (playwright / aiohttp / bs4) が import 時に読み込まれていないか
+を確認し、違反があれば終了コード 1 を返す。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from typing import List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_BUDGET_MS = float(os.getenv("AMBI_IMPORT_BUDGET_MS", "500"))
+# main の import 時に読み込まれてはいけないモジュール
+DEFERRED_MODULES = ("playwright", "aiohttp", "bs4")
+
+_PROBE = (
+    "import sys; import main; "
+    f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+)
+
+
+def measure(runs: int) -> Tuple[float, List[str]]:
+    """
+    main の累積 import 時間 (ミリ秒、runs 回の最小値) と、読み込まれた重いモジュールを返す
+    """
+    best = None
+    loaded: List[str] = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = {**os.environ, "AMBI_STATE_DB": os.path.join(workdir, "state.sqlite3")}
+        for _ in range(runs):
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", _PROBE],
+                cwd=workdir,
+                env={**env, "PYTHONPATH": REPO_DIR},
+                capture_output=True,
+                text=True,
+                check=True
+            )
+            for line in proc.stderr.splitlines():
+                parts = [p.strip() for p in line.split("|")]
+                if len(parts) == 3 and parts[2] == "main":
+                    cumulative_ms = int(parts[1]) / 1000
+                    best = cumulative_ms if best is None else min(best, cumulative_ms)
+            loaded = [m for m in proc.stdout.strip().split(",") if m]
+    if best is None:
+        raise RuntimeError("import 時間を取得できませんでした")
+    return best, loaded
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="main の import 時間の予算チェック")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3, help="計測回数 (最小値で判定)")
+    args = parser.parse_args()
+
+    elapsed_ms, loaded = measure(args.runs)
+    print(f"import main: {elapsed_ms:.1f}ms (予算 {args.budget_ms:.0f}ms)")
+
+    ok = True
+    if elapsed_ms > args.budget_ms:
+        print("NG: import 時間が予算を超えています")
+        ok = False
+    if loaded:
+        print(f"NG: 起動時に読み込まれるべきでないモジュールが読み込まれています: {loaded}")
+        ok = False
+    if ok:
+        print("OK")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
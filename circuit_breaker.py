@@ -0,0 +1,138 @@
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import metrics
+from retry_policy import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# on: AMBIの障害時に処理を止める / off: 常に通す
+CIRCUIT_MODE = os.getenv("AMBI_CIRCUIT", "on")
+# 連続でこの回数失敗 (通信エラー・429・5xx・遅延) したら遮断する
+CIRCUIT_FAILURES = int(os.getenv("AMBI_CIRCUIT_FAILURES", "5"))
+# 遮断してから試しに1件だけ通すまでの時間 (秒)
+CIRCUIT_OPEN_SEC = float(os.getenv("AMBI_CIRCUIT_OPEN_SEC", "30"))
+# これより遅い応答は失敗とみなす (秒)。ログインはブラウザ操作を含むため別に指定する
+CIRCUIT_SLOW_SEC = float(os.getenv("AMBI_CIRCUIT_SLOW_SEC", "15"))
+CIRCUIT_LOGIN_SLOW_SEC = float(os.getenv("AMBI_CIRCUIT_LOGIN_SLOW_SEC", "60"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 呼び出しの種類 (ログ・エラーメッセージ用の名前)
+LABELS = {"login": "ログイン", "search": "検索", "send": "スカウト送信"}
+
+
+class CircuitBreaker:
+    """
+    AMBIへの呼び出しの種類 (login / search / send) ごとのサーキットブレーカー。
+    - closed: 通常どおり通す。連続 failure_threshold 回失敗したら open にする
+    - open: open_sec の間はAMBIに送らず、即座に CircuitOpenError を送出する
+    - half_open: open_sec 経過後、1件だけ試しに通す。成功すれば closed、失敗すれば再び open
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURES,
+        open_sec: float = CIRCUIT_OPEN_SEC,
+        slow_sec: float = CIRCUIT_SLOW_SEC
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_sec = open_sec
+        self.slow_sec = slow_sec
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probing = False
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        self.state = state
+        metrics.CIRCUIT_TRANSITIONS.inc(circuit=self.name, state=state)
+        if state == OPEN:
+            logger.warning(
+                "AMBIの%sで失敗が続いたため %.0f秒間遮断します (直近のエラー: %s)",
+                LABELS.get(self.name, self.name), self.open_sec, self.last_error
+            )
+        else:
+            logger.info("AMBIの%sの遮断状態: %s", LABELS.get(self.name, self.name), state)
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.open_sec - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        呼び出し前に確認する。遮断中なら CircuitOpenError を送出する。
+        復旧確認のために通す1件であれば True を返す (finish に probe=True で渡す)
+        """
+        if CIRCUIT_MODE != "on" or self.state == CLOSED:
+            return False
+        if self.state == OPEN and self.retry_after() <= 0:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self._probing:
+            # 復旧を確かめるため1件だけ通す
+            self._probing = True
+            return True
+        metrics.CIRCUIT_REJECTIONS.inc(circuit=self.name)
+        wait = max(1, round(self.retry_after()))
+        raise CircuitOpenError(
+            f"AMBIの{LABELS.get(self.name, self.name)}で障害が続いているため、一時的に処理を止めています"
+            f" (約{wait}秒後に再開します)",
+            retry_after=wait
+        )
+
+    def finish(
+        self, ok: Optional[bool], elapsed: float = 0.0, error: Optional[str] = None, probe: bool = False
+    ) -> None:
+        """
+        呼び出し結果を記録する。ok=None は判定しない (中断された等) 場合
+        """
+        if probe:
+            self._probing = False
+        if ok is None:
+            return
+        if ok and elapsed > self.slow_sec:
+            ok, error = False, f"応答遅延 ({elapsed:.1f}秒)"
+        if ok:
+            self.failures = 0
+            self._set_state(CLOSED)
+            return
+        self.failures += 1
+        self.last_error = error
+        if probe or self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after_sec": round(self.retry_after(), 1) if self.state != CLOSED else 0,
+            "last_error": self.last_error,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    呼び出しの種類ごとのサーキットブレーカーを返す (プロセス内で共有)
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        slow_sec = CIRCUIT_LOGIN_SLOW_SEC if name == "login" else CIRCUIT_SLOW_SEC
+        breaker = CircuitBreaker(name, slow_sec=slow_sec)
+        _breakers[name] = breaker
+    return breaker
+
+
+def snapshot() -> Dict[str, Dict[str, object]]:
+    return {name: get_breaker(name).snapshot() for name in LABELS}
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Optional
+
+import metrics
+
+if TYPE_CHECKING:
+    import aiohttp
+    from hybrid_client import AmbiHybridClient
+
+logger = logging.getLogger(__name__)
+
+# 保持するアカウントごとのクライアント数の上限 (超えたら使われていない順に破棄する)
+CLIENT_MAX_TENANTS = max(1, int(os.getenv("AMBI_CLIENT_MAX_TENANTS", "1000")))
+# この時間 (秒) 使われなかったクライアントは破棄する
+CLIENT_IDLE_SEC = float(os.getenv("AMBI_CLIENT_IDLE_SEC", "900"))
+# AMBIへのHTTP接続数の上限 (全アカウント合計、APIサーバの1プロセスあたり)
+HTTP_MAX_CONNECTIONS = max(1, int(os.getenv("AMBI_HTTP_MAX_CONNECTIONS", "64")))
+# 使い終わったHTTP接続を次のリクエストのために残しておく時間 (秒)
+HTTP_KEEPALIVE_SEC = float(os.getenv("AMBI_HTTP_KEEPALIVE_SEC", "30"))
+
+_connector: Optional["aiohttp.TCPConnector"] = None
+_connector_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_connector() -> "aiohttp.TCPConnector":
+    """
+    全アカウントで共有するHTTPコネクタ (接続・DNS解決・TLSセッションを使い回す)。
+    接続数は HTTP_MAX_CONNECTIONS を超えない (超える分は空きを待つ)
+    """
+    global _connector, _connector_loop
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    if _connector is None or _connector.closed or _connector_loop is not loop:
+        _connector = aiohttp.TCPConnector(
+            limit=HTTP_MAX_CONNECTIONS,
+            keepalive_timeout=HTTP_KEEPALIVE_SEC,
+            ttl_dns_cache=300
+        )
+        _connector_loop = loop
+    return _connector
+
+
+async def close_connector() -> None:
+    global _connector
+    if _connector is not None and not _connector.closed:
+        await _connector.close()
+    _connector = None
+
+
+class _Entry:
+    def __init__(self, client: "AmbiHybridClient"):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class ClientRegistry:
+    """
+    アカウント (username) ごとの AmbiHybridClient をリクエスト間で使い回す。
+    Cookie・パスワード・HTTPセッションをアカウントごとに1つだけ持ち、HTTP接続は全アカウントで共有する。
+    - 保持数が max_clients を超えたら、使用中でないものを最後に使われた順 (LRU) に破棄する
+    - idle_sec 使われなかったクライアントはバックグラウンドで破棄する
+    破棄したクライアントはHTTPセッションを閉じ、ログインロック・レートリミッタなどアカウント単位の状態も解放する。
+    使用中のクライアントは破棄しないため、すべて使用中の間は一時的に上限を超えることがある。
+    """
+
+    def __init__(self, max_clients: int = CLIENT_MAX_TENANTS, idle_sec: float = CLIENT_IDLE_SEC):
+        self.max_clients = max(1, max_clients)
+        self.idle_sec = idle_sec
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def lease(self, username: str) -> AsyncIterator["AmbiHybridClient"]:
+        """
+        アカウントのクライアントを借りる (無ければ作る)。with ブロックの間は破棄されない
+        """
+        from hybrid_client import AmbiHybridClient
+
+        entry = self._entries.get(username)
+        if entry is None:
+            entry = _Entry(AmbiHybridClient(username, keep_session=True))
+            self._entries[username] = entry
+        self._entries.move_to_end(username)
+        entry.in_use += 1
+        self._update_gauges()
+        try:
+            await self._evict_over_budget()
+            yield entry.client
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            self._update_gauges()
+
+    def peek(self, username: str) -> Optional["AmbiHybridClient"]:
+        """
+        保持しているクライアントを返す (使用したことにはしない)
+        """
+        entry = self._entries.get(username)
+        return None if entry is None else entry.client
+
+    async def _evict(self, username: str, reason: str) -> None:
+        from hybrid_client import forget_account
+
+        entry = self._entries.pop(username, None)
+        if entry is None:
+            return
+        metrics.CLIENT_EVICTIONS.inc(reason=reason)
+        logger.debug("クライアントを破棄します (%s): %s", reason, username)
+        forget_account(username)
+        await entry.client.close()
+
+    async def _evict_over_budget(self) -> None:
+        over = len(self._entries) - self.max_clients
+        if over <= 0:
+            return
+        # 古い順 (OrderedDict の先頭) から、使用中でないものを破棄する
+        victims = [name for name, entry in self._entries.items() if entry.in_use == 0][:over]
+        for username in victims:
+            await self._evict(username, "lru")
+        self._update_gauges()
+
+    async def evict_idle(self) -> int:
+        now = time.monotonic()
+        victims = [
+            name for name, entry in self._entries.items()
+            if entry.in_use == 0 and now - entry.last_used > self.idle_sec
+        ]
+        for username in victims:
+            await self._evict(username, "idle")
+        self._update_gauges()
+        return len(victims)
+
+    def _update_gauges(self) -> None:
+        metrics.CLIENTS.set(len(self._entries), state="live")
+        metrics.CLIENTS.set(sum(1 for e in self._entries.values() if e.in_use), state="in_use")
+
+    def snapshot(self) -> Dict[str, object]:
+        now = time.monotonic()
+        idle = [now - e.last_used for e in self._entries.values() if e.in_use == 0]
+        return {
+            "tenants": len(self._entries),
+            "in_use": sum(1 for e in self._entries.values() if e.in_use),
+            "max_tenants": self.max_clients,
+            "idle_sec": self.idle_sec,
+            "oldest_idle_sec": round(max(idle), 1) if idle else 0,
+            "http_max_connections": HTTP_MAX_CONNECTIONS,
+            "evictions": {
+                reason: int(metrics.CLIENT_EVICTIONS.value(reason=reason)) for reason in ("lru", "idle")
+            },
+        }
+
+    async def _run(self) -> None:
+        tick = max(1.0, min(60.0, self.idle_sec / 4))
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.warning("クライアントの破棄に失敗しました: %s", e)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        from hybrid_client import forget_account
+
+        entries, self._entries = self._entries, OrderedDict()
+        for username, entry in entries.items():
+            forget_account(username)
+            await entry.client.close()
+        self._update_gauges()
+        await close_connector()
+
+
+_registry: Optional[ClientRegistry] = None
+
+
+def get_registry() -> ClientRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ClientRegistry()
+    return _registry
+
+
+def lease(username: str):
+    """
+    get_registry().lease(username) の省略形
+    """
+    return get_registry().lease(username)
@@ -0,0 +1,202 @@
+import os
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+try:
+    import brotli  # requirements.txt に含む (無い環境では gzip のみ使う)
+except ImportError:
+    brotli = None
+
+# on: APIレスポンスを圧縮する / off: 圧縮しない
+COMPRESSION_MODE = os.getenv("AMBI_COMPRESSION", "on")
+# これより小さいレスポンスは圧縮しない (バイト)
+COMPRESS_MIN_BYTES = int(os.getenv("AMBI_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("AMBI_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("AMBI_BROTLI_QUALITY", "5"))
+
+# 圧縮対象のContent-Type (前方一致)
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+
+def accept_encoding() -> str:
+    """
+    AMBIへのリクエストで提示する Accept-Encoding
+    """
+    return "gzip, deflate, br" if brotli is not None else "gzip, deflate"
+
+
+def decode_body(raw: bytes, content_encoding: Optional[str]) -> bytes:
+    """
+    Content-Encoding に従って応答本文を展開する (aiohttp の自動展開を切っているため)
+    """
+    encoding = (content_encoding or "").strip().lower()
+    if not encoding or encoding == "identity":
+        return raw
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(raw)
+        except zlib.error:
+            # zlib ヘッダ無しの deflate を返すサーバもある
+            return zlib.decompress(raw, -zlib.MAX_WBITS)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(raw)
+    raise ValueError(f"未対応の Content-Encoding: {content_encoding}")
+
+
+def _choose_encoding(accept: str) -> Optional[str]:
+    offered = set()
+    for item in accept.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        offered.add(name.strip().lower())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def _is_compressible(headers: Dict[bytes, bytes]) -> bool:
+    content_type = headers.get(b"content-type", b"").decode("latin-1")
+    return b"content-encoding" not in headers and content_type.startswith(_COMPRESSIBLE_TYPES)
+
+
+def _with_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    """
+    Vary に Accept-Encoding を加える (圧縮する・しないが Accept-Encoding で変わる応答をキャッシュに区別させる)
+    """
+    for i, (key, value) in enumerate(headers):
+        if key == b"vary":
+            if b"accept-encoding" in value.lower() or value.strip() == b"*":
+                return headers
+            return headers[:i] + [(key, value + b", Accept-Encoding")] + headers[i + 1:]
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+
+class _StreamCompressor:
+    """
+    本文を分割して受け取りながら圧縮する
+    """
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._br = None
+            # wbits=31: gzip 形式
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._br is not None:
+            return self._br.process(data)
+        return self._zlib.compress(data)
+
+    def flush(self) -> bytes:
+        if self._br is not None:
+            return self._br.finish()
+        return self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """
+    APIレスポンスを gzip (brotli があれば br) で圧縮するASGIミドルウェア。
+    - クライアントの Accept-Encoding に応じて選び、minimum_size 未満や圧縮済みの応答はそのまま返す
+    - 本文が分割して届く場合も、minimum_size に達した時点から逐次圧縮して流す
+    - 圧縮前後のバイト数を ambi_compression_bytes_total に記録する
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or COMPRESSION_MODE != "on":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for key, value in scope.get("headers", []):
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = _choose_encoding(accept)
+        if encoding is None:
+            async def send_with_vary(message):
+                if message["type"] == "http.response.start" and _is_compressible(dict(message.get("headers", []))):
+                    message = {**message, "headers": _with_vary(list(message.get("headers", [])))}
+                await send(message)
+
+            await self.app(scope, receive, send_with_vary)
+            return
+
+        start_message = None
+        # 圧縮するか判断するまで本文を溜めておく
+        pending: List[bytes] = []
+        pending_size = 0
+        # True になったら以降のメッセージはそのまま流す
+        passthrough = False
+        compressor: Optional[_StreamCompressor] = None
+        original_size = 0
+        sent_size = 0
+
+        async def send_uncompressed() -> None:
+            nonlocal passthrough
+            passthrough = True
+            await send({**start_message, "headers": _with_vary(list(start_message.get("headers", [])))})
+            await send({"type": "http.response.body", "body": b"".join(pending), "more_body": False})
+
+        async def send_wrapper(message):
+            nonlocal start_message, pending_size, passthrough, compressor, original_size, sent_size
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start_message = message
+                if not _is_compressible(dict(message.get("headers", []))):
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                pending.append(body)
+                pending_size += len(body)
+                if pending_size < self.minimum_size:
+                    if not more_body:
+                        await send_uncompressed()
+                    return
+
+                # 圧縮を開始する (長さは事前にわからないため Content-Length は外す)
+                compressor = _StreamCompressor(encoding)
+                headers = [
+                    (k, v) for k, v in start_message.get("headers", [])
+                    if k != b"content-length"
+                ]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                await send({**start_message, "headers": _with_vary(headers)})
+                body = b"".join(pending)
+                pending.clear()
+
+            original_size += len(body)
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.flush()
+            sent_size += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+            if not more_body:
+                metrics.COMPRESSION_BYTES.inc(original_size, direction="response", stage="original")
+                metrics.COMPRESSION_BYTES.inc(sent_size, direction="response", stage="transferred")
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,177 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from typing import Awaitable, Iterable, Optional, TypeVar
+
+import metrics
+from retry_policy import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 1リクエストあたりの処理時間の上限 (秒)。X-Request-Timeout ヘッダで短くできる
+REQUEST_DEADLINE_SEC = float(os.getenv("AMBI_REQUEST_DEADLINE_SEC", "120"))
+# AMBIへの1回のHTTPリクエストのタイムアウト (秒)。残り時間の方が短ければそちらを使う
+UPSTREAM_TIMEOUT_SEC = float(os.getenv("AMBI_UPSTREAM_TIMEOUT_SEC", "30"))
+# 上限に達した後、取得済みの結果を返すなどの後始末を待つ時間 (秒)。過ぎたら処理ごと取り消す
+HARD_STOP_GRACE_SEC = float(os.getenv("AMBI_DEADLINE_GRACE_SEC", "2"))
+
+# 現在の処理の期限 (time.monotonic() の値)。None は期限なし
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("ambi_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """
+    期限までの残り秒数 (期限が無ければ None)
+    """
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def check(what: str) -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"処理時間の上限に達したため中断しました ({what})")
+
+
+def budget(default: float, what: str) -> float:
+    """
+    個々の処理に使ってよい時間 (default と残り時間の短い方)。期限切れなら DeadlineExceeded
+    """
+    check(what)
+    left = remaining()
+    return default if left is None else min(default, left)
+
+
+async def sleep(seconds: float, what: str) -> None:
+    """
+    待っている間に期限を過ぎる場合は、待たずに DeadlineExceeded を送出する
+    """
+    left = remaining()
+    if left is not None and left < seconds:
+        raise DeadlineExceeded(f"処理時間の上限までに待機が終わらないため中断しました ({what})")
+    await asyncio.sleep(seconds)
+
+
+async def wait_for(aw: Awaitable[T], what: str) -> T:
+    """
+    期限までに終わらなければ取り消して DeadlineExceeded を送出する
+    """
+    left = remaining()
+    if left is None:
+        return await aw
+    check(what)
+    try:
+        return await asyncio.wait_for(aw, left)
+    except asyncio.TimeoutError:
+        if (remaining() or 0) <= 0:
+            raise DeadlineExceeded(f"処理時間の上限に達したため中断しました ({what})") from None
+        raise
+
+
+def parse_timeout_header(value: Optional[str]) -> float:
+    """
+    X-Request-Timeout ヘッダ (秒) を解釈する。未指定・不正な値は既定値、既定値より長くはしない
+    """
+    if value:
+        try:
+            seconds = float(value)
+        except ValueError:
+            seconds = 0.0
+        if seconds > 0:
+            return min(seconds, REQUEST_DEADLINE_SEC)
+    return REQUEST_DEADLINE_SEC
+
+
+async def run(aw: Awaitable[T], seconds: float) -> T:
+    """
+    seconds 秒の期限付きで実行する。
+    期限はログイン・トークン取得・各ページの取得・リトライの待ちに引き継がれ、各処理はそれまでに打ち切る。
+    それでも期限から HARD_STOP_GRACE_SEC 秒以内に終わらない場合は、処理ごと取り消す。
+    """
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires_at if current is None else min(current, expires_at))
+    try:
+        # 期限はタスク生成時のコンテキストごと引き継がれる
+        return await asyncio.wait_for(aw, seconds + HARD_STOP_GRACE_SEC)
+    except asyncio.TimeoutError:
+        metrics.CANCELLATIONS.inc(reason="deadline")
+        raise DeadlineExceeded(f"処理時間の上限 ({seconds:g}秒) に達したため中断しました") from None
+    except DeadlineExceeded:
+        metrics.CANCELLATIONS.inc(reason="deadline")
+        raise
+    finally:
+        _deadline.reset(token)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    クライアントが切断したら処理中のリクエストを取り消すASGIミドルウェア (paths で対象を指定)。
+    リクエスト本文を先に読み切り、以降は受信側で切断 (http.disconnect) だけを待つ。
+    取り消されたリクエストのログイン・ページ取得は中断され、ブラウザやHTTPセッションも閉じられる。
+    """
+
+    def __init__(self, app, paths: Iterable[str]):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        body_messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body_messages.append(message)
+            if not message.get("more_body", False):
+                break
+
+        disconnected = asyncio.Event()
+
+        async def replay_receive():
+            if body_messages:
+                return body_messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        response_sent = False
+
+        async def send_wrapper(message):
+            nonlocal response_sent
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        app_task = asyncio.create_task(self.app(scope, replay_receive, send_wrapper))
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await asyncio.wait({app_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            # 応答を送り終えた後の http.disconnect は切断ではない (後処理は最後まで行う)
+            if not app_task.done() and not response_sent:
+                logger.info("クライアントが切断したため処理を中断します: %s", scope["path"])
+                metrics.CANCELLATIONS.inc(reason="disconnect")
+                app_task.cancel()
+            await asyncio.gather(app_task, return_exceptions=True)
+            if not app_task.cancelled() and app_task.exception() is not None:
+                raise app_task.exception()
+        finally:
+            # 自分自身が取り消された場合も、アプリ側の処理を残さない
+            for task in (app_task, watcher):
+                task.cancel()
+            await asyncio.gather(app_task, watcher, return_exceptions=True)
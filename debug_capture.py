@@ -0,0 +1,203 @@
+import abc
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import re
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# off: 保存しない / sample: 一定割合のみ保存 / always: すべて保存
+CAPTURE_MODE = os.getenv("AMBI_DEBUG_CAPTURE", "off")
+CAPTURE_SAMPLE_RATE = float(os.getenv("AMBI_DEBUG_CAPTURE_RATE", "0.01"))
+CAPTURE_DIR = os.getenv("AMBI_DEBUG_CAPTURE_DIR", "debug_captures")
+# 保存ファイル数・合計サイズの上限 (超えたら古いものから削除)
+CAPTURE_MAX_FILES = int(os.getenv("AMBI_DEBUG_CAPTURE_MAX_FILES", "200"))
+CAPTURE_MAX_BYTES = int(os.getenv("AMBI_DEBUG_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024)))
+# 書き込み待ちの上限件数 (溢れた分は破棄し、リクエスト処理は待たせない)
+CAPTURE_QUEUE_SIZE = int(os.getenv("AMBI_DEBUG_CAPTURE_QUEUE_SIZE", "100"))
+
+REDACTED = "***"
+# 値を伏せるヘッダ / パラメータ (小文字で比較)
+SECRET_HEADERS = {"cookie", "set-cookie", "authorization"}
+SECRET_PARAMS = {"c13ct", "accloginid", "accloginpw", "password", "passwd", "pw"}
+# 本文中の hidden トークン
+_SECRET_INPUT = re.compile(r'(name=["\']C13CT["\'][^>]*?value=["\'])[^"\']*(["\'])', re.IGNORECASE)
+
+
+def redact_headers(headers: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        k: (REDACTED if k.lower() in SECRET_HEADERS else str(v))
+        for k, v in headers.items()
+    }
+
+
+def redact_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not params:
+        return {}
+    return {
+        k: (REDACTED if k.lower() in SECRET_PARAMS else v)
+        for k, v in params.items()
+    }
+
+
+def redact_body(body: str) -> str:
+    return _SECRET_INPUT.sub(rf"\g<1>{REDACTED}\g<2>", body)
+
+
+class CaptureSink(abc.ABC):
+    """
+    デバッグ記録の書き込み先。write() は別スレッドから呼ばれる。
+    """
+
+    @abc.abstractmethod
+    def write(self, record: Dict[str, Any]) -> None:
+        ...
+
+
+class FileCaptureSink(CaptureSink):
+    """
+    1件ずつ gzip 圧縮した JSON ファイルとして保存し、件数・合計サイズの上限を超えたら古いものから削除する。
+    """
+
+    def __init__(
+        self,
+        directory: str = CAPTURE_DIR,
+        max_files: int = CAPTURE_MAX_FILES,
+        max_bytes: int = CAPTURE_MAX_BYTES
+    ):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._seq = 0
+
+    def write(self, record: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._seq += 1
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        filename = os.path.join(
+            self.directory,
+            f"{timestamp}_{self._seq:04d}_{record['name']}_{record['status']}.json.gz"
+        )
+        with gzip.open(filename, "wt", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        self._rotate()
+
+    def _rotate(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json.gz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((name, path, os.path.getsize(path)))
+            except OSError:
+                continue
+        # ファイル名がタイムスタンプ始まりなので名前順 = 古い順
+        entries.sort()
+        total = sum(size for _, _, size in entries)
+        while entries and (len(entries) > self.max_files or total > self.max_bytes):
+            _, path, size = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class DebugCapture:
+    """
+    AMBIとのやり取りのデバッグ記録。
+    - mode / sample_rate で記録するかを判定 (off の場合はほぼコストなし)
+    - 秘密情報 (Cookie, パスワード, C13CT) を伏せてからキューに積み、
+      バックグラウンドのタスクが別スレッドで sink に書き込む (イベントループをブロックしない)
+    """
+
+    def __init__(
+        self,
+        mode: str = CAPTURE_MODE,
+        sample_rate: float = CAPTURE_SAMPLE_RATE,
+        sink: Optional[CaptureSink] = None
+    ):
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.sink = sink or FileCaptureSink()
+        self.dropped = 0
+        self._queue: Optional["asyncio.Queue[Dict[str, Any]]"] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def should_capture(self) -> bool:
+        if self.mode == "always":
+            return True
+        if self.mode == "sample":
+            return random.random() < self.sample_rate
+        return False
+
+    def capture(
+        self,
+        name: str,
+        url: str,
+        status: int,
+        request_headers: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        response_headers: Optional[Dict[str, Any]] = None,
+        body: str = ""
+    ) -> None:
+        if not self.should_capture():
+            return
+
+        record = {
+            "name": name,
+            "url": url,
+            "status": status,
+            "captured_at": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "request_headers": redact_headers(request_headers or {}),
+            "params": redact_params(params),
+            "response_headers": redact_headers(response_headers or {}),
+            "body": redact_body(body),
+        }
+
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._writer())
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _writer(self) -> None:
+        while True:
+            record = await self._queue.get()
+            try:
+                await asyncio.to_thread(self.sink.write, record)
+            except Exception as e:
+                logger.warning("デバッグ記録の書き込みに失敗: %s", e)
+            finally:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """
+        書き込み待ちの記録を書き切ってから停止する
+        """
+        if self._queue is not None:
+            await self._queue.join()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_capture = DebugCapture()
+
+
+def get_capture() -> DebugCapture:
+    return _capture
+
+
+def set_capture(capture: DebugCapture) -> None:
+    global _capture
+    _capture = capture
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from models import CandidateDetail
+
+# 候補者詳細のキャッシュも他の状態と同じローカル状態DBに置く (全ワーカープロセスで共有)
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+# 候補者詳細を再利用する期間 (秒)
+DETAIL_CACHE_TTL_SEC = float(os.getenv("AMBI_DETAIL_CACHE_TTL_SEC", "86400"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candidate_details (
+    username     TEXT NOT NULL,
+    candidate_id INTEGER NOT NULL,
+    detail       TEXT NOT NULL,
+    expires_at   REAL NOT NULL,
+    PRIMARY KEY (username, candidate_id)
+);
+"""
+
+
+class DetailCache:
+    """
+    候補者詳細を (アカウント, 候補者ID) ごとに TTL 付きで保存する。
+    同じアカウントで取得した候補者の詳細ページは、有効期限内であれば取得し直さない。
+    アカウントをまたいでは共有しない (呼び出し側はログインに成功してから読むこと)。
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE, ttl: float = DETAIL_CACHE_TTL_SEC):
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # アカウント列の無い旧スキーマはキャッシュなので作り直す
+            columns = [r[1] for r in self._conn.execute("PRAGMA table_info(candidate_details)")]
+            if columns and "username" not in columns:
+                self._conn.execute("DROP TABLE candidate_details")
+            self._conn.executescript(_SCHEMA)
+        self.purge_expired()
+
+    def get_many(self, username: str, candidate_ids: List[int]) -> Dict[int, CandidateDetail]:
+        """
+        アカウントが取得した有効期限内の詳細を {候補者ID: 詳細} で返す (無いものは含まない)
+        """
+        if not candidate_ids:
+            return {}
+        placeholders = ",".join("?" * len(candidate_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT candidate_id, detail FROM candidate_details "
+                f"WHERE username = ? AND candidate_id IN ({placeholders}) AND expires_at > ?",
+                (username, *candidate_ids, time.time())
+            ).fetchall()
+        return {row[0]: CandidateDetail.parse_raw(row[1]) for row in rows}
+
+    def save_many(self, username: str, details: List[CandidateDetail]) -> None:
+        expires_at = time.time() + self.ttl
+        rows = [(username, d.id, d.json(ensure_ascii=False), expires_at) for d in details if d.id is not None]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO candidate_details VALUES (?, ?, ?, ?)", rows)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM candidate_details WHERE expires_at <= ?", (time.time(),))
+        return cur.rowcount
+
+
+_cache: Optional[DetailCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DetailCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DetailCache()
+    return _cache
@@ -1,28 +1,150 @@
-
 import asyncio
 import logging
-from typing import Dict, List, Optional
-import datetime
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from models import AmbiSearchFilter, CandidateData, CandidateDetail
+from models import ScoutMessageRequest, ScoutMessageResponse
+from scraper import extract_candidate_detail_from_html, extract_candidates_from_html
+from candidate_filter import compile_predicates
+from page_planner import plan_pages
+from rate_limiter import forget_limiter, get_limiter, parse_retry_after
+from retry_policy import RetryPolicy, run_step
+from retry_policy import AUTH_EXPIRED, CSRF_REJECTED, TRANSIENT_NETWORK, SERVER_ERROR
+from retry_policy import AmbiError, AuthExpiredError, CsrfRejectedError, UpstreamServerError
+from retry_policy import CircuitOpenError, DeadlineExceeded, ParseError, SendOutcomeUnknown, TransientError
+from retry_policy import CredentialsUnavailableError
+from session_manager import get_store as get_session_store, new_lock_owner
+from debug_capture import get_capture
+from circuit_breaker import get_breaker
+from client_registry import get_connector
+import client_registry
+import detail_cache
+import session_keepalive
+from login_pool import LOGIN_ISOLATION, get_pool as get_login_pool
+from login_worker import LOGIN_STEP_TIMEOUT_SEC, submit_login_form
+import metrics
+import tracing
+import deadline
+from compression import accept_encoding, decode_body
+
+# playwright / aiohttp / bs4 は読み込みが重いので、ヘルスチェックに応答するまでの起動時間を
+# 延ばさないよう使う時点で import する (起動後は prewarm.py がバックグラウンドで読み込む)
+if TYPE_CHECKING:
+    import aiohttp
 
-from playwright.async_api import async_playwright
-import aiohttp
-from bs4 import BeautifulSoup
+logger = logging.getLogger(__name__)
 
-from models import AmbiSearchFilter, CandidateData
-from models import ScoutMessageRequest
-from scraper import extract_candidates_from_html
+# scout_list_message_frame の事前リクエストを実行済みの (アカウント, PHPSESSID, search_id)
+# ログインし直す(PHPSESSIDが変わる) か search_id が変わるまでは再実行しない
+_prepared_scout_frames: "OrderedDict[Tuple[str, str, int], bool]" = OrderedDict()
+_PREPARED_SCOUT_FRAMES_MAX = 10000
+
+
+class UpstreamResponse(NamedTuple):
+    """
+    AMBIへのリクエスト結果 (本文は読み込み済み)
+    """
+    status: int
+    text: str
+    headers: Dict[str, str]
+    url: str
+
+
+class DetailResult(NamedTuple):
+    """
+    候補者詳細の取得結果。取得できなかった候補者は errors に理由を持つ
+    """
+    details: List[CandidateDetail]
+    errors: Dict[int, str]
+    incomplete: Optional[str] = None
+    # details のうちキャッシュから返した件数
+    cached: int = 0
+
+
+class SendTracker:
+    """
+    スカウト送信の状態を呼び出し側 (送信台帳の記録) に伝える。
+    in_doubt: 送信POSTをAMBIに送った後で失敗し、送信されたかどうか分からない
+    (タイムアウト・接続断・5xx・処理時間の上限による取り消しなど)
+    """
+
+    def __init__(self) -> None:
+        self.in_doubt = False
+
+
+class SearchResult(NamedTuple):
+    """
+    検索結果。途中のページで取得に失敗した場合は、取得済みの候補者と失敗理由 (incomplete) を持つ
+    """
+    candidates: List[CandidateData]
+    incomplete: Optional[str] = None
+
+
+def _new_session() -> "aiohttp.ClientSession":
+    import aiohttp
+    # 接続は全アカウントで共有するコネクタから借りる (セッションを閉じてもコネクタは閉じない)。
+    # 圧縮前後のバイト数を計測するため、展開は _request で行う
+    return aiohttp.ClientSession(connector=get_connector(), connector_owner=False, auto_decompress=False)
+
+
+def _soup(html: str):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, "html.parser")
+
+
+# ログイン済みとみなすために必要なCookie
+REQUIRED_COOKIES = ['PHPSESSID', 'C13CC']
+# ほかのワーカーのログイン完了を待つときの確認間隔 (秒)
+LOGIN_LOCK_POLL_SEC = 0.5
+# 検索結果の2ページ目以降を同時に取得するページ数
+SEARCH_PAGE_CONCURRENCY = max(1, int(os.getenv("AMBI_SEARCH_PAGE_CONCURRENCY", "2")))
+# 候補者詳細ページのパス ({id} に候補者IDが入る)
+CANDIDATE_DETAIL_PATH = os.getenv("AMBI_CANDIDATE_DETAIL_PATH", "/company/scout/detail/?SID={id}&PK=3FFFF4")
+# 候補者詳細を同時に取得する件数 (アカウント単位のレート制御の範囲内で並行する)
+DETAIL_CONCURRENCY = max(1, int(os.getenv("AMBI_DETAIL_CONCURRENCY", "4")))
+
+# 同じプロセス内で同じアカウントのログインを直列化するロック
+# (プロセス間は session_manager のログインロックで直列化する)
+_login_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _has_required_cookies(cookies: Optional[Dict[str, str]]) -> bool:
+    return bool(cookies) and all(c in cookies for c in REQUIRED_COOKIES)
+
+
+def forget_account(username: str) -> None:
+    """
+    アカウント単位でプロセス内に持っている状態 (ログインロック・レートリミッタ) を解放する
+    """
+    lock = _login_locks.get(username)
+    if lock is not None and not lock.locked():
+        del _login_locks[username]
+    forget_limiter(username)
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
 
 class AmbiHybridClient:
-    BASE_URL = "https://en-ambi.com"
+    # ローカルのスタンドインサーバ (ambi_standin.py) に向ける場合は AMBI_BASE_URL で上書きする
+    BASE_URL = os.getenv("AMBI_BASE_URL", "https://en-ambi.com").rstrip("/")
     
-    def __init__(self):
+    def __init__(self, username: Optional[str] = None, keep_session: bool = False):
+        # レートリミッタなどアカウント単位の状態のキー (login_with_playwright でもセットされる)
+        self.username = username
+        # True: HTTPセッションを close() まで使い回す (client_registry で管理する場合)
+        self.keep_session = keep_session
+        self._http: Optional["aiohttp.ClientSession"] = None
+        # 再ログイン用 (セッション切れを検知したときのみ使用)
+        self._password: Optional[str] = None
+        # ステップ単位のリトライ設定
+        self.retry_policy = RetryPolicy.from_env()
         # Cookieやヘッダーは後でセット
         self.cookies: Dict[str, str] = {}
         self.headers = {
             'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+            'accept-encoding': accept_encoding(),
             'accept-language': 'ja,en-US;q=0.9,en;q=0.8',
             'cache-control': 'no-cache',
             'content-type': 'application/x-www-form-urlencoded',
@@ -38,52 +160,216 @@ class AmbiHybridClient:
             'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
         }
 
+    @asynccontextmanager
+    async def _session(self) -> AsyncIterator["aiohttp.ClientSession"]:
+        """
+        AMBIへのHTTPセッション。keep_session なら使い回し、そうでなければこの with ブロックの間だけ使う。
+        Cookieは毎回このクライアントの最新のものに入れ替える。
+        """
+        if not self.keep_session:
+            async with _new_session() as session:
+                session.cookie_jar.update_cookies(self.cookies)
+                yield session
+            return
+        if self._http is None or self._http.closed:
+            self._http = _new_session()
+        # 前回の応答で保存されたCookieが、ログインし直した後のCookieと混ざらないようにする
+        self._http.cookie_jar.clear()
+        self._http.cookie_jar.update_cookies(self.cookies)
+        yield self._http
+
+    async def close(self) -> None:
+        """
+        使い回しているHTTPセッションを閉じる (接続自体は共有コネクタに戻る)
+        """
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
+
+    @metrics.timed("login")
+    @tracing.traced("login")
     async def login_with_playwright(self, username: str, password: str) -> bool:
         """
         Playwrightを使用してログインし、重要Cookie (PHPSESSID, C13CCなど) を取得
         """
         LOGIN_URL = f"{self.BASE_URL}/company_login/login/?PK=CC1E9D"
-        logger.info(f"ログインを開始: {LOGIN_URL}")
+        self.username = username
+        logger.info("ログインを開始: %s", LOGIN_URL)
         
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context()
-            page = await context.new_page()
+        # AMBIのログインで障害が続いている間はブラウザを起動せずに失敗させる
+        breaker = get_breaker("login")
+        probe = breaker.allow()
+        healthy: Optional[bool] = None
+        error: Optional[str] = None
+        started = time.monotonic()
+        try:
+            result = await self._login_in_browser(LOGIN_URL, username, password)
+            healthy = True
+            # 再ログイン用のパスワードは、ログインに成功した場合のみ入れ替える
+            self._password = password
+            return result
+        except (DeadlineExceeded, asyncio.CancelledError):
+            raise
+        except TransientError as e:
+            left = deadline.remaining()
+            # 残り時間が尽きたことによるタイムアウトは、AMBIの異常とはみなさない
+            if left is None or left > 1:
+                healthy, error = False, str(e)
+            raise
+        except AmbiError:
+            # 認証情報の誤りなど (AMBI自体は応答している)
+            healthy = True
+            raise
+        finally:
+            breaker.finish(healthy, time.monotonic() - started, error, probe)
+
+    async def _login_in_browser(self, login_url: str, username: str, password: str) -> bool:
+        """
+        ブラウザでログインフォームを送信し、Cookieを取得する。
+        既定ではログイン用のワーカープロセス (login_pool) で行い、AMBI_LOGIN_ISOLATION=inline ならこのプロセスで行う。
+        """
+        try:
+            if LOGIN_ISOLATION == "process":
+                cookies = await get_login_pool().login(login_url, username, password)
+            else:
+                cookies = await self._login_inline(login_url, username, password)
 
-            try:
-                await page.goto(LOGIN_URL)
-                # ログインフォームへの入力
-                await page.fill('input[name="accLoginID"]', username)
-                await page.fill('input[name="accLoginPW"]', password)
-                await page.click('button.loginbtn')
-
-                # ネットワーク待ち + 画面安定化待ち
-                await page.wait_for_load_state("networkidle")
-                await asyncio.sleep(2)
-
-                if "/company_login/login/" in page.url:
-                    raise Exception("ログイン認証に失敗しました")
-
-                # Cookie を取得
-                cookies = await context.cookies()
-                self.cookies = {cookie['name']: cookie['value'] for cookie in cookies}
-
-                # 重要クッキーがちゃんと取れているか確認
-                required_cookies = ['PHPSESSID', 'C13CC']
-                missing_cookies = [c for c in required_cookies if c not in self.cookies]
-                if missing_cookies:
-                    raise Exception(f"必要なクッキーが取得できませんでした: {missing_cookies}")
-
-                logger.info("ログイン成功")
-                return True
+            # 重要クッキーがちゃんと取れているか確認
+            missing_cookies = [c for c in REQUIRED_COOKIES if c not in cookies]
+            if missing_cookies:
+                raise TransientError(f"必要なクッキーが取得できませんでした: {missing_cookies}")
+            self.cookies = cookies
 
-            except Exception as e:
-                logger.error(f"ログインエラー: {str(e)}")
-                raise
+            logger.info("ログイン成功")
+            return True
+
+        except AmbiError as e:
+            logger.error("ログインエラー: %s", e)
+            raise
+
+        except asyncio.CancelledError:
+            logger.info("ログインを中断しました")
+            raise
+
+        except Exception as e:
+            # ブラウザ操作のタイムアウト等は再試行で解決しうる
+            logger.error("ログインエラー: %s", e)
+            raise TransientError(f"ログイン処理に失敗しました: {str(e)}") from e
 
+    async def _login_inline(self, login_url: str, username: str, password: str) -> Dict[str, str]:
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(
+                headless=True, timeout=deadline.budget(LOGIN_STEP_TIMEOUT_SEC, "ブラウザ起動") * 1000
+            )
+            try:
+                context = await browser.new_context()
+                return await submit_login_form(context, login_url, username, password)
             finally:
                 await browser.close()
 
+    @tracing.traced("ensure_login")
+    async def ensure_login(self, username: str, password: str) -> None:
+        """
+        保存済みのCookieがあれば再利用し、無ければPlaywrightでログインする。
+        保存済みのCookieは、ログインに成功したときと同じパスワードが指定された場合のみ再利用する
+        (異なる場合はPlaywrightでログインし、認証に失敗すればこのクライアントの状態は変えない)。
+        Cookieが失効していた場合は、各ステップで AuthExpiredError を検知した時点で relogin() される。
+        使われたアカウントは session_keepalive に登録し、失効する前にバックグラウンドで更新する。
+        """
+        self.username = username
+
+        cookies = await asyncio.to_thread(get_session_store().load_cookies, username, password)
+        if _has_required_cookies(cookies):
+            self.cookies = cookies
+            self._password = password
+            metrics.LOGINS.inc(result="reused")
+            logger.info("保存済みのCookieを再利用します")
+        else:
+            await self.relogin(password)
+
+        # 以降はリクエストの合間もバックグラウンドでセッションを維持する
+        session_keepalive.track(username, password)
+
+    async def resume_session(self, username: str, password_hash: str) -> None:
+        """
+        パスワードを保持していない処理 (再起動後に引き継いだ一括送信ジョブ) のために、
+        password_hash のパスワードでのログインで保存されたCookieを使う。
+        使えるCookieが無い場合や、セッション切れで再ログインが必要になった場合は CredentialsUnavailableError。
+        """
+        self.username = username
+        cookies = await asyncio.to_thread(get_session_store().load_cookies_by_hash, username, password_hash)
+        if not _has_required_cookies(cookies):
+            raise CredentialsUnavailableError("再開に使える保存済みのログインセッションがありません")
+        self.cookies = cookies
+        metrics.LOGINS.inc(result="reused")
+        logger.info("保存済みのCookieでジョブを再開します")
+
+    @tracing.traced("relogin")
+    async def relogin(self, password: Optional[str] = None) -> None:
+        """
+        Playwrightでログインし直し、取得したCookieを保存する。
+        password を省略した場合は、前回ログインに成功したパスワードを使う。
+        ログイン自体も一時的な失敗 (タイムアウト等) であれば再試行する。
+        同じアカウントのログインはプロセス内・ワーカープロセス間で1つずつ行い、
+        待っている間にほかのワーカーが同じパスワードでログインし直していれば、そのCookieを使う (ログインはしない)。
+        """
+        password = self._password if password is None else password
+        if self.username is None or password is None:
+            raise CredentialsUnavailableError("再ログインに必要な認証情報がありません")
+
+        # 失効したとみなすセッション (これ以外のCookieが保存されていれば、ほかで再ログイン済み)
+        stale_session = self.cookies.get("PHPSESSID")
+        store = get_session_store()
+        owner = new_lock_owner()
+
+        local_lock = _login_locks.setdefault(self.username, asyncio.Lock())
+        async with local_lock:
+            with tracing.span("login_lock_wait"):
+                while not await asyncio.to_thread(store.try_lock_login, self.username, owner):
+                    await deadline.sleep(LOGIN_LOCK_POLL_SEC, "ほかの処理のログイン待ち")
+            try:
+                cookies = await asyncio.to_thread(store.load_cookies, self.username, password)
+                if _has_required_cookies(cookies) and cookies.get("PHPSESSID") != stale_session:
+                    self.cookies = cookies
+                    self._password = password
+                    metrics.LOGINS.inc(result="shared")
+                    logger.info("ほかの処理で再ログイン済みのCookieを使います")
+                    return
+
+                await run_step(
+                    "ログイン",
+                    lambda: self.login_with_playwright(self.username, password),
+                    RetryPolicy.from_env(retry_on=frozenset({TRANSIENT_NETWORK, SERVER_ERROR}))
+                )
+                metrics.LOGINS.inc(result="login")
+                await asyncio.to_thread(store.save_cookies, self.username, self.cookies, password)
+            finally:
+                await asyncio.to_thread(store.unlock_login, self.username, owner)
+
+    def _cookie_header(self) -> str:
+        return "; ".join([f"{k}={v}" for k, v in self.cookies.items()])
+
+    def _check_response(self, resp: UpstreamResponse, what: str) -> None:
+        """
+        応答を確認し、失敗であれば分類済みの例外として送出する。
+        - ログイン画面へのリダイレクト / 401: セッション切れ
+        - 403 / 419: CSRFトークン(C13CT)の拒否
+        - 429 / 5xx: AMBI側の一時的なエラー
+        """
+        if "/company_login/login/" in resp.url:
+            raise AuthExpiredError(f"{what}: セッションが切れています (ログイン画面へリダイレクト)")
+        if resp.status == 200:
+            return
+        if resp.status == 401:
+            raise AuthExpiredError(f"{what}: status={resp.status}")
+        if resp.status in (403, 419):
+            raise CsrfRejectedError(f"{what}: status={resp.status}")
+        if resp.status == 429 or resp.status >= 500:
+            raise UpstreamServerError(f"{what}: status={resp.status}")
+        raise AmbiError(f"{what}: status={resp.status}")
+
     def _build_search_params(self, filters: AmbiSearchFilter) -> Dict[str, str]:
         """
         検索パラメータの構築。
@@ -177,55 +463,161 @@ class AmbiHybridClient:
         
         return params
 
+    async def _request(
+        self,
+        session: "aiohttp.ClientSession",
+        method: str,
+        url: str,
+        headers: Dict[str, str],
+        data: Optional[Dict] = None,
+        allow_redirects: bool = True,
+        circuit: str = "search",
+        on_dispatch: Optional[Callable[[], None]] = None
+    ) -> UpstreamResponse:
+        """
+        AMBIへのリクエスト共通処理。
+        呼び出しの種類 (circuit: search / send) ごとのサーキットブレーカーで、AMBIの障害中は送らずに失敗させる。
+        アカウント単位のレートリミッタでペースを制御し、応答ステータスと所要時間をフィードバックする。
+        on_dispatch はリクエストを実際に送る直前に呼ばれる (これより前の失敗ではAMBIに何も送っていない)。
+        """
+        import aiohttp
+
+        breaker = get_breaker(circuit)
+        probe = breaker.allow()
+        # サーキットブレーカーへの結果 (None: AMBIの状態とは無関係な中断)
+        healthy: Optional[bool] = None
+        error: Optional[str] = None
+        started = time.monotonic()
+        try:
+            limiter = get_limiter(self.username or "")
+            with tracing.span("rate_limit_wait"):
+                await deadline.wait_for(limiter.acquire(), "レート制御の待ち")
+
+            # 1回のリクエストはリクエスト全体の残り時間を超えて待たない
+            timeout = aiohttp.ClientTimeout(total=deadline.budget(deadline.UPSTREAM_TIMEOUT_SEC, url.split("?", 1)[0]))
+            started = time.monotonic()
+            with tracing.span("http", method=method, url=url.split("?", 1)[0]) as http_span:
+                if on_dispatch is not None:
+                    on_dispatch()
+                try:
+                    async with session.request(
+                        method, url, data=data, headers=headers, allow_redirects=allow_redirects, timeout=timeout
+                    ) as response:
+                        raw = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    limiter.record(None, time.monotonic() - started)
+                    metrics.UPSTREAM_RESPONSES.inc(method=method, status="error")
+                    # 残り時間に合わせて短くしたタイムアウトは、AMBIの異常とはみなさない
+                    if not (isinstance(e, asyncio.TimeoutError) and timeout.total < deadline.UPSTREAM_TIMEOUT_SEC):
+                        healthy, error = False, f"{type(e).__name__}: {e}"
+                    raise
+                healthy = response.status < 500 and response.status != 429
+                if not healthy:
+                    error = f"status={response.status}"
+                content_encoding = response.headers.get("Content-Encoding")
+                try:
+                    body = decode_body(raw, content_encoding)
+                except Exception as e:
+                    limiter.record(response.status, time.monotonic() - started)
+                    raise TransientError(f"応答の展開に失敗しました ({content_encoding}): {str(e)}") from e
+                text = body.decode(response.charset or "utf-8", errors="replace")
+                if http_span is not None:
+                    http_span.set_attribute("status", response.status)
+                    http_span.set_attribute("bytes", len(raw))
+                    http_span.set_attribute("encoding", content_encoding or "identity")
+        finally:
+            breaker.finish(healthy, time.monotonic() - started, error, probe)
+
+        limiter.record(
+            response.status,
+            time.monotonic() - started,
+            retry_after=parse_retry_after(response.headers.get("Retry-After"))
+        )
+        metrics.UPSTREAM_RESPONSES.inc(method=method, status=str(response.status))
+        metrics.UPSTREAM_BYTES.inc(len(raw), method=method)
+        if content_encoding:
+            metrics.COMPRESSION_BYTES.inc(len(body), direction="upstream", stage="original")
+            metrics.COMPRESSION_BYTES.inc(len(raw), direction="upstream", stage="transferred")
+        return UpstreamResponse(
+            status=response.status,
+            text=text,
+            headers=dict(response.headers),
+            url=str(response.url)
+        )
+
+    @metrics.timed("search_page")
+    @tracing.traced("search_page")
     async def _post_search(
         self,
-        session: aiohttp.ClientSession,
+        session: "aiohttp.ClientSession",
         url: str,
         params: Dict[str, str],
         headers: Dict[str, str],
-        save_filename_prefix: str
+        capture_name: str
     ) -> str:
         """
         与えられたparamsをPOSTしてHTMLを取得する共通関数
         """
-        async with session.post(url, data=params, headers=headers, allow_redirects=True) as response:
-            text = await response.text()
-            status_code = response.status
-
-            # デバッグ用にレスポンスを保存
-            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{save_filename_prefix}_{status_code}_{timestamp}.html"
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(f"URL: {url}\n")
-                f.write(f"Status: {status_code}\n")
-                f.write("Request Headers:\n")
-                for k, v in headers.items():
-                    f.write(f"{k}: {v}\n")
-                f.write("\nRequest Params:\n")
-                f.write(str(params))
-                f.write("\nResponse Headers:\n")
-                for k, v in response.headers.items():
-                    f.write(f"{k}: {v}\n")
-                f.write("\nBody:\n")
-                f.write(text)
-
-            logger.info(f"レスポンス保存: {filename}")
-            if status_code != 200:
-                raise Exception(f"検索失敗: status={status_code}, url={url}")
-
-            return text
-
-    async def search_candidates(self, filters: AmbiSearchFilter) -> List[CandidateData]:
+        page_span = tracing.current_span()
+        if page_span is not None:
+            page_span.set_attribute("per_page", params.get("per_page", "0"))
+
+        response = await self._request(session, "POST", url, headers=headers, data=params)
+
+        # デバッグ用にレスポンスを記録 (AMBI_DEBUG_CAPTURE で有効化、秘密情報は伏せて非同期に保存)
+        get_capture().capture(
+            capture_name,
+            url=url,
+            status=response.status,
+            request_headers=headers,
+            params=params,
+            response_headers=response.headers,
+            body=response.text
+        )
+
+        self._check_response(response, f"検索失敗: url={url}")
+        metrics.SEARCH_PAGES.inc()
+
+        return response.text
+
+    @metrics.timed("parse")
+    @tracing.traced("parse")
+    def _parse_candidates(self, html: str) -> List[CandidateData]:
+        try:
+            candidates = extract_candidates_from_html(html)
+        except Exception as e:
+            raise ParseError(f"検索結果の解析に失敗しました: {str(e)}") from e
+        metrics.CANDIDATES.inc(len(candidates))
+        parse_span = tracing.current_span()
+        if parse_span is not None:
+            parse_span.set_attribute("candidates", len(candidates))
+        return candidates
+
+    @tracing.traced("search_candidates")
+    async def search_candidates(self, filters: AmbiSearchFilter) -> SearchResult:
         """
         1) index画面へGET→ hiddenトークン(C13CT)取得
         2) 1ページ目のPOST送信→HTML取得
-        3) ページ下部のリンク(href=?per_page=50...)を解析
-        4) fetch_all_pages=True or max_pages指定に応じて 2ページ目以降を繰り返し取得
+        3) ヒット件数と1ページの件数から全ページのオフセットを算出 (ページ下部のリンクと突き合わせ)
+        4) fetch_all_pages=True or max_pages指定に応じて 2ページ目以降を並行して取得
         5) すべてのページのCandidateDataを結合して返却
+
+        local_filters はページを解析するたびに適用し、条件を満たす候補者だけを残す。
+        limit を指定した場合は、条件を満たす候補者が limit 件に達した時点で残りのページは取得しない。
+
+        各ステップは失敗したステップだけを再試行する (取得済みのページは保持)。
+        - セッション切れ: 再ログイン → トークン再取得 → 同じページを再取得
+        - CSRF拒否: トークン再取得 → 同じページを再取得
+        - 通信エラー/5xx/解析失敗: バックオフ後に同じページを再取得
+        2ページ目以降が再試行しても取得できない場合は、取得済みの結果を incomplete 付きで返す。
         """
         index_url = f"{self.BASE_URL}/company/scout/index/action/?PK=3FFFF4"
         search_url = f"{self.BASE_URL}/company/scout/search_list/?PK=3FFFF4"
 
+        # 手元での絞り込み条件 (不正な条件はページを取得する前にエラーにする)
+        matches = compile_predicates(filters.local_filters)
+        limit = filters.limit if filters.limit and filters.limit > 0 else None
+
         # ベースパラメータ (フォーム)
         base_params = self._build_search_params(filters)
 
@@ -248,100 +640,251 @@ class AmbiHybridClient:
             'isSendMail': '',
         }
 
-        # HTTP セッションとヘッダー
-        headers = {
-            **self.headers,
-            'referer': index_url,
-            'cookie': '; '.join([f"{k}={v}" for k, v in self.cookies.items()]),
-        }
+        # HTTP ヘッダー (再ログインでCookieが変わるため都度組み立てる)
+        def build_headers() -> Dict[str, str]:
+            return {
+                **self.headers,
+                'referer': index_url,
+                'cookie': self._cookie_header(),
+            }
 
         all_candidates: List[CandidateData] = []
+        search_span = tracing.current_span()
+
+        def accept(page_candidates: List[CandidateData]) -> bool:
+            """
+            1ページ分の候補者を絞り込んで結果に加える。limit に達したら True
+            """
+            matched = [c for c in page_candidates if matches(c)]
+            metrics.CANDIDATES_FILTERED.inc(len(page_candidates) - len(matched))
+            all_candidates.extend(matched)
+            if limit is not None and len(all_candidates) >= limit:
+                del all_candidates[limit:]
+                if search_span is not None:
+                    search_span.set_attribute("stopped_by_limit", True)
+                return True
+            return False
 
-        async with aiohttp.ClientSession() as session:
-            session.cookie_jar.update_cookies(self.cookies)
+        async with self._session() as session:
 
-            # (A) index画面でCSRFトークン取得
-            async with session.get(index_url, headers=headers) as index_resp:
-                index_html = await index_resp.text()
-                if index_resp.status != 200:
-                    raise Exception("検索画面へのアクセスに失敗")
+            async def load_token() -> None:
+                extended_params['C13CT'] = await self._get_c13ct_token(session)
 
-            soup = BeautifulSoup(index_html, 'html.parser')
-            c13ct_input = soup.find('input', {'name': 'C13CT'})
-            if not c13ct_input or not c13ct_input.has_attr('value'):
-                raise Exception("CSRFトークン(C13CT)を取得できませんでした")
-            extended_params['C13CT'] = c13ct_input['value']
+            async def refresh_token() -> None:
+                # 拒否されたトークンは共有キャッシュにあっても使わずに取り直す
+                extended_params['C13CT'] = await self._get_c13ct_token(session, force=True)
 
-            # (B) 1ページ目をPOST
-            first_page_html = await self._post_search(
-                session=session,
-                url=search_url,
-                params=extended_params,
-                headers=headers,
-                save_filename_prefix="response_first_page"
+            async def relogin() -> None:
+                await self.relogin()
+                session.cookie_jar.update_cookies(self.cookies)
+
+            async def relogin_and_refresh_token() -> None:
+                await relogin()
+                await refresh_token()
+
+            page_recover = {
+                AUTH_EXPIRED: relogin_and_refresh_token,
+                CSRF_REJECTED: refresh_token,
+            }
+
+            async def fetch_page(url: str, extra: Dict[str, str], capture_name: str) -> List[CandidateData]:
+                # 再試行時は最新のトークンで送り直す
+                html = await self._post_search(
+                    session=session,
+                    url=url,
+                    params={**extended_params, **extra},
+                    headers=build_headers(),
+                    capture_name=capture_name
+                )
+                nonlocal last_html
+                last_html = html
+                deadline.check("検索結果の解析")
+                return self._parse_candidates(html)
+
+            last_html = ""
+
+            # (A) CSRFトークン取得 (共有キャッシュに無ければindex画面から)
+            await run_step(
+                "C13CTトークン取得", load_token, self.retry_policy, {AUTH_EXPIRED: relogin}
             )
 
-            candidates_page1 = extract_candidates_from_html(first_page_html)
-            all_candidates.extend(candidates_page1)
+            # (B) 1ページ目をPOST
+            candidates_page1 = await run_step(
+                "1ページ目の取得",
+                lambda: fetch_page(search_url, {}, "response_first_page"),
+                self.retry_policy,
+                page_recover
+            )
+            first_page_html = last_html
+            if accept(candidates_page1):
+                logger.info("条件を満たす候補者が上限 (%d件) に達したため、1ページ目で終了します", limit)
+                return SearchResult(all_candidates)
 
             # ページネーションが不要ならここで終了
             if (not filters.fetch_all_pages) and (filters.max_pages is None or filters.max_pages <= 1):
-                return all_candidates
-
-            # (C) 1ページ目のHTMLから、ページ下のリンクに含まれる per_page= の値を解析
-            soup_1st = BeautifulSoup(first_page_html, 'html.parser')
-            page_links = soup_1st.select("ul.pageList li a.link")
+                return SearchResult(all_candidates)
 
-            offsets = []
-            for link in page_links:
-                href = link.get("href", "")
-                if "per_page=" in href:
-                    import re
-                    m = re.search(r"per_page=(\d+)", href)
-                    if m:
-                        val = int(m.group(1))
-                        if val > 0:
-                            offsets.append(val)
-
-            offsets = sorted(set(offsets))
+            # (C) 1ページ目のヒット件数から、取得する全ページのオフセットを算出 (ページリンクと突き合わせ)
+            plan = plan_pages(_soup(first_page_html), len(candidates_page1))
+            if search_span is not None:
+                search_span.set_attribute("total_hits", plan.total)
+                search_span.set_attribute("planned_pages", len(plan.offsets) + 1)
+                search_span.set_attribute("plan_source", plan.source)
 
+            offsets = plan.offsets
             if not offsets:
-                logger.info("2ページ目以降のリンクが見当たらなかったため終了")
-                return all_candidates
+                logger.info("2ページ目以降が無いため終了")
+                return SearchResult(all_candidates)
 
-            current_page = 1
             if not filters.fetch_all_pages and filters.max_pages:
                 needed_pages_count = filters.max_pages - 1  # 1ページ目は取得済
                 offsets = offsets[:needed_pages_count]
 
-            for offset in offsets:
-                current_page += 1
-                logger.info(f"=== {current_page}ページ目を取得します (per_page={offset}) ===")
+            async def fetch_numbered(page_no: int, offset: int) -> List[CandidateData]:
+                logger.info("=== %dページ目を取得します (per_page=%d) ===", page_no, offset)
+                return await run_step(
+                    f"{page_no}ページ目の取得",
+                    lambda: fetch_page(
+                        f"{search_url}&per_page={offset}",
+                        {'per_page': str(offset)},
+                        f"response_page{page_no}"
+                    ),
+                    self.retry_policy,
+                    page_recover
+                )
+
+            # (D) 2ページ目以降は SEARCH_PAGE_CONCURRENCY ページずつ先行して取得し、ページ順に結合する
+            # (実際の送信間隔はアカウント単位のレートリミッタが制御する)
+            planned = iter(enumerate(offsets, start=2))
+            in_flight: "Deque[Tuple[int, asyncio.Task]]" = deque()
 
-                page_url = f"{search_url}&per_page={offset}"
-                page_params = {
-                    **extended_params,
-                    'per_page': str(offset)
-                }
+            def schedule() -> None:
+                while len(in_flight) < SEARCH_PAGE_CONCURRENCY:
+                    item = next(planned, None)
+                    if item is None:
+                        return
+                    page_no, offset = item
+                    in_flight.append((page_no, asyncio.create_task(fetch_numbered(page_no, offset))))
 
-                page_html = await self._post_search(
-                    session=session,
-                    url=page_url,
-                    params=page_params,
-                    headers=headers,
-                    save_filename_prefix=f"response_page{current_page}"
-                )
+            try:
+                schedule()
+                while in_flight:
+                    current_page, task = in_flight.popleft()
+                    try:
+                        page_candidates = await task
+                    except DeadlineExceeded as e:
+                        # 処理時間の上限に達した場合も、取得済みのページは返す
+                        logger.warning("%dページ目の取得前に処理時間の上限に達しました: %s", current_page, e)
+                        return SearchResult(
+                            all_candidates,
+                            incomplete=f"処理時間の上限に達したため、{current_page}ページ目以降は取得していません"
+                        )
+                    except Exception as e:
+                        # 取得済みのページは捨てずに返す
+                        logger.error("%dページ目の取得に失敗したため、取得済みの結果を返します: %s", current_page, e)
+                        return SearchResult(
+                            all_candidates,
+                            incomplete=f"{current_page}ページ目以降の取得に失敗しました"
+                        )
+
+                    if not page_candidates:
+                        logger.info("%dページ目に候補者が見つからないため終了します。", current_page)
+                        break
+                    if accept(page_candidates):
+                        logger.info(
+                            "条件を満たす候補者が上限 (%d件) に達したため、%dページ目で終了します", limit, current_page
+                        )
+                        break
+                    schedule()
+            finally:
+                # 打ち切った場合、先行して取得中のページは取り消す
+                for _, task in in_flight:
+                    task.cancel()
+                await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
 
-                page_candidates = extract_candidates_from_html(page_html)
-                if not page_candidates:
-                    logger.info(f"{current_page}ページ目に候補者が見つからないため終了します。")
-                    break
-                all_candidates.extend(page_candidates)
-                await asyncio.sleep(1)
+        return SearchResult(all_candidates)
 
-        return all_candidates
+    @metrics.timed("candidate_detail")
+    @tracing.traced("candidate_detail")
+    async def _fetch_candidate_detail(self, session: "aiohttp.ClientSession", candidate_id: int) -> CandidateDetail:
+        url = self.BASE_URL + CANDIDATE_DETAIL_PATH.format(id=candidate_id)
+        headers = {
+            **self.headers,
+            "cookie": self._cookie_header(),
+            "referer": f"{self.BASE_URL}/company/scout/search_list/?PK=3FFFF4",
+        }
+        response = await self._request(session, "GET", url, headers=headers)
+
+        get_capture().capture(
+            "candidate_detail",
+            url=url,
+            status=response.status,
+            request_headers=headers,
+            params={},
+            response_headers=response.headers,
+            body=response.text
+        )
+        self._check_response(response, f"候補者詳細の取得失敗: id={candidate_id}")
+
+        deadline.check("候補者詳細の解析")
+        try:
+            detail = extract_candidate_detail_from_html(response.text)
+        except Exception as e:
+            raise ParseError(f"候補者詳細の解析に失敗しました (id={candidate_id}): {str(e)}") from e
+        if detail.id is None:
+            detail.id = candidate_id
+        return detail
+
+    @tracing.traced("candidate_details")
+    async def fetch_candidate_details(self, candidate_ids: List[int]) -> DetailResult:
+        """
+        候補者詳細ページを DETAIL_CONCURRENCY 件ずつ並行して取得する (順序は candidate_ids のとおり)。
+        失敗した候補者は errors に理由を入れて残りは続ける。
+        処理時間の上限に達したら、取得済みの詳細と incomplete (未取得の理由) を返す。
+        """
+        semaphore = asyncio.Semaphore(DETAIL_CONCURRENCY)
+        details: Dict[int, CandidateDetail] = {}
+        errors: Dict[int, str] = {}
+        incomplete: Optional[str] = None
+
+        async with self._session() as session:
+            async def relogin() -> None:
+                await self.relogin()
+                session.cookie_jar.update_cookies(self.cookies)
+
+            async def fetch_one(candidate_id: int) -> None:
+                nonlocal incomplete
+                async with semaphore:
+                    if incomplete is not None:
+                        errors[candidate_id] = incomplete
+                        return
+                    try:
+                        details[candidate_id] = await run_step(
+                            f"候補者詳細の取得 (id={candidate_id})",
+                            lambda: self._fetch_candidate_detail(session, candidate_id),
+                            self.retry_policy,
+                            {AUTH_EXPIRED: relogin}
+                        )
+                    except DeadlineExceeded:
+                        incomplete = "処理時間の上限に達したため取得していません"
+                        errors[candidate_id] = incomplete
+                    except CircuitOpenError as e:
+                        errors[candidate_id] = str(e)
+                    except Exception as e:
+                        logger.warning("候補者詳細を取得できませんでした (id=%d): %s", candidate_id, e)
+                        errors[candidate_id] = str(e)
+
+            await asyncio.gather(*(fetch_one(candidate_id) for candidate_id in candidate_ids))
+
+        return DetailResult(
+            [details[c] for c in candidate_ids if c in details],
+            errors,
+            incomplete
+        )
 
     # ============== 追加: cURL相当の事前POST関数 ==============
+    @metrics.timed("scout_list_frame")
+    @tracing.traced("scout_list_frame")
     async def fetch_scout_list_frame(
         self,
         SID: int,
@@ -357,12 +900,11 @@ class AmbiHybridClient:
         """
         url = f"{self.BASE_URL}/company/api/scout_list_message_frame/index/scoutfolder/?sendpage={sendpage}&SearchID={search_id}"
 
-        async with aiohttp.ClientSession() as session:
-            session.cookie_jar.update_cookies(self.cookies)
+        async with self._session() as session:
 
             # CSRFトークンが指定されていなければ取得
             if not c13ct:
-                c13ct = await self._get_c13ct_token(session)
+                c13ct = await self._get_c13ct_token(session, circuit="send")
 
             post_data = {
                 "SID": str(SID),
@@ -371,54 +913,126 @@ class AmbiHybridClient:
             # XHRと同等のヘッダ追加
             headers = {
                 **self.headers,
-                "cookie": "; ".join([f"{k}={v}" for k, v in self.cookies.items()]),
+                "cookie": self._cookie_header(),
                 "x-requested-with": "XMLHttpRequest",
                 "referer": f"{self.BASE_URL}/company/scout/folder/?SearchID={search_id}&PK=CC1E9D"
             }
 
-            async with session.post(url, data=post_data, headers=headers) as resp:
-                text = await resp.text()
-                if resp.status != 200:
-                    raise Exception(
-                        f"fetch_scout_list_frame 失敗: status={resp.status}, url={url}"
-                    )
-                # 必要に応じてログ保存や解析
-                return text
+            resp = await self._request(session, "POST", url, headers=headers, data=post_data, circuit="send")
+            self._check_response(resp, f"fetch_scout_list_frame 失敗: url={url}")
+            # 必要に応じてログ保存や解析
+            return resp.text
+
+    async def prepare_scout_list_frame(self, SID: int, search_id: int) -> bool:
+        """
+        fetch_scout_list_frame() をログインセッション × search_id ごとに1回だけ実行する。
+        同じセッション・同じ search_id で実行済みなら何もしない。
+        戻り値: 実際に事前リクエストを送った場合 True
+        """
+        key = (self.username or "", self.cookies.get("PHPSESSID", ""), search_id)
+        if key in _prepared_scout_frames:
+            logger.debug("事前リクエストは実行済みのためスキップ: search_id=%s", search_id)
+            return False
+
+        await self.fetch_scout_list_frame(SID=SID, search_id=search_id)
+
+        _prepared_scout_frames[key] = True
+        while len(_prepared_scout_frames) > _PREPARED_SCOUT_FRAMES_MAX:
+            _prepared_scout_frames.popitem(last=False)
+        return True
+
+    async def _get_c13ct_token(
+        self,
+        session: "aiohttp.ClientSession",
+        force: bool = False,
+        circuit: str = "search"
+    ) -> str:
+        """
+        C13CTトークンを返す。同じログインセッションのトークンが共有キャッシュにあれば再利用し、
+        無ければ (または force=True なら) index画面から取得してキャッシュする。
+        circuit は取得に使うサーキットブレーカー (送信のためのトークンは send)。
+        """
+        store = get_session_store()
+        username = self.username or ""
+        phpsessid = self.cookies.get("PHPSESSID", "")
+        if not force:
+            token = await asyncio.to_thread(store.load_token, username, phpsessid)
+            if token:
+                metrics.TOKEN_CACHE.inc(result="hit")
+                return token
+        metrics.TOKEN_CACHE.inc(result="miss")
+
+        token = await self._fetch_c13ct_token(session, circuit)
+        await asyncio.to_thread(store.save_token, username, phpsessid, token)
+        return token
+
+    @metrics.timed("keepalive")
+    @tracing.traced("keepalive")
+    async def refresh_session(self) -> None:
+        """
+        セッション維持用: index画面へアクセスしてセッションを延長し、C13CTトークンを取り直して共有キャッシュに置く。
+        セッションが切れていれば AuthExpiredError。応答でCookieが更新されていれば保存する。
+        """
+        async with self._session() as session:
+            await self._get_c13ct_token(session, force=True)
+            rotated = {
+                cookie.key: cookie.value for cookie in session.cookie_jar
+                if cookie.value and self.cookies.get(cookie.key) != cookie.value
+            }
+        if rotated:
+            self.cookies.update(rotated)
+            await asyncio.to_thread(get_session_store().save_cookies, self.username, self.cookies)
+
+    async def invalidate_token(self) -> None:
+        """
+        拒否されたC13CTトークンを共有キャッシュから削除する
+        """
+        await asyncio.to_thread(
+            get_session_store().invalidate_token, self.username or "", self.cookies.get("PHPSESSID", "")
+        )
 
-    async def _get_c13ct_token(self, session: aiohttp.ClientSession) -> str:
+    @metrics.timed("c13ct_token")
+    @tracing.traced("c13ct_token")
+    async def _fetch_c13ct_token(self, session: "aiohttp.ClientSession", circuit: str = "search") -> str:
         """
-        スカウト送信時などに必要なC13CTトークンを再取得。
+        スカウト送信時などに必要なC13CTトークンをindex画面から取得。
         """
         index_url = f"{self.BASE_URL}/company/scout/index/action/?PK=3FFFF4"
         headers = {
             **self.headers,
-            "cookie": "; ".join([f"{k}={v}" for k,v in self.cookies.items()]),
+            "cookie": self._cookie_header(),
             "referer": f"{self.BASE_URL}/company_login/login/",
         }
-        async with session.get(index_url, headers=headers) as resp:
-            if resp.status != 200:
-                raise Exception("C13CTトークン取得ページへのアクセスに失敗")
-
-            html = await resp.text()
-            soup = BeautifulSoup(html, "html.parser")
-            c13ct_input = soup.find('input', {'name': 'C13CT'})
-            if not c13ct_input or not c13ct_input.has_attr("value"):
-                raise Exception("CSRFトークン(C13CT)を取得できませんでした")
-            return c13ct_input["value"]
-
-    async def send_scout_message(self, request: ScoutMessageRequest) -> bool:
+        resp = await self._request(session, "GET", index_url, headers=headers, circuit=circuit)
+        self._check_response(resp, "C13CTトークン取得ページへのアクセスに失敗")
+
+        soup = _soup(resp.text)
+        c13ct_input = soup.find('input', {'name': 'C13CT'})
+        if not c13ct_input or not c13ct_input.has_attr("value"):
+            # ログインしていない状態の画面にはトークンが無い
+            raise AuthExpiredError("CSRFトークン(C13CT)を取得できませんでした")
+        return c13ct_input["value"]
+
+    @metrics.timed("scout_send")
+    @tracing.traced("scout_send")
+    async def send_scout_message(self, request: ScoutMessageRequest, tracker: Optional[SendTracker] = None) -> bool:
         """
         スカウトメッセージ送信処理
         - 事前に login_with_playwright() で cookies を取得しておく前提。
         - 内部で C13CT (CSRFトークン) を再取得し、POST を投げる。
+        - 送信POSTを送った後で結果が分からなくなった場合は tracker.in_doubt を立てたままにする
+          (5xx は SendOutcomeUnknown、タイムアウト・接続断などはその例外を送出する)。
         """
         url = f"{self.BASE_URL}/company/api/scout_send/run"
+        tracker = tracker or SendTracker()
+
+        def dispatched() -> None:
+            tracker.in_doubt = True
 
-        async with aiohttp.ClientSession() as session:
-            session.cookie_jar.update_cookies(self.cookies)
+        async with self._session() as session:
 
             # (1) 最新の C13CT を取得
-            c13ct_value = await self._get_c13ct_token(session)
+            c13ct_value = await self._get_c13ct_token(session, circuit="send")
 
             # (2) POST データの組み立て
             post_data = {
@@ -456,65 +1070,148 @@ class AmbiHybridClient:
             # (3) POST 送信
             headers = {
                 **self.headers,
-                "cookie": "; ".join([f"{k}={v}" for k, v in self.cookies.items()]),
+                "cookie": self._cookie_header(),
                 "referer": f"{self.BASE_URL}/company/scout/index/action/?PK=3FFFF4",
             }
 
-            async with session.post(url, data=post_data, headers=headers) as resp:
-                resp_text = await resp.text()
-                status_code = resp.status
+            resp = await self._request(
+                session, "POST", url, headers=headers, data=post_data, circuit="send", on_dispatch=dispatched
+            )
+            resp_text = resp.text
+            status_code = resp.status
+
+            # デバッグ用にレスポンスを記録
+            get_capture().capture(
+                "scout_send",
+                url=url,
+                status=status_code,
+                request_headers=headers,
+                params=post_data,
+                response_headers=resp.headers,
+                body=resp_text
+            )
 
-                # デバッグ用にレスポンスを保存
-                timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"scout_send_{status_code}_{timestamp}.html"
-                with open(filename, "w", encoding="utf-8") as f:
-                    f.write(resp_text)
-                logger.info(f"Scout message response saved to: {filename}")
+            # 5xx はAMBIが送信を処理した後のエラーの可能性があるため、送信されたかどうか分からない
+            if status_code >= 500:
+                logger.error("スカウト送信APIがステータス %d を返しました (送信結果不明)", status_code)
+                metrics.PHASE_FAILURES.inc(phase="scout_send", kind="unknown")
+                raise SendOutcomeUnknown(f"スカウト送信: 送信結果が不明です (status={status_code})")
+            # 応答を受け取れたので、以降の結果 (セッション切れ・拒否・成功) は確定している
+            tracker.in_doubt = False
 
-                if status_code != 200:
-                    logger.error(f"スカウト送信APIがステータス {status_code} を返しました")
-                    return False
+            # ログイン画面へ戻された場合は送信されていないので、再ログインして再試行できる
+            if "/company_login/login/" in resp.url:
+                raise AuthExpiredError("スカウト送信: セッションが切れています (ログイン画面へリダイレクト)")
 
-                # レスポンス内容をチェック (実際の判定ロジックは運用に合わせて実装)
-                if "エラー" in resp_text or "error" in resp_text.lower():
-                    logger.error("スカウト送信APIのレスポンスにエラーらしき文字が含まれます")
-                    return False
+            # トークンが拒否された場合も送信されていないので、トークンを取り直して再試行できる
+            if status_code in (403, 419):
+                await self.invalidate_token()
+                raise CsrfRejectedError(f"スカウト送信: C13CTが拒否されました (status={status_code})")
 
-                logger.info("スカウト送信完了")
-                return True
+            if status_code != 200:
+                logger.error("スカウト送信APIがステータス %d を返しました", status_code)
+                metrics.PHASE_FAILURES.inc(phase="scout_send", kind="rejected")
+                return False
+
+            # レスポンス内容をチェック (実際の判定ロジックは運用に合わせて実装)
+            if "エラー" in resp_text or "error" in resp_text.lower():
+                logger.error("スカウト送信APIのレスポンスにエラーらしき文字が含まれます")
+                metrics.PHASE_FAILURES.inc(phase="scout_send", kind="rejected")
+                return False
+
+            logger.info("スカウト送信完了")
+            return True
 
 
-async def search_with_hybrid(username: str, password: str, filters: AmbiSearchFilter) -> List[CandidateData]:
+async def search_with_hybrid(username: str, password: str, filters: AmbiSearchFilter) -> SearchResult:
     """
     ハイブリッド方式での検索実行:
-    1) Playwrightでログイン (重要Cookie取得)
+    1) 保存済みCookieを再利用 (無ければPlaywrightでログインして重要Cookie取得)
     2) HTTPセッション(aiohttp) + CSRFトークン で1ページ目POST
-    3) HTMLからページネーションリンクを抽出 → 2ページ目以降もPOSTで取得
+    3) ヒット件数から全ページのオフセットを算出 → 2ページ目以降もPOSTで取得
     4) すべてのページの候補者を連結して返す
+    失敗時は失敗したステップのみ再試行し、再ログインはセッション切れを検知したときだけ行う。
     """
-    client = AmbiHybridClient()
-    max_retries = 2
-    retry_delay = 3
-
-    for attempt in range(max_retries):
-        try:
-            # 1) ログイン → Cookie保持
-            await client.login_with_playwright(username, password)
-            await asyncio.sleep(1)
-
-            # 2) ページネーション対応で全候補者を取得
-            candidates = await client.search_candidates(filters)
-
-            if not candidates:
-                logger.warning("検索結果が0件でした")
-            return candidates
-
-        except Exception as e:
-            logger.error(f"試行 {attempt + 1}/{max_retries} 回目でエラー: {str(e)}")
-            if attempt < max_retries - 1:
-                logger.info(f"{retry_delay}秒後にリトライします...")
-                await asyncio.sleep(retry_delay)
-            else:
-                raise Exception(f"最大リトライ回数に達しました: {str(e)}")
-
+    async with client_registry.lease(username) as client:
+        await client.ensure_login(username, password)
+        result = await client.search_candidates(filters)
+    if not result.candidates:
+        logger.warning("検索結果が0件でした")
+    return result
+
+
+async def enrich_with_hybrid(
+    username: str,
+    password: str,
+    candidate_ids: List[int],
+    refresh: bool = False
+) -> DetailResult:
+    """
+    保存済みCookieでログインし (無ければPlaywrightでログイン)、候補者詳細を返す (順序は candidate_ids のとおり)。
+    このアカウントで取得済みの詳細はキャッシュから返し (refresh なら取得し直す)、残りを並行して取得する。
+    キャッシュはログインに成功してから読む (認証できない呼び出しには何も返さない)。
+    """
+    cache = detail_cache.get_cache()
+    async with client_registry.lease(username) as client:
+        await client.ensure_login(username, password)
+        cached = {} if refresh else await asyncio.to_thread(cache.get_many, username, candidate_ids)
+        missing = [c for c in candidate_ids if c not in cached]
+        result = DetailResult([], {})
+        if missing:
+            result = await client.fetch_candidate_details(missing)
+            await asyncio.to_thread(cache.save_many, username, result.details)
+
+    fetched = {d.id: d for d in result.details}
+    details = [cached.get(c) or fetched[c] for c in candidate_ids if c in cached or c in fetched]
+    return DetailResult(details, result.errors, result.incomplete, len(cached))
+
+
+async def send_with_hybrid(
+    client: AmbiHybridClient,
+    request: ScoutMessageRequest,
+    tracker: Optional[SendTracker] = None
+) -> ScoutMessageResponse:
+    """
+    ログイン済みの client を使ってスカウトを1通送信する:
+    1) search_id が指定されていれば scout_list_message_frame を呼んでサーバ状態を整える
+       (同じログインセッション・同じ search_id では初回のみ実行)
+    2) send_scout_message() でスカウト送信
+    セッション切れ・トークン拒否 (送信されていないことが確実な失敗) のときのみ、
+    再ログインまたはトークンの取り直しをして再試行する。
+    送信POSTの後で結果が分からなくなった場合は tracker.in_doubt が立つ (呼び出し側は再送してはならない)。
+    単体送信エンドポイントと一括送信ジョブの両方から使用する。
+    """
+    async def attempt() -> ScoutMessageResponse:
+        if request.search_id:
+            try:
+                await client.prepare_scout_list_frame(
+                    SID=request.UID,
+                    search_id=request.search_id
+                )
+            except (AuthExpiredError, CsrfRejectedError):
+                raise
+            except Exception as ex:
+                # 事前リクエスト失敗したらログ残して続行するか、エラー返すかは運用判断
+                # ここではエラー返却にする
+                return ScoutMessageResponse(
+                    status="error",
+                    message=f"事前リクエストに失敗しました: {str(ex)}"
+                )
 
+        success = await client.send_scout_message(request, tracker)
+        if success:
+            return ScoutMessageResponse(
+                status="success",
+                message="スカウトメッセージの送信に成功しました。"
+            )
+        return ScoutMessageResponse(
+            status="error",
+            message="スカウトメッセージの送信に失敗しました。"
+        )
+
+    return await run_step(
+        "スカウト送信",
+        attempt,
+        RetryPolicy.from_env(retry_on=frozenset({AUTH_EXPIRED, CSRF_REJECTED})),
+        {AUTH_EXPIRED: client.relogin, CSRF_REJECTED: client.invalidate_token}
+    )
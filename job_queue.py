@@ -0,0 +1,559 @@
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from models import ScoutJobRequest, ScoutJobStatusResponse, ScoutJobItemResult
+from models import ScoutMessageContent, ScoutMessageRequest, ScoutMessageResponse
+from models import ScoutTemplateJobRequest, ScoutTemplateJobSpec, ScoutTemplateItem
+from hybrid_client import SendTracker, send_with_hybrid
+from retry_policy import CircuitOpenError, CredentialsUnavailableError, error_message, is_login_failure
+from send_ledger import SendLedger, send_key
+from scout_template import CompiledScoutTemplate, TemplateStore
+import candidate_cache
+import client_registry
+import deadline
+from logging_setup import set_account_id, set_request_id
+from session_manager import get_store as get_session_store, new_lock_owner
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# ジョブ/アイテムの状態を保持するローカルDB (再起動後も再開できるようにファイルに永続化)
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+# 同時に処理するジョブ数
+JOB_WORKERS = int(os.getenv("AMBI_JOB_WORKERS", "2"))
+# ジョブ・アイテムを処理中のワーカーが保持するリースの期間 (秒)。
+# 1件の送信の処理時間の上限より長くする。リースが切れたものは、ほかのワーカーが引き継げる
+JOB_LEASE_SEC = float(os.getenv("AMBI_JOB_LEASE_SEC", "300"))
+# 引き受けたジョブ (キューで順番を待っているものを含む) のリースを延長し、停止したワーカーのジョブを確認する間隔 (秒)
+JOB_HEARTBEAT_SEC = max(1.0, JOB_LEASE_SEC / 4)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scout_jobs (
+    job_id     TEXT PRIMARY KEY,
+    username   TEXT NOT NULL,
+    password   TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    spec       TEXT,
+    owner      TEXT,
+    lease_until REAL,
+    session_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS scout_job_items (
+    job_id     TEXT NOT NULL,
+    idx        INTEGER NOT NULL,
+    uid        INTEGER NOT NULL,
+    payload    TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    message    TEXT,
+    updated_at TEXT NOT NULL,
+    owner      TEXT,
+    lease_until REAL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class JobStore:
+    """
+    一括送信ジョブを SQLite に保存する。
+    - scout_jobs: ジョブ単位の状態 (queued / running / done)。
+      テンプレート送信ジョブの場合は共通の送信設定 (spec) も保持する
+    - scout_job_items: 1通ごとの状態 (pending / running / success / error / unknown) と結果メッセージ。
+      payload は通常ジョブなら送信内容そのもの、テンプレート送信ジョブなら UID と差し込み変数のみ
+    ジョブとアイテムは処理するワーカー (owner) がリース付きで引き受ける。
+    引き受けは1つのUPDATE文で行うため、複数のワーカープロセスが同じアイテムを処理することはない。
+    リースが切れたもの (ワーカーが落ちた場合) だけを、ほかのワーカーや再起動後のワーカーが引き継ぐ。
+    パスワードはDBに保存しない (ScoutJobRunner がプロセス内にのみ保持する)。
+    代わりに、ジョブのパスワードでのログインで保存されたCookieのハッシュ (session_hash) を記録し、
+    パスワードを失った後の再開ではそのCookieを使う。
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # 列が足りない旧スキーマのDBを移行
+            for table, column, definition in (
+                ("scout_jobs", "spec", "TEXT"),
+                ("scout_jobs", "owner", "TEXT"),
+                ("scout_jobs", "lease_until", "REAL"),
+                ("scout_jobs", "session_hash", "TEXT"),
+                ("scout_job_items", "owner", "TEXT"),
+                ("scout_job_items", "lease_until", "REAL"),
+            ):
+                columns = [r[1] for r in self._conn.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            # 以前の版で保存されたパスワードを消去する
+            self._conn.execute("UPDATE scout_jobs SET password = '' WHERE password != ''")
+
+    def create_job(
+        self,
+        username: str,
+        items: List[Tuple[int, str]],
+        owner: str,
+        spec: Optional[str] = None,
+        session_hash: Optional[str] = None,
+        lease: float = JOB_LEASE_SEC
+    ) -> str:
+        """
+        items は (UID, payload JSON) のリスト。ジョブは登録したワーカー (owner) が引き受けた状態で作る
+        """
+        job_id = uuid.uuid4().hex
+        now = _now()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO scout_jobs"
+                " (job_id, username, password, state, created_at, updated_at, spec, owner, lease_until, session_hash)"
+                " VALUES (?, ?, '', 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, username, now, now, spec, owner, time.time() + lease, session_hash)
+            )
+            self._conn.executemany(
+                "INSERT INTO scout_job_items (job_id, idx, uid, payload, state, message, updated_at)"
+                " VALUES (?, ?, ?, ?, 'pending', NULL, ?)",
+                [
+                    (job_id, i, uid, payload, now)
+                    for i, (uid, payload) in enumerate(items)
+                ]
+            )
+            self._conn.execute("COMMIT")
+        return job_id
+
+    def job_info(self, job_id: str) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        (username, spec, session_hash) を返す
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT username, spec, session_hash FROM scout_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            raise Exception(f"ジョブが見つかりません: {job_id}")
+        return row[0], row[1], row[2]
+
+    def set_session_hash(self, job_id: str, session_hash: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scout_jobs SET session_hash = COALESCE(?, session_hash) WHERE job_id = ?",
+                (session_hash, job_id)
+            )
+
+    def renew_jobs(self, job_ids: List[str], owner: str, lease: float = JOB_LEASE_SEC) -> None:
+        """
+        owner が引き受けている未完了ジョブのリースを延長する (キューで順番を待っている間も引き継がれないように)
+        """
+        if not job_ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE scout_jobs SET lease_until = ? WHERE job_id = ? AND owner = ? AND state != 'done'",
+                [(time.time() + lease, job_id, owner) for job_id in job_ids]
+            )
+
+    def claim_job(self, job_id: str, owner: str, lease: float = JOB_LEASE_SEC) -> bool:
+        """
+        未完了のジョブを引き受ける (引き受け済み、またはリースが切れていれば取得できる)。リースの延長にも使う
+        """
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE scout_jobs SET owner = ?, lease_until = ?"
+                " WHERE job_id = ? AND state != 'done'"
+                " AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+                (owner, now + lease, job_id, owner, now)
+            )
+            return cur.rowcount == 1
+
+    def claim_next_item(self, job_id: str, owner: str, lease: float = JOB_LEASE_SEC) -> Optional[Tuple[int, str]]:
+        """
+        次に送信するアイテムを running にして引き受け、(idx, payload) を返す。
+        未処理のアイテムと、処理中のままリースが切れたアイテム (ワーカーが落ちたもの) が対象
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE scout_job_items SET state = 'running', owner = ?, lease_until = ?, updated_at = ?"
+                " WHERE rowid = ("
+                "   SELECT rowid FROM scout_job_items"
+                "   WHERE job_id = ? AND (state = 'pending' OR (state = 'running' AND lease_until < ?))"
+                "   ORDER BY idx LIMIT 1"
+                " ) RETURNING idx, payload",
+                (owner, now + lease, _now(), job_id, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    def mark_item(self, job_id: str, index: int, owner: str, state: str, message: Optional[str] = None) -> bool:
+        """
+        引き受けたアイテムの結果を記録する (リースが切れてほかのワーカーに引き継がれていれば記録しない)
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE scout_job_items SET state = ?, message = ?, updated_at = ?, owner = NULL, lease_until = NULL"
+                " WHERE job_id = ? AND idx = ? AND owner = ?",
+                (state, message, _now(), job_id, index, owner)
+            )
+            return cur.rowcount == 1
+
+    def fail_pending(self, job_id: str, message: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scout_job_items SET state = 'error', message = ?, updated_at = ?"
+                " WHERE job_id = ? AND state = 'pending'",
+                (message, _now(), job_id)
+            )
+
+    def set_job_state(self, job_id: str, state: str) -> None:
+        with self._lock:
+            if state == "done":
+                self._conn.execute(
+                    "UPDATE scout_jobs SET state = ?, owner = NULL, lease_until = NULL, updated_at = ?"
+                    " WHERE job_id = ?",
+                    (state, _now(), job_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE scout_jobs SET state = ?, updated_at = ? WHERE job_id = ?",
+                    (state, _now(), job_id)
+                )
+
+    def claimable_jobs(self) -> List[str]:
+        """
+        引き受け手のいない未完了ジョブ (処理していたワーカーのリースが切れたもの) を洗い出す。
+        生きているワーカーは処理中・順番待ちのジョブのリースを延長し続けるため、それらには触れない。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM scout_jobs WHERE state != 'done'"
+                " AND (owner IS NULL OR lease_until < ?) ORDER BY created_at",
+                (time.time(),)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def get_status(self, job_id: str) -> Optional[ScoutJobStatusResponse]:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT state FROM scout_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT idx, uid, state, message, updated_at FROM scout_job_items"
+                " WHERE job_id = ? ORDER BY idx",
+                (job_id,)
+            ).fetchall()
+
+        items = [
+            ScoutJobItemResult(index=r[0], UID=r[1], state=r[2], message=r[3], updated_at=r[4])
+            for r in rows
+        ]
+        succeeded = sum(1 for it in items if it.state == "success")
+        # 送信結果が不明 (unknown) のアイテムも、再送しないため処理済みとして数える
+        failed = sum(1 for it in items if it.state in ("error", "unknown"))
+        return ScoutJobStatusResponse(
+            status="success",
+            job_id=job_id,
+            state=job[0],
+            total=len(items),
+            succeeded=succeeded,
+            failed=failed,
+            pending=len(items) - succeeded - failed,
+            items=items,
+            message=f"{succeeded + failed}/{len(items)}件 処理済み"
+        )
+
+
+class ScoutJobRunner:
+    """
+    一括送信ジョブを非同期に処理するワーカー群。
+    1ジョブにつき1回ログインし、同じクライアントで各アイテムを順番に送信する。
+    各アイテムは送信前に送信台帳を確認し、送信済みのものは再送しない。
+    テンプレート送信ジョブは、コンパイル済みテンプレートに差し込み変数を当てて各アイテムの文面を生成する。
+    ジョブは登録を受けたプロセスが処理し、順番を待っている間もリースを延長し続ける。
+    パスワードはそのプロセスのメモリにのみ保持するため、プロセスが停止したジョブを (リースが切れた後に) 引き継いだ場合は、
+    ジョブのパスワードでのログインで保存されたCookieで再開する。Cookieが無い・失効した場合は未送信のアイテムを失敗として終える。
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        ledger: SendLedger,
+        templates: TemplateStore,
+        workers: int = JOB_WORKERS
+    ):
+        self.store = store
+        self.ledger = ledger
+        self.templates = templates
+        self.workers = max(1, workers)
+        # ジョブ・アイテムのリースの持ち主 (ワーカープロセスごと)
+        self.owner = new_lock_owner()
+        # ジョブID -> パスワード (DBには保存しない)
+        self._passwords: Dict[str, str] = {}
+        self._queued: Set[str] = set()
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    def _enqueue(self, job_id: str) -> None:
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _adopt_orphans(self) -> None:
+        """
+        処理していたワーカーが停止した (リースが切れた) 未完了ジョブを引き継ぐ
+        """
+        for job_id in await asyncio.to_thread(self.store.claimable_jobs):
+            if job_id not in self._queued:
+                logger.info("停止したワーカーの未完了ジョブを引き継ぎます: %s", job_id)
+                self._enqueue(job_id)
+
+    async def _watch_orphans(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SEC)
+            try:
+                await asyncio.to_thread(self.store.renew_jobs, list(self._queued), self.owner)
+                await self._adopt_orphans()
+            except Exception as e:
+                logger.warning("未完了ジョブの確認に失敗しました: %s", e)
+
+    async def start(self) -> None:
+        await self._adopt_orphans()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._watch_orphans()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, request: ScoutJobRequest) -> str:
+        items = [(item.UID, item.json()) for item in request.items]
+        session_hash = await asyncio.to_thread(get_session_store().password_hash, request.username, request.password)
+        job_id = await asyncio.to_thread(
+            self.store.create_job, request.username, items, self.owner, None, session_hash
+        )
+        self._passwords[job_id] = request.password
+        self._enqueue(job_id)
+        return job_id
+
+    async def submit_templated(self, request: ScoutTemplateJobRequest) -> str:
+        if self.templates.get(request.template_id) is None:
+            raise Exception(f"テンプレートが見つかりません: {request.template_id}")
+
+        spec = ScoutTemplateJobSpec(**request.dict(exclude={"username", "password", "items"}))
+        items = [(item.UID, item.json()) for item in request.items]
+        session_hash = await asyncio.to_thread(get_session_store().password_hash, request.username, request.password)
+        job_id = await asyncio.to_thread(
+            self.store.create_job, request.username, items, self.owner, spec.json(), session_hash
+        )
+        self._passwords[job_id] = request.password
+        self._enqueue(job_id)
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[ScoutJobStatusResponse]:
+        return await asyncio.to_thread(self.store.get_status, job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error("ジョブ %s の処理中にエラー: %s", job_id, e)
+            finally:
+                self._queued.discard(job_id)
+                self._queue.task_done()
+
+    def _build_content(
+        self,
+        username: str,
+        payload: str,
+        spec: Optional[ScoutTemplateJobSpec],
+        template: Optional[CompiledScoutTemplate]
+    ) -> ScoutMessageContent:
+        """
+        アイテムの payload から送信内容を組み立てる (キャッシュを読むため別スレッドで呼ぶ)。
+        テンプレート送信の場合、差し込み変数はこのアカウントで取得済みの候補者の項目をアイテム指定の値で上書きしたもの。
+        """
+        if spec is None:
+            return ScoutMessageContent.parse_raw(payload)
+
+        item = ScoutTemplateItem.parse_raw(payload)
+        variables = {**candidate_cache.template_variables(username, item.UID), **item.variables}
+        return ScoutMessageContent(
+            UID=item.UID,
+            idempotency_key=item.idempotency_key,
+            **spec.dict(exclude={"template_id"}),
+            **template.render(variables)
+        )
+
+    async def _run_job(self, job_id: str) -> None:
+        if not await asyncio.to_thread(self.store.claim_job, job_id, self.owner):
+            # ほかのワーカーが処理中
+            self._passwords.pop(job_id, None)
+            return
+        username, spec_json, session_hash = await asyncio.to_thread(self.store.job_info, job_id)
+        # ワーカー内のログにはジョブIDをリクエストIDとして付ける
+        set_request_id(job_id)
+        set_account_id(username)
+        await asyncio.to_thread(self.store.set_job_state, job_id, "running")
+
+        # None なら登録を受けたプロセスが停止し、パスワードが失われた (保存済みのCookieで再開する)
+        password = self._passwords.get(job_id)
+        if password is None:
+            if session_hash is None:
+                await self._abandon(job_id, "パスワードでログインしたセッションの記録がありません")
+                return
+            logger.info("保存済みのCookieでジョブを再開します: %s", job_id)
+
+        spec: Optional[ScoutTemplateJobSpec] = None
+        template: Optional[CompiledScoutTemplate] = None
+        if spec_json:
+            spec = ScoutTemplateJobSpec.parse_raw(spec_json)
+            template = await asyncio.to_thread(self.templates.get, spec.template_id)
+            if template is None:
+                await asyncio.to_thread(
+                    self.store.fail_pending, job_id, f"テンプレートが見つかりません: {spec.template_id}"
+                )
+
+        # ログイン済み (保存済みCookieの確認済み) か。失敗したら次のアイテムでログインからやり直す
+        logged_in = False
+        while True:
+            # ジョブのリースを延長してから、次のアイテムを引き受ける
+            if not await asyncio.to_thread(self.store.claim_job, job_id, self.owner):
+                logger.warning("ジョブのリースが切れたため処理をやめます: %s", job_id)
+                self._passwords.pop(job_id, None)
+                return
+            pending = await asyncio.to_thread(self.store.claim_next_item, job_id, self.owner)
+            if pending is None:
+                break
+            index, payload = pending
+
+            try:
+                content = await asyncio.to_thread(self._build_content, username, payload, spec, template)
+            except Exception as e:
+                await asyncio.to_thread(
+                    self.store.mark_item, job_id, index, self.owner, "error", f"送信内容の生成に失敗しました: {str(e)}"
+                )
+                continue
+
+            key = send_key(username, content)
+            recorded = await asyncio.to_thread(self.ledger.begin, key, username, content, self.owner)
+            if recorded is not None:
+                # 送信済みなら success、送信処理中・送信結果不明のものは (このジョブからは) 結果不明として記録する
+                state = "success" if recorded.status == "success" else "unknown"
+                await asyncio.to_thread(
+                    self.store.mark_item, job_id, index, self.owner, state, recorded.message
+                )
+                continue
+
+            tracker = SendTracker()
+
+            async def send_item(logged_in: bool, content: ScoutMessageContent) -> ScoutMessageResponse:
+                async with client_registry.lease(username) as client:
+                    if not logged_in and password is None:
+                        await client.resume_session(username, session_hash)
+                    elif not logged_in:
+                        await client.ensure_login(username=username, password=password)
+                        # 再起動後に再開するときに使うセッションを記録する
+                        logged_in_hash = await asyncio.to_thread(get_session_store().password_hash, username, password)
+                        await asyncio.to_thread(self.store.set_session_hash, job_id, logged_in_hash)
+                    request = ScoutMessageRequest(username=username, password=password or "", **content.dict())
+                    return await send_with_hybrid(client, request, tracker)
+
+            try:
+                with tracing.span("scout_job_item", job_id=job_id, index=index, UID=content.UID):
+                    # 1件ごとに単体送信と同じ処理時間の上限を設ける
+                    result = await deadline.run(send_item(logged_in, content), deadline.REQUEST_DEADLINE_SEC)
+                logged_in = True
+                state, message = result.status, result.message
+                login_failed = False
+            except CircuitOpenError as e:
+                # AMBIの障害で送信を止めている間は失敗扱いにせず、再開を待って同じアイテムから続ける
+                logger.warning("AMBIの障害のため %.0f秒後に送信を再開します: %s", e.retry_after, e)
+                await asyncio.to_thread(
+                    self.ledger.finish, key, self.owner, ScoutMessageResponse(status="error", message=str(e))
+                )
+                await asyncio.to_thread(self.store.mark_item, job_id, index, self.owner, "pending", str(e))
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                # 次のアイテムではログインからやり直す
+                logged_in = False
+                if tracker.in_doubt:
+                    # 送信されたかどうか分からないアイテムは再送しない
+                    unknown = await asyncio.to_thread(self.ledger.finish_unknown, key, self.owner, str(e))
+                    await asyncio.to_thread(self.store.mark_item, job_id, index, self.owner, "unknown", unknown.message)
+                    continue
+                if isinstance(e, CredentialsUnavailableError):
+                    # パスワードを失ったジョブで、保存済みのCookieが使えなくなった
+                    await asyncio.to_thread(
+                        self.ledger.finish, key, self.owner, ScoutMessageResponse(status="error", message=str(e))
+                    )
+                    await asyncio.to_thread(self.store.mark_item, job_id, index, self.owner, "pending", None)
+                    await self._abandon(job_id, str(e))
+                    return
+                state = "error"
+                message = error_message(e, prefix="スカウト送信時にエラーが発生")
+                login_failed = is_login_failure(e)
+            except BaseException:
+                # ワーカーの停止 (シャットダウン)。台帳とアイテムを処理中のまま残さない
+                await asyncio.shield(self._release_item(job_id, index, key, tracker.in_doubt))
+                raise
+
+            await asyncio.to_thread(
+                self.ledger.finish, key, self.owner, ScoutMessageResponse(status=state, message=message)
+            )
+            await asyncio.to_thread(self.store.mark_item, job_id, index, self.owner, state, message)
+
+            if login_failed:
+                # 認証情報の誤りは何度試しても同じなので残りのアイテムも失敗扱いにする
+                await asyncio.to_thread(self.store.fail_pending, job_id, message)
+                break
+
+        await asyncio.to_thread(self.store.set_job_state, job_id, "done")
+        self._passwords.pop(job_id, None)
+        logger.info("ジョブ %s が完了しました", job_id)
+
+    async def _release_item(self, job_id: str, index: int, key: str, in_doubt: bool) -> None:
+        """
+        送信中に取り消されたアイテムを記録する。送信リクエストを送った後なら unknown、
+        送る前なら pending に戻し、次に引き受けたワーカーが送信する
+        """
+        recorded = await asyncio.to_thread(self.ledger.abandon, key, self.owner, in_doubt)
+        if in_doubt:
+            await asyncio.to_thread(self.store.mark_item, job_id, index, self.owner, "unknown", recorded.message)
+        else:
+            await asyncio.to_thread(self.store.mark_item, job_id, index, self.owner, "pending", None)
+
+    async def _abandon(self, job_id: str, reason: str) -> None:
+        """
+        パスワードを失い、保存済みのCookieでも再開できないジョブの未送信のアイテムを失敗として終える
+        """
+        message = "サーバの再起動などでジョブが中断され、未送信のアイテムを送信できませんでした。再登録してください。"
+        logger.warning("ジョブを再開できないため終了します (%s): %s", reason, job_id)
+        while True:
+            pending = await asyncio.to_thread(self.store.claim_next_item, job_id, self.owner)
+            if pending is None:
+                break
+            await asyncio.to_thread(self.store.mark_item, job_id, pending[0], self.owner, "error", message)
+        await asyncio.to_thread(self.store.set_job_state, job_id, "done")
+        self._passwords.pop(job_id, None)
@@ -0,0 +1,356 @@
+"""
+APIサーバ (main:app) の負荷試験
+
+ローカルのスタンドインサーバ (ambi_standin.py) をAMBIの代わりに起動し、
+uvicorn で起動した main:app にシナリオごとの負荷をかけて以下を出力する。
+- スループット (件/秒)、レイテンシ p50 / p95 / p99、エラー件数
+- APIサーバ (子プロセスを含む) の最大メモリ (RSS)、最大ブラウザプロセス数
+
+    python loadtest.py --concurrency 10 --requests 100
+    python loadtest.py --scenarios search_deep,same_account --json result.json
+
+ログインは実際にPlaywright (Chromium) で行うため、Playwright のブラウザが必要。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+import ambi_standin
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ----------------------------------------
+# シナリオ
+# ----------------------------------------
+class Scenario:
+    """
+    - total / per_page: スタンドインの検索ヒット件数と1ページの件数 (= ページ数)
+    - send_ratio: スカウト送信の割合 (残りは検索)
+    - accounts: 使うアカウント数 (1 なら全リクエストが同じアカウント)
+    - fetch_all_pages: 検索で全ページを取得するか
+    """
+
+    def __init__(
+        self,
+        name: str,
+        total: int = 50,
+        per_page: int = 50,
+        send_ratio: float = 0.0,
+        accounts: int = 10,
+        fetch_all_pages: bool = False
+    ):
+        self.name = name
+        self.total = total
+        self.per_page = per_page
+        self.send_ratio = send_ratio
+        self.accounts = accounts
+        self.fetch_all_pages = fetch_all_pages
+
+
+SCENARIOS = {
+    "search_single_page": Scenario("search_single_page", total=50),
+    "search_deep": Scenario("search_deep", total=500, fetch_all_pages=True),
+    "send": Scenario("send", send_ratio=1.0),
+    "mixed": Scenario("mixed", total=200, send_ratio=0.3, fetch_all_pages=True),
+    "same_account": Scenario("same_account", total=150, send_ratio=0.3, accounts=1, fetch_all_pages=True),
+}
+
+
+def build_request(scenario: Scenario, n: int) -> Dict[str, Any]:
+    username = f"loadtest{n % scenario.accounts}"
+    if random.random() < scenario.send_ratio:
+        return {
+            "path": "/scout/send",
+            "json": {
+                "username": username,
+                "password": "password",
+                "UID": 1000000 + n,
+                "ScoutType": 1,
+                "attachedWorkIDs": [1],
+                "Title": "負荷試験",
+                "Body": "負荷試験のスカウトです",
+                "search_id": 1,
+                "idempotency_key": f"loadtest-{time.time_ns()}-{n}",
+            },
+        }
+    return {
+        "path": "/search",
+        "json": {
+            "username": username,
+            "password": "password",
+            "filters": {"fetch_all_pages": scenario.fetch_all_pages},
+        },
+    }
+
+
+# ----------------------------------------
+# プロセス計測 (/proc を読む。Linux 以外では 0 になる)
+# ----------------------------------------
+def _children(pid: int) -> List[int]:
+    path = f"/proc/{pid}/task/{pid}/children"
+    try:
+        with open(path) as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        pids.append(p)
+        stack.extend(_children(p))
+    return pids
+
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _is_browser(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            name = f.read().strip().lower()
+    except OSError:
+        return False
+    return "chrom" in name or "headless_shell" in name
+
+
+class ProcessSampler:
+    """
+    APIサーバのプロセスツリーのメモリとブラウザプロセス数を定期的に採取し、最大値を記録する
+    """
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.peak_browsers = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> None:
+        pids = _process_tree(self.pid)
+        self.peak_rss_kb = max(self.peak_rss_kb, sum(_rss_kb(p) for p in pids))
+        self.peak_browsers = max(self.peak_browsers, sum(1 for p in pids if _is_browser(p)))
+
+    async def _run(self) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self.peak_rss_kb = 0
+        self.peak_browsers = 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.sample()
+
+
+# ----------------------------------------
+# 集計
+# ----------------------------------------
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # nearest-rank 法
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_scenario(
+    api_base: str,
+    scenario: Scenario,
+    standin: ambi_standin.StandinServer,
+    sampler: ProcessSampler,
+    concurrency: int,
+    requests: int,
+    timeout: float
+) -> Dict[str, Any]:
+    standin.config.total = scenario.total
+    standin.config.per_page = scenario.per_page
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        for n in counter:
+            req = build_request(scenario, n)
+            started = time.perf_counter()
+            try:
+                async with session.post(api_base + req["path"], json=req["json"]) as resp:
+                    body = await resp.json()
+                ok = resp.status == 200 and body.get("status") == "success"
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    sampler.start()
+    started = time.perf_counter()
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await sampler.stop()
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        "scenario": scenario.name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "peak_rss_mb": round(sampler.peak_rss_kb / 1024, 1),
+        "peak_browsers": sampler.peak_browsers,
+    }
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    columns = [
+        "scenario", "requests", "errors", "throughput_rps",
+        "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb", "peak_browsers"
+    ]
+    if not results:
+        return
+    widths = {c: max([len(c)] + [len(str(r[c])) for r in results]) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("APIサーバの起動に失敗しました")
+            try:
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("APIサーバが起動しませんでした")
+
+
+async def main_async(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    names = [s for s in args.scenarios.split(",") if s]
+    unknown = [s for s in names if s not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"不明なシナリオ: {unknown} (選択肢: {list(SCENARIOS)})")
+
+    # スタンドイン (同じプロセスで起動し、シナリオごとにページ数を切り替える)
+    standin_app = ambi_standin.create_app(ambi_standin.StandinConfig(
+        latency=args.standin_latency,
+        jitter=args.standin_jitter,
+        error_rate=args.standin_error_rate
+    ))
+    standin: ambi_standin.StandinServer = standin_app["standin"]
+    standin_port = _free_port()
+    runner = web.AppRunner(standin_app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", standin_port).start()
+
+    # APIサーバ (状態DB・Cookieは一時ディレクトリに置き、既存の状態を汚さない)
+    api_port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="ambi_loadtest_")
+    env = {
+        **os.environ,
+        "AMBI_BASE_URL": f"http://127.0.0.1:{standin_port}",
+        "AMBI_STATE_DB": os.path.join(workdir, "state.sqlite3"),
+        "AMBI_LOG_LEVEL": os.environ.get("AMBI_LOG_LEVEL", "WARNING"),
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--app-dir", REPO_DIR,
+            "--host", "127.0.0.1", "--port", str(api_port),
+            "--workers", str(args.workers),
+        ],
+        cwd=workdir,
+        env=env
+    )
+    api_base = f"http://127.0.0.1:{api_port}"
+    results = []
+    try:
+        await _wait_ready(api_base + "/readyz", process)
+        sampler = ProcessSampler(process.pid)
+        for name in names:
+            result = await run_scenario(
+                api_base, SCENARIOS[name], standin, sampler,
+                args.concurrency, args.requests, args.timeout
+            )
+            results.append(result)
+            print(f"{name}: 完了", file=sys.stderr)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await runner.cleanup()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="APIサーバの負荷試験")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="実行するシナリオ (カンマ区切り)")
+    parser.add_argument("--concurrency", type=int, default=10, help="同時リクエスト数")
+    parser.add_argument("--requests", type=int, default=50, help="シナリオあたりのリクエスト数")
+    parser.add_argument("--timeout", type=float, default=300, help="1リクエストのタイムアウト (秒)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn のワーカー数")
+    parser.add_argument("--standin-latency", type=float, default=0.05, help="スタンドインの応答遅延 (秒)")
+    parser.add_argument("--standin-jitter", type=float, default=0.02)
+    parser.add_argument("--standin-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", default=None, help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Dict, Optional
+
+# ルートロガーのレベル
+LOG_LEVEL = os.getenv("AMBI_LOG_LEVEL", "INFO")
+# ロガー別のレベル ("aiohttp=WARNING,hybrid_client=DEBUG" 形式)
+LOG_LEVELS = os.getenv("AMBI_LOG_LEVELS", "aiohttp=WARNING,asyncio=WARNING,playwright=WARNING")
+# json: 1行1JSONの構造化ログ / text: 人が読む用のテキスト
+LOG_FORMAT = os.getenv("AMBI_LOG_FORMAT", "json")
+
+# ログに付与するリクエストID・アカウントID (asyncio のタスクごとに引き継がれる)
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+account_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("account_id", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def set_request_id(request_id: Optional[str]) -> None:
+    request_id_var.set(request_id)
+
+
+def set_account_id(account_id: Optional[str]) -> None:
+    account_id_var.set(account_id)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    レコードにリクエストID・アカウントIDを付けてキューに積むだけのハンドラ。
+    標準の QueueHandler は積む前にメッセージを整形するが、ここでは整形を
+    リスナー側のスレッドに任せ、イベントループ上では行わない。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        record.account_id = account_id_var.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        account_id = getattr(record, "account_id", None)
+        if account_id:
+            entry["account_id"] = account_id
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s %(account_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        for name in ("request_id", "account_id"):
+            if getattr(record, name, None) is None:
+                setattr(record, name, "-")
+        return super().format(record)
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        if name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging() -> None:
+    """
+    ログ出力の初期化 (複数回呼ばれても1回だけ実行)。
+    ルートロガーには ContextQueueHandler のみを付け、整形と標準出力への書き込みは
+    QueueListener のスレッドで行う。
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL.upper())
+
+    for name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,263 @@
+import asyncio
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import sys
+from typing import Dict, List, Optional
+
+import deadline
+import metrics
+from retry_policy import AmbiError, DeadlineExceeded, TransientError
+
+logger = logging.getLogger(__name__)
+
+# process: ログインを専用のワーカープロセスで行う / inline: APIサーバのプロセス内でブラウザを起動する
+LOGIN_ISOLATION = os.getenv("AMBI_LOGIN_ISOLATION", "process")
+# ログイン用ワーカープロセスの数 (APIサーバの1プロセスあたり。同時に行えるログイン数の上限でもある)
+LOGIN_WORKERS = max(1, int(os.getenv("AMBI_LOGIN_WORKERS", "2")))
+# ワーカー1つあたりのメモリ上限 (MB、ブラウザを含むプロセスツリーのRSS合計)。超えたら再起動する
+LOGIN_WORKER_MAX_RSS_MB = float(os.getenv("AMBI_LOGIN_WORKER_MAX_RSS_MB", "1024"))
+# この回数ログインしたワーカーは再起動する (ブラウザのメモリの増加を抑える。0 なら再起動しない)
+LOGIN_WORKER_MAX_LOGINS = int(os.getenv("AMBI_LOGIN_WORKER_MAX_LOGINS", "50"))
+# ログイン中にメモリ使用量を確認する間隔 (秒)
+MEMORY_CHECK_SEC = 1.0
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "login_worker.py")
+
+
+def check_playwright() -> None:
+    """
+    ログインに使う Playwright がインストールされているか確認する (起動時に呼び、無ければ起動を中止する)。
+    読み込みは重いため、パッケージの有無だけを調べる。
+    """
+    if importlib.util.find_spec("playwright") is None:
+        raise RuntimeError(
+            "Playwright がインストールされていないため、AMBIへのログインができません "
+            f"(AMBI_LOGIN_ISOLATION={LOGIN_ISOLATION})。"
+            "pip install -r requirements.txt と playwright install --with-deps chromium を実行してください。"
+        )
+
+
+def _tree_rss_mb(pid: int) -> Optional[float]:
+    """
+    pid とその子孫プロセス (Chromium) のRSS合計 (MB)。/proc が読めない環境では None
+    """
+    try:
+        entries = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return None
+    children: Dict[int, List[int]] = {}
+    for name in entries:
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 2番目の項目 (comm) に空白や括弧を含みうるため、最後の ")" 以降を分割する
+        ppid = int(stat[stat.rfind(b")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(name))
+
+    total_kb = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+        stack.extend(children.get(current, []))
+    return total_kb / 1024
+
+
+class _LoginWorker:
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.logins = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def kill(self) -> None:
+        if self.alive:
+            self.process.kill()
+        await self.process.wait()
+
+
+class LoginWorkerPool:
+    """
+    Playwrightによるログインを専用のワーカープロセスで行う。
+    ログインが集中してもAPIサーバのイベントループやメモリを圧迫せず、ブラウザが落ちても巻き込まれない。
+    - 各ワーカーはブラウザを起動したまま1件ずつログインを処理する (要求・応答は標準入出力の1行JSON)
+    - ログイン中はワーカーのメモリ使用量を監視し、max_rss_mb を超えたら強制終了する
+    - 異常終了・メモリ超過・max_logins 回のログイン・中断されたワーカーは破棄し、次のログインで起動し直す
+    """
+
+    def __init__(
+        self,
+        size: int = LOGIN_WORKERS,
+        max_rss_mb: float = LOGIN_WORKER_MAX_RSS_MB,
+        max_logins: int = LOGIN_WORKER_MAX_LOGINS
+    ):
+        self.size = max(1, size)
+        self.max_rss_mb = max_rss_mb
+        self.max_logins = max_logins
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle: List[_LoginWorker] = []
+        self._busy: List[_LoginWorker] = []
+        self._ids = itertools.count(1)
+
+    async def _spawn(self) -> _LoginWorker:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=os.path.dirname(WORKER_SCRIPT)
+        )
+        logger.info("ログイン用ワーカーを起動しました: pid=%d", process.pid)
+        return _LoginWorker(process)
+
+    async def _acquire(self) -> _LoginWorker:
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive:
+                return worker
+            metrics.LOGIN_WORKER_RESTARTS.inc(reason="crash")
+            await worker.kill()
+        return await self._spawn()
+
+    async def _discard(self, worker: _LoginWorker, reason: str) -> None:
+        metrics.LOGIN_WORKER_RESTARTS.inc(reason=reason)
+        log = logger.info if reason == "recycle" else logger.warning
+        log("ログイン用ワーカーを終了します (%s): pid=%d", reason, worker.process.pid)
+        await worker.kill()
+
+    async def _call(self, worker: _LoginWorker, request: Dict) -> Dict:
+        """
+        要求を1件送り、応答を待つ。待っている間もメモリ使用量を確認する
+        """
+        request = {"id": next(self._ids), **request}
+        try:
+            worker.process.stdin.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+            await worker.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            await self._discard(worker, "crash")
+            raise TransientError("ログイン用ワーカーが異常終了しました") from None
+
+        reading = asyncio.ensure_future(worker.process.stdout.readline())
+        try:
+            while True:
+                done, _ = await asyncio.wait({reading}, timeout=MEMORY_CHECK_SEC)
+                if done:
+                    break
+                rss = await asyncio.to_thread(_tree_rss_mb, worker.process.pid)
+                if self.max_rss_mb > 0 and rss is not None and rss > self.max_rss_mb:
+                    await self._discard(worker, "memory")
+                    raise TransientError(
+                        f"ログイン用ワーカーのメモリ使用量が上限を超えたため中断しました ({rss:.0f}MB)"
+                    )
+        finally:
+            reading.cancel()
+        line = reading.result()
+        if not line:
+            await self._discard(worker, "crash")
+            raise TransientError("ログイン用ワーカーが異常終了しました")
+        return json.loads(line)
+
+    async def _run(self, request: Dict) -> Dict:
+        async with self._slots:
+            worker = await self._acquire()
+            self._busy.append(worker)
+            reusable = False
+            try:
+                response = await self._call(worker, request)
+                reusable = True
+                return response
+            finally:
+                self._busy.remove(worker)
+                if reusable and worker.alive:
+                    if request.get("op") == "login":
+                        worker.logins += 1
+                    if self.max_logins > 0 and worker.logins >= self.max_logins:
+                        await self._discard(worker, "recycle")
+                    else:
+                        self._idle.append(worker)
+                elif worker.alive:
+                    # 中断された (応答を待たずに取り消された) ワーカーは状態が分からないため破棄する
+                    await self._discard(worker, "cancel")
+
+    async def login(self, login_url: str, username: str, password: str) -> Dict[str, str]:
+        """
+        ワーカープロセスでログインし、取得したCookieを返す。
+        リクエストの残り時間はワーカー側のブラウザ操作にも引き継ぐ。
+        """
+        timeout = deadline.budget(deadline.REQUEST_DEADLINE_SEC, "ログイン")
+        request = {
+            "op": "login", "login_url": login_url, "username": username, "password": password, "timeout": timeout
+        }
+        response = await self._run(request)
+        if "cookies" in response:
+            return response["cookies"]
+        kind, message = response.get("kind"), response.get("error", "")
+        if kind == "deadline":
+            raise DeadlineExceeded(message)
+        if kind == "auth":
+            raise AmbiError(message)
+        raise TransientError(message)
+
+    async def warm(self) -> None:
+        """
+        ワーカーを起動し、ブラウザを立ち上げておく (起動時の事前準備)
+        """
+        async def warm_one() -> None:
+            response = await self._run({"op": "warm"})
+            if "error" in response:
+                raise TransientError(response["error"])
+
+        await asyncio.gather(*(warm_one() for _ in range(self.size)))
+
+    async def close(self) -> None:
+        workers, self._idle = self._idle, []
+        for worker in workers + self._busy:
+            if worker.alive and worker.process.stdin is not None:
+                # 標準入力を閉じるとワーカーはブラウザを閉じて終了する
+                worker.process.stdin.close()
+        for worker in workers + self._busy:
+            try:
+                await asyncio.wait_for(worker.process.wait(), 5)
+            except asyncio.TimeoutError:
+                await worker.kill()
+
+    def snapshot(self) -> Dict[str, object]:
+        workers = []
+        for state, group in (("idle", self._idle), ("busy", self._busy)):
+            for worker in group:
+                rss = _tree_rss_mb(worker.process.pid) if worker.alive else None
+                workers.append({
+                    "pid": worker.process.pid,
+                    "state": state,
+                    "logins": worker.logins,
+                    "rss_mb": None if rss is None else round(rss, 1),
+                })
+        return {"size": self.size, "max_rss_mb": self.max_rss_mb, "workers": workers}
+
+
+_pool: Optional[LoginWorkerPool] = None
+
+
+def get_pool() -> LoginWorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = LoginWorkerPool()
+    return _pool
+
+
+async def close_pool() -> None:
+    if _pool is not None:
+        await _pool.close()
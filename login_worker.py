@@ -0,0 +1,130 @@
+"""
+Playwrightによるログインを行うワーカープロセス (login_pool.py から起動される)。
+
+標準入力から1行1件のJSONでログイン要求を受け取り、結果を1行のJSONで返す。
+    要求: {"id": 1, "op": "login", "login_url": "...", "username": "...", "password": "...", "timeout": 30}
+          {"id": 2, "op": "warm"}  (ブラウザを起動しておくだけ)
+    応答: {"id": 1, "cookies": {...}} / {"id": 1, "error": "...", "kind": "auth" | "transient" | "deadline"}
+ブラウザは起動したまま使い回し、ログインごとに新しいコンテキスト (Cookieの入れ物) を作る。
+"""
+import asyncio
+import json
+import os
+import sys
+from typing import Dict
+
+import deadline
+from retry_policy import AmbiError, DeadlineExceeded, TransientError
+
+# Playwrightの各操作 (画面遷移・入力・読み込み待ち) のタイムアウト (秒)。残り時間の方が短ければそちらを使う
+LOGIN_STEP_TIMEOUT_SEC = float(os.getenv("AMBI_LOGIN_STEP_TIMEOUT_SEC", "30"))
+
+
+async def submit_login_form(context, login_url: str, username: str, password: str) -> Dict[str, str]:
+    """
+    ブラウザのコンテキストでログインフォームを送信し、取得したCookieを返す。
+    各操作はリクエストの残り時間 (deadline) を超えて待たない。認証に失敗した場合は AmbiError
+    """
+    page = await context.new_page()
+    page.set_default_timeout(deadline.budget(LOGIN_STEP_TIMEOUT_SEC, "ログイン") * 1000)
+    await page.goto(login_url)
+    # ログインフォームへの入力
+    await page.fill('input[name="accLoginID"]', username)
+    await page.fill('input[name="accLoginPW"]', password)
+    await page.click('button.loginbtn')
+
+    # ネットワーク待ち + 画面安定化待ち
+    await page.wait_for_load_state("networkidle")
+    await deadline.sleep(2, "ログイン")
+
+    if "/company_login/login/" in page.url:
+        raise AmbiError("ログイン認証に失敗しました")
+
+    cookies = await context.cookies()
+    return {cookie['name']: cookie['value'] for cookie in cookies}
+
+
+class _Worker:
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+
+    async def _get_browser(self):
+        if self._browser is not None and self._browser.is_connected():
+            return self._browser
+        from playwright.async_api import async_playwright
+
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=True, timeout=deadline.budget(LOGIN_STEP_TIMEOUT_SEC, "ブラウザ起動") * 1000
+        )
+        return self._browser
+
+    async def login(self, request: Dict) -> Dict[str, str]:
+        browser = await self._get_browser()
+        context = await browser.new_context()
+        try:
+            return await submit_login_form(
+                context, request["login_url"], request["username"], request["password"]
+            )
+        finally:
+            await context.close()
+
+    async def handle(self, request: Dict) -> Dict:
+        response: Dict = {"id": request.get("id")}
+        try:
+            if request.get("op") == "warm":
+                await self._get_browser()
+                response["ok"] = True
+            else:
+                response["cookies"] = await deadline.run(
+                    self.login(request), float(request.get("timeout") or deadline.REQUEST_DEADLINE_SEC)
+                )
+        except DeadlineExceeded as e:
+            response.update(error=str(e), kind="deadline")
+        except TransientError as e:
+            response.update(error=str(e), kind="transient")
+        except AmbiError as e:
+            response.update(error=str(e), kind="auth")
+        except Exception as e:
+            # ブラウザ操作のタイムアウト等は再試行で解決しうる
+            response.update(error=f"ログイン処理に失敗しました: {str(e)}", kind="transient")
+        return response
+
+    async def close(self) -> None:
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+
+async def _serve(rpc_out) -> None:
+    worker = _Worker()
+    try:
+        while True:
+            line = await asyncio.to_thread(sys.stdin.readline)
+            if not line:
+                # 親プロセスが終了した (標準入力が閉じられた)
+                break
+            if not line.strip():
+                continue
+            response = await worker.handle(json.loads(line))
+            rpc_out.write(json.dumps(response, ensure_ascii=False) + "\n")
+            rpc_out.flush()
+    finally:
+        await worker.close()
+
+
+def main() -> None:
+    # 標準出力は応答専用にし、ログやブラウザの出力は標準エラー出力へ回す
+    rpc_out = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    from logging_setup import configure_logging
+    configure_logging()
+    asyncio.run(_serve(rpc_out))
+
+
+if __name__ == "__main__":
+    main()
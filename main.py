@@ -1,99 +1,590 @@
-from fastapi import FastAPI
+import asyncio
+import hmac
+import os
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from models import SearchRequest, SearchResponse
 from models import ScoutMessageRequest, ScoutMessageResponse
-from hybrid_client import search_with_hybrid, AmbiHybridClient
+from models import ScoutJobRequest, ScoutJobSubmitResponse, ScoutJobStatusResponse
+from models import ScoutTemplateRequest, ScoutTemplateResponse, ScoutTemplateJobRequest
+from models import CandidateDetailRequest, CandidateDetailResponse
+from hybrid_client import SendTracker, enrich_with_hybrid, search_with_hybrid, send_with_hybrid
+from job_queue import JobStore, ScoutJobRunner
+from send_ledger import SendLedger, send_key
+from session_manager import new_lock_owner
+from scout_template import TemplateStore
+from result_cursor import CursorStore, clamp_limit
+import candidate_cache
+from debug_capture import get_capture
+from logging_setup import configure_logging, set_account_id, set_request_id
+import metrics
+import tracing
+import profiler
+from prewarm import Prewarmer
+from compression import CompressionMiddleware
+import deadline
+from deadline import CancelOnDisconnectMiddleware
+from retry_policy import error_message
+import circuit_breaker
+import session_keepalive
+import login_pool
+import client_registry
+
+configure_logging()
+
+# スカウト送信台帳 (リトライ時の二重送信防止)
+send_ledger = SendLedger()
+# スカウト文面テンプレート (テンプレート送信ジョブで使用)
+template_store = TemplateStore()
+# 一括送信ジョブ (SQLiteに永続化し、バックグラウンドで順次送信)
+job_runner = ScoutJobRunner(JobStore(), send_ledger, template_store)
+# 検索結果カーソル (cursor=True の検索結果をサーバ側に保存して少しずつ返す)
+cursor_store = CursorStore()
+# 重いモジュールの読み込み・ブラウザ起動などの事前準備 (/readyz で完了を確認)
+prewarmer = Prewarmer()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ログインに必要な Playwright が無ければ、リクエストを受ける前に起動を中止する
+    login_pool.check_playwright()
+    # 事前準備は待たずに起動を完了させる (ヘルスチェックにはすぐ応答する)
+    prewarmer.start()
+    await job_runner.start()
+    # 使用中のアカウントのセッションをリクエストの合間に維持する
+    session_keepalive.get_keepalive().start()
+    # 使われなくなったアカウントのクライアントを破棄する
+    client_registry.get_registry().start()
+    yield
+    await prewarmer.stop()
+    await job_runner.stop()
+    await session_keepalive.get_keepalive().stop()
+    await login_pool.close_pool()
+    await client_registry.get_registry().stop()
+    # 書き込み待ちのデバッグ記録を書き切る
+    await get_capture().close()
+
+
+app = FastAPI(title="AMBI Scraping API", lifespan=lifespan)
+
+
+# POST /candidates/details で一度に指定できる候補者IDの数
+MAX_DETAIL_IDS = int(os.getenv("AMBI_DETAIL_MAX_IDS", "200"))
+
+# プロファイル対象のエンドポイント
+PROFILED_PATHS = {"/search", "/scout/send"}
+
+# /debug/* の管理用トークン (未設定なら /debug/* は無効)
+DEBUG_TOKEN = os.getenv("AMBI_DEBUG_TOKEN", "")
+
+
+def _has_debug_token(request: Request) -> bool:
+    """
+    AMBI_DEBUG_TOKEN が設定されていて、X-Debug-Token ヘッダが一致するか
+    """
+    if not DEBUG_TOKEN:
+        return False
+    supplied = request.headers.get("X-Debug-Token", "")
+    return hmac.compare_digest(supplied.encode(), DEBUG_TOKEN.encode())
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    X-Profile: 1 ヘッダ / ?profile=1 (X-Debug-Token が必要) のリクエストと、AMBI_PROFILE_SAMPLE_RATE の割合で
+    選んだリクエストを統計的プロファイラの下で実行し、プロファイルIDを X-Profile-ID ヘッダで返す。
+    指定が無いリクエストでは何もしない。
+    """
+    if request.url.path not in PROFILED_PATHS:
+        return await call_next(request)
+    requested = (
+        (request.headers.get("X-Profile") == "1" or request.query_params.get("profile") == "1")
+        and _has_debug_token(request)
+    )
+    sampled = profiler.PROFILE_SAMPLE_RATE > 0 and random.random() < profiler.PROFILE_SAMPLE_RATE
+    if not requested and not sampled:
+        return await call_next(request)
+
+    active = profiler.try_begin()
+    if active is None:
+        return await call_next(request)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profile_id = profiler.finish(active, f"{request.method} {request.url.path}", started)
+    response.headers["X-Profile-ID"] = profile_id
+    return response
+
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """
+    リクエスト全体をトレースの最上位スパンとして記録する。
+    traceparent ヘッダ (W3C Trace Context) があれば呼び出し元のトレースに繋げ、
+    レスポンスの traceparent ヘッダでトレースIDを返す。
+    """
+    if request.url.path in ("/metrics", "/healthz", "/readyz") or request.url.path.startswith("/debug/"):
+        # 監視・デバッグ用の呼び出しでリングバッファを埋めない
+        return await call_next(request)
+    with tracing.span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent")
+    ) as root:
+        response = await call_next(request)
+        if root is not None:
+            root.set_attribute("status", response.status_code)
+            response.headers["traceparent"] = root.traceparent
+    return response
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    エンドポイントごとの処理時間を記録する (パスはルート定義のテンプレートで集計)
+    """
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        path=getattr(route, "path", "unmatched"),
+        status=str(response.status_code)
+    )
+    return response
+
+
+@app.middleware("http")
+async def attach_request_id(request: Request, call_next):
+    """
+    X-Request-ID (無ければ採番) をログに付け、レスポンスヘッダでも返す
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    set_request_id(request_id)
+    set_account_id(None)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.middleware("http")
+async def guard_debug_endpoints(request: Request, call_next):
+    """
+    /debug/* (アカウント名・内部状態を含む) は AMBI_DEBUG_TOKEN を設定した場合のみ有効にし、
+    X-Debug-Token ヘッダが一致するリクエストにだけ応答する
+    """
+    if not request.url.path.startswith("/debug/"):
+        return await call_next(request)
+    if not DEBUG_TOKEN:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    if not _has_debug_token(request):
+        return JSONResponse(
+            {"status": "error", "message": "X-Debug-Token が正しくありません。"},
+            status_code=401
+        )
+    return await call_next(request)
+
+
+# クライアントが切断した検索は中断する (送信は途中で止めると結果が不明になるため対象外)
+app.add_middleware(CancelOnDisconnectMiddleware, paths={"/search", "/candidates/details"})
+# レスポンス圧縮 (最後に追加したミドルウェアが最も外側になるため、ここで追加する)
+app.add_middleware(CompressionMiddleware)
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    生存確認 (プロセスが応答できれば常に ok)
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    準備完了の確認。事前準備が終わるまでは 503 を返す
+    """
+    body = {
+        "status": "ok" if prewarmer.ready else "warming",
+        "components": prewarmer.components,
+        "elapsed": prewarmer.elapsed,
+    }
+    return JSONResponse(body, status_code=200 if prewarmer.ready else 503)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus 形式のメトリクス
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/debug/traces")
+async def debug_traces(
+    min_duration_ms: float = Query(0, description="この時間(ミリ秒)以上かかったトレースのみ返す"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    直近のトレースの一覧 (新しい順)
+    """
+    return {"traces": tracing.get_buffer().list(min_duration_ms=min_duration_ms, limit=limit)}
+
+
+@app.get("/debug/traces/{trace_id}")
+async def debug_trace_detail(trace_id: str):
+    """
+    1トレース分のスパンをツリー形式で返す
+    """
+    trace = tracing.get_buffer().get(trace_id)
+    if trace is None:
+        return {"status": "error", "message": "指定されたトレースが見つかりません。"}
+    return trace
+
+
+@app.get("/debug/circuits")
+async def debug_circuits():
+    """
+    AMBIへの呼び出しの種類 (login / search / send) ごとのサーキットブレーカーの状態
+    """
+    return {"status": "success", "circuits": circuit_breaker.snapshot()}
+
+
+@app.get("/debug/login-workers")
+async def debug_login_workers():
+    """
+    ログイン用ワーカープロセスの状態 (プロセスID・ログイン回数・メモリ使用量)
+    """
+    return {"status": "success", "isolation": login_pool.LOGIN_ISOLATION, **login_pool.get_pool().snapshot()}
+
+
+@app.get("/debug/clients")
+async def debug_clients():
+    """
+    アカウントごとのクライアントの保持数・使用中の数・破棄した数
+    """
+    return {"status": "success", **client_registry.get_registry().snapshot()}
+
+
+@app.get("/debug/profiles")
+async def debug_profiles():
+    """
+    採取済みプロファイルの一覧 (新しい順)
+    """
+    return {"profiles": profiler.get_store().list()}
+
+
+@app.get("/debug/profiles/{profile_id}")
+async def debug_profile_download(profile_id: str):
+    """
+    プロファイルを folded 形式 (flamegraph.pl / speedscope で読める) で返す
+    """
+    folded = profiler.get_store().get_folded(profile_id)
+    if folded is None:
+        return {"status": "error", "message": "指定されたプロファイルが見つかりません。"}
+    return PlainTextResponse(
+        folded,
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'}
+    )
 
-app = FastAPI(title="AMBI Scraping API")
 
 @app.post("/search", response_model=SearchResponse)
-async def search_ambi(request: SearchRequest):
+async def search_ambi(request: SearchRequest, x_request_timeout: Optional[str] = Header(None)):
     """
-    1) Playwrightでログイン・cookie取得
+    1) 保存済みcookieを再利用 (無ければPlaywrightでログイン・cookie取得)
     2) 取得したcookieを使ってHTTPリクエスト
     3) 結果HTMLを解析→候補者一覧を返す
+    処理時間の上限 (X-Request-Timeout ヘッダ、既定 AMBI_REQUEST_DEADLINE_SEC) に達したら、取得済みの結果を返す。
     """
+    set_account_id(request.username)
     try:
-        candidates = await search_with_hybrid(
-            username=request.username,
-            password=request.password,
-            filters=request.filters
+        result = await deadline.run(
+            search_with_hybrid(
+                username=request.username,
+                password=request.password,
+                filters=request.filters
+            ),
+            deadline.parse_timeout_header(x_request_timeout)
         )
+        candidates = result.candidates
+        # テンプレート送信の差し込み変数として再利用できるよう保持
+        await asyncio.to_thread(candidate_cache.remember, request.username, candidates)
+
+        message = f"検索結果: {len(candidates)}件の候補者が見つかりました"
+        if result.incomplete:
+            message += f"（{result.incomplete}。取得済みの結果のみ返却します）"
+
+        if request.cursor:
+            cursor_id = await asyncio.to_thread(
+                cursor_store.create, request.username, request.password, candidates, result.incomplete is not None, message
+            )
+            page = await asyncio.to_thread(
+                cursor_store.read, cursor_id, request.username, request.password, 0, clamp_limit(request.page_size)
+            )
+            return _cursor_response(page)
 
         return SearchResponse(
             status="success",
             candidates=candidates,
-            message=f"検索結果: {len(candidates)}件の候補者が見つかりました"
+            message=message,
+            partial=result.incomplete is not None
         )
 
     except Exception as e:
-        error_message = str(e)
-        if "ログイン認証に失敗" in error_message:
-            message = "ログインに失敗しました。認証情報を確認してください。"
-        elif "最大リトライ回数" in error_message:
-            message = "一時的なエラーが発生しました。しばらく時間をおいて再試行してください。"
-        else:
-            message = f"エラーが発生しました: {error_message}"
+        return SearchResponse(
+            status="error",
+            candidates=[],
+            message=error_message(e, deadline_hint="条件を絞るか、しばらく時間をおいて再試行してください。")
+        )
+
+
+def _cursor_response(page) -> SearchResponse:
+    return SearchResponse(
+        status="success",
+        candidates=page.candidates,
+        message=page.message,
+        partial=page.partial,
+        cursor_id=page.cursor_id,
+        total=page.total,
+        offset=page.offset,
+        next_offset=page.next_offset
+    )
+
 
+@app.get("/search/cursor/{cursor_id}", response_model=SearchResponse)
+async def search_cursor(
+    cursor_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = None,
+    x_ambi_username: str = Header(...),
+    x_ambi_password: str = Header(...)
+):
+    """
+    cursor=True の検索で保存した結果を offset から limit 件ずつ返す
+    (next_offset が null になるまで繰り返し呼ぶ)。検索時と同じユーザー名・パスワードをヘッダで指定する。
+    """
+    page = await asyncio.to_thread(
+        cursor_store.read, cursor_id, x_ambi_username, x_ambi_password, offset, clamp_limit(limit)
+    )
+    if page is None:
         return SearchResponse(
             status="error",
             candidates=[],
-            message=message
+            message="指定されたカーソルが見つかりません（有効期限切れの可能性があります）。"
+        )
+    return _cursor_response(page)
+
+
+@app.delete("/search/cursor/{cursor_id}")
+async def search_cursor_delete(
+    cursor_id: str,
+    x_ambi_username: str = Header(...),
+    x_ambi_password: str = Header(...)
+):
+    """
+    読み終えたカーソルを有効期限を待たずに削除する
+    """
+    if not await asyncio.to_thread(cursor_store.delete, cursor_id, x_ambi_username, x_ambi_password):
+        return {"status": "error", "message": "指定されたカーソルが見つかりません。"}
+    return {"status": "success", "message": "カーソルを削除しました。"}
+
+
+@app.post("/candidates/details", response_model=CandidateDetailResponse)
+async def candidate_details(request: CandidateDetailRequest, x_request_timeout: Optional[str] = Header(None)):
+    """
+    検索結果の候補者ID (ids) について、候補者詳細ページから職務経歴・自己PRなどを取得する。
+    ログインに成功した後、このアカウントで有効期限内に取得済みの候補者はキャッシュから返し
+    (refresh=True なら取得し直す)、残りは AMBI_DETAIL_CONCURRENCY 件ずつ並行して取得する。結果は ids の順に返す。
+    取得できなかった候補者は errors に理由を入れ、取得できた分だけ返す。
+    """
+    set_account_id(request.username)
+    # 重複を除く (順序は保つ)
+    ids = list(dict.fromkeys(request.ids))
+    if len(ids) > MAX_DETAIL_IDS:
+        return CandidateDetailResponse(
+            status="error",
+            message=f"一度に指定できる候補者は{MAX_DETAIL_IDS}件までです。"
         )
 
+    try:
+        result = await deadline.run(
+            enrich_with_hybrid(request.username, request.password, ids, refresh=request.refresh),
+            deadline.parse_timeout_header(x_request_timeout)
+        )
+    except Exception as e:
+        return CandidateDetailResponse(
+            status="error",
+            message=error_message(e, deadline_hint="件数を減らすか、しばらく時間をおいて再試行してください。")
+        )
+
+    details = result.details
+    await asyncio.to_thread(candidate_cache.remember, request.username, details)
+
+    message = f"候補者詳細: {len(details)}件を取得しました（うちキャッシュ {result.cached}件）"
+    if result.incomplete:
+        message += f"（{result.incomplete}。取得済みの結果のみ返却します）"
+    elif result.errors:
+        message += f"（{len(result.errors)}件は取得できませんでした）"
+    return CandidateDetailResponse(
+        status="success" if details or not result.errors else "error",
+        candidates=details,
+        message=message,
+        cached=result.cached,
+        errors=result.errors,
+        partial=bool(result.errors)
+    )
+
+
 @app.post("/scout/send", response_model=ScoutMessageResponse)
-async def scout_send(request: ScoutMessageRequest):
+async def scout_send(
+    request: ScoutMessageRequest,
+    idempotency_key: Optional[str] = Header(None),
+    x_request_timeout: Optional[str] = Header(None)
+):
     """
     スカウトメッセージ送信エンドポイント
-    1) Playwrightでログイン (Cookie取得)
+    0) 送信台帳を確認し、送信済みなら記録済みの結果を返す (Idempotency-Key ヘッダでもキー指定可)
+    1) 保存済みCookieを再利用 (無ければPlaywrightでログインしてCookie取得)
     2) (追加) 送信前に scout_list_message_frame を呼んでサーバ状態を整える
     3) send_scout_message() でスカウト送信
     """
-    client = AmbiHybridClient()
+    set_account_id(request.username)
+    if idempotency_key and not request.idempotency_key:
+        request.idempotency_key = idempotency_key
+
+    # (0) 送信台帳の確認
+    key = send_key(request.username, request)
+    owner = new_lock_owner()
+    recorded = await asyncio.to_thread(send_ledger.begin, key, request.username, request, owner)
+    if recorded is not None:
+        return recorded
+
+    # 送信POSTの後で失敗した場合は、送信されたかどうか分からないため再送できない状態で記録する
+    tracker = SendTracker()
+
+    async def login_and_send() -> ScoutMessageResponse:
+        # アカウントごとのクライアント (Cookie・HTTPセッション) をリクエスト間で使い回す
+        async with client_registry.lease(request.username) as client:
+            # (1) ログイン (セッション切れの場合は送信時に再ログイン)
+            await client.ensure_login(
+                username=request.username,
+                password=request.password
+            )
+
+            # (2)(3) 事前リクエスト + スカウトメッセージ送信
+            return await send_with_hybrid(client, request, tracker)
+
+    try:
+        response = await deadline.run(login_and_send(), deadline.parse_timeout_header(x_request_timeout))
+
+    except Exception as e:
+        if tracker.in_doubt:
+            return await asyncio.to_thread(send_ledger.finish_unknown, key, owner, str(e))
+        response = ScoutMessageResponse(
+            status="error",
+            message=error_message(e, prefix="スカウト送信時にエラーが発生")
+        )
+    except BaseException:
+        # タスクの取り消し (シャットダウンなど)。台帳を pending のまま残さない
+        await asyncio.shield(asyncio.to_thread(send_ledger.abandon, key, owner, tracker.in_doubt))
+        raise
+
+    await asyncio.to_thread(send_ledger.finish, key, owner, response)
+    return response
+
+@app.post("/scout/jobs", response_model=ScoutJobSubmitResponse)
+async def scout_job_submit(request: ScoutJobRequest):
+    """
+    一括送信ジョブの登録エンドポイント
+    - 送信内容をローカルDBに保存してジョブIDを即時返却する
+    - 実際の送信はバックグラウンドのワーカーが順次行う (進捗は /jobs/{job_id} で確認)
+    """
+    if not request.items:
+        return ScoutJobSubmitResponse(
+            status="error",
+            message="送信アイテムが空です。"
+        )
 
     try:
-        # (1) ログイン
-        await client.login_with_playwright(
-            username=request.username,
-            password=request.password
+        job_id = await job_runner.submit(request)
+    except Exception as e:
+        return ScoutJobSubmitResponse(
+            status="error",
+            message=f"ジョブの登録に失敗しました: {str(e)}"
         )
 
-        # (2) cURL相当の事前リクエスト
-        #     search_id が指定されていればfetch実行
-        if request.search_id:
-            try:
-                await client.fetch_scout_list_frame(
-                    SID=request.UID,
-                    search_id=request.search_id
-                )
-            except Exception as ex:
-                # 事前リクエスト失敗したらログ残して続行するか、エラー返すかは運用判断
-                # ここではエラー返却にする
-                return ScoutMessageResponse(
-                    status="error",
-                    message=f"事前リクエストに失敗しました: {str(ex)}"
-                )
-
-        # (3) スカウトメッセージ送信
-        success = await client.send_scout_message(request)
-        if success:
-            return ScoutMessageResponse(
-                status="success",
-                message="スカウトメッセージの送信に成功しました。"
-            )
-        else:
-            return ScoutMessageResponse(
-                status="error",
-                message="スカウトメッセージの送信に失敗しました。"
-            )
+    return ScoutJobSubmitResponse(
+        status="success",
+        job_id=job_id,
+        message=f"{len(request.items)}件の送信ジョブを登録しました"
+    )
 
+@app.get("/jobs/{job_id}", response_model=ScoutJobStatusResponse)
+async def scout_job_status(job_id: str):
+    """
+    一括送信ジョブの進捗と1件ごとの送信結果を返す
+    """
+    job_status = await job_runner.status(job_id)
+    if job_status is None:
+        return ScoutJobStatusResponse(
+            status="error",
+            job_id=job_id,
+            message="指定されたジョブが見つかりません。"
+        )
+    return job_status
+
+@app.post("/scout/templates", response_model=ScoutTemplateResponse)
+async def scout_template_register(request: ScoutTemplateRequest):
+    """
+    スカウト文面テンプレートの登録エンドポイント
+    - {{変数名}} を含む件名/本文を登録し、テンプレートIDを返す (同じ内容なら同じID)
+    - 登録時に1度だけコンパイルし、送信時は差し込みのみ行う
+    """
+    try:
+        template_id = await asyncio.to_thread(template_store.register, request)
     except Exception as e:
-        error_message = str(e)
-        if "ログイン認証に失敗" in error_message:
-            msg = "ログインに失敗しました。認証情報を確認してください。"
-        else:
-            msg = f"スカウト送信時にエラーが発生: {error_message}"
+        return ScoutTemplateResponse(
+            status="error",
+            message=f"テンプレートの登録に失敗しました: {str(e)}"
+        )
 
-        return ScoutMessageResponse(
+    return ScoutTemplateResponse(
+        status="success",
+        template_id=template_id,
+        variables=template_store.get(template_id).variables,
+        message="テンプレートを登録しました"
+    )
+
+@app.post("/scout/jobs/templated", response_model=ScoutJobSubmitResponse)
+async def scout_templated_job_submit(request: ScoutTemplateJobRequest):
+    """
+    テンプレート送信ジョブの登録エンドポイント
+    - 各アイテムは UID と差し込み変数のみを持ち、文面はサーバー側でテンプレートから生成する
+    - 差し込み変数は検索済み候補者の項目 (company, age, location など) も利用できる
+    """
+    if not request.items:
+        return ScoutJobSubmitResponse(
             status="error",
-            message=msg
+            message="送信アイテムが空です。"
         )
+
+    try:
+        job_id = await job_runner.submit_templated(request)
+    except Exception as e:
+        return ScoutJobSubmitResponse(
+            status="error",
+            message=f"ジョブの登録に失敗しました: {str(e)}"
+        )
+
+    return ScoutJobSubmitResponse(
+        status="success",
+        job_id=job_id,
+        message=f"{len(request.items)}件の送信ジョブを登録しました"
+    )
@@ -0,0 +1,270 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Prometheus テキスト形式のメトリクス (外部ライブラリなしの最小実装)
+
+# 処理時間ヒストグラムの既定バケット (秒)
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+_INF_LABEL = 'le="+Inf"'
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値ごとに [バケット別件数..., 合計, 件数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, _INF_LABEL)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ----------------------------------------
+# AMBIクライアントのフェーズ別メトリクス
+# phase: login / c13ct_token / search_page / parse / scout_list_frame / scout_send
+# ----------------------------------------
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    "ambi_phase_duration_seconds", "AMBIクライアントの処理フェーズ別の所要時間", ["phase"]
+))
+PHASE_FAILURES = REGISTRY.register(Counter(
+    "ambi_phase_failures_total", "AMBIクライアントの処理フェーズ別の失敗回数", ["phase", "kind"]
+))
+RETRIES = REGISTRY.register(Counter(
+    "ambi_retries_total", "ステップ単位の再試行回数 (失敗の分類別)", ["kind"]
+))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    "ambi_upstream_responses_total", "AMBIからの応答件数 (ステータス別、通信エラーは error)", ["method", "status"]
+))
+UPSTREAM_BYTES = REGISTRY.register(Counter(
+    "ambi_upstream_response_bytes_total", "AMBIから受信した本文のバイト数 (圧縮されていれば圧縮後)", ["method"]
+))
+COMPRESSION_BYTES = REGISTRY.register(Counter(
+    "ambi_compression_bytes_total",
+    "圧縮の対象になった本文のバイト数 (direction: upstream / response、stage: original=展開後 / transferred=転送量)",
+    ["direction", "stage"]
+))
+LOGINS = REGISTRY.register(Counter(
+    "ambi_logins_total", "ログイン状態の取得方法 (login: Playwrightでログイン / reused: 保存済みCookie / shared: ほかのワーカーのログイン結果)", ["result"]
+))
+TOKEN_CACHE = REGISTRY.register(Counter(
+    "ambi_token_cache_total", "C13CTトークンの共有キャッシュの利用結果", ["result"]
+))
+SEARCH_PAGES = REGISTRY.register(Counter(
+    "ambi_search_pages_total", "取得した検索結果ページ数"
+))
+CANDIDATES = REGISTRY.register(Counter(
+    "ambi_candidates_total", "検索結果から抽出した候補者数"
+))
+CIRCUIT_TRANSITIONS = REGISTRY.register(Counter(
+    "ambi_circuit_transitions_total", "サーキットブレーカーの状態遷移回数 (circuit: login / search / send)", ["circuit", "state"]
+))
+CIRCUIT_REJECTIONS = REGISTRY.register(Counter(
+    "ambi_circuit_rejections_total", "遮断中のためAMBIに送らずに失敗させた呼び出し数", ["circuit"]
+))
+KEEPALIVES = REGISTRY.register(Counter(
+    "ambi_session_keepalive_total",
+    "バックグラウンドでのセッション確認の結果 (ok / relogin / login / skipped / error)", ["result"]
+))
+LOGIN_WORKER_RESTARTS = REGISTRY.register(Counter(
+    "ambi_login_worker_restarts_total",
+    "ログイン用ワーカープロセスを終了した回数 (crash / memory / recycle / cancel)", ["reason"]
+))
+CLIENTS = REGISTRY.register(Gauge(
+    "ambi_clients", "保持しているアカウントごとのクライアント数 (state: live=保持中 / in_use=使用中)", ["state"]
+))
+CLIENT_EVICTIONS = REGISTRY.register(Counter(
+    "ambi_client_evictions_total", "破棄したアカウントごとのクライアント数 (reason: lru / idle)", ["reason"]
+))
+CANDIDATES_FILTERED = REGISTRY.register(Counter(
+    "ambi_candidates_filtered_total", "手元での絞り込み条件 (local_filters) で除外した候補者数"
+))
+
+# ----------------------------------------
+# APIエンドポイントのメトリクス
+# ----------------------------------------
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "ambi_http_request_duration_seconds", "APIリクエストの処理時間", ["method", "path", "status"]
+))
+CANCELLATIONS = REGISTRY.register(Counter(
+    "ambi_request_cancellations_total", "中断したAPIリクエスト数 (deadline: 処理時間の上限 / disconnect: クライアントの切断)", ["reason"]
+))
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    with ブロックの所要時間を PHASE_SECONDS に記録し、例外が出たら PHASE_FAILURES に数える
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        PHASE_FAILURES.inc(phase=name, kind=getattr(e, "kind", type(e).__name__))
+        raise
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - started, phase=name)
+
+
+def timed(name: str) -> Callable:
+    """
+    関数 (同期・非同期どちらも可) の実行を phase(name) で計測するデコレータ
+    """
+    def decorator(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with phase(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    return REGISTRY.render()
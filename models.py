@@ -1,9 +1,21 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Optional, List, Dict
 
 # ----------------------------------------
 # 絞り込み条件モデル
 # ----------------------------------------
+class CandidatePredicate(BaseModel):
+    """
+    AMBIの検索条件では指定できない項目を、取得した候補者に対して手元で絞り込む条件
+    - field: CandidateData の項目名 (location, language, age など)
+    - op: eq / ne / contains / not_contains / in / gte / lte
+    - value: 比較する値 (in はリスト)
+    """
+    field: str
+    op: str = "contains"
+    value: Any
+
+
 class AmbiSearchFilter(BaseModel):
     """
     AMBIの検索フォーム (例: scout/index/action/?PK=CC1E9D) を想定
@@ -32,6 +44,11 @@ class AmbiSearchFilter(BaseModel):
     # fetch_all_pages=Falseの場合の最大ページ数 (1 => 1ページのみ)
     max_pages: Optional[int] = 1
 
+    # 手元での絞り込み条件 (すべて満たす候補者のみ返す)。ページを解析するたびに適用する
+    local_filters: List[CandidatePredicate] = []
+    # 返す候補者数の上限。条件を満たす候補者がこの件数に達したら残りのページは取得しない
+    limit: Optional[int] = None
+
 
 # ----------------------------------------
 # 候補者情報(スクレイピング結果)モデル
@@ -51,6 +68,17 @@ class CandidateData(BaseModel):
     summary: Optional[str]
 
 
+class CandidateDetail(CandidateData):
+    """
+    候補者詳細ページから取得した情報 (一覧と共通の項目 + 詳細ページにのみある項目)
+    """
+    resume: Optional[str]              # 職務経歴の全文 (一覧の summary は省略されている)
+    self_pr: Optional[str]             # 自己PR
+    careers: List[str] = []            # 職歴 (1社ごと)
+    qualifications: List[str] = []     # 資格
+    sections: Dict[str, str] = {}      # 見出し付きの全項目 {見出し: 本文} (上記以外の項目も含む)
+
+
 # ----------------------------------------
 # API リクエスト/レスポンスモデル（検索用）
 # ----------------------------------------
@@ -59,23 +87,52 @@ class SearchRequest(BaseModel):
     password: str
     target_url: Optional[str] = None
     filters: AmbiSearchFilter
+    # True の場合、結果をサーバ側に保存してカーソルIDと先頭の page_size 件だけを返す
+    # (残りは GET /search/cursor/{cursor_id} で取得)
+    cursor: bool = False
+    page_size: Optional[int] = None
 
 
 class SearchResponse(BaseModel):
     status: str
     candidates: List[CandidateData] = []
     message: str
+    # 途中のページで取得に失敗し、取得済みの結果のみを返した場合 True
+    partial: bool = False
+    # カーソルモードの場合のみ: 結果全体の件数と、candidates の位置・次の取得位置
+    cursor_id: Optional[str] = None
+    total: Optional[int] = None
+    offset: Optional[int] = None
+    next_offset: Optional[int] = None
+
+
+class CandidateDetailRequest(BaseModel):
+    username: str
+    password: str
+    ids: List[int]                     # 候補者ID (検索結果の id)
+    refresh: bool = False              # True ならキャッシュを使わずに取得し直す
+
+
+class CandidateDetailResponse(BaseModel):
+    status: str
+    candidates: List[CandidateDetail] = []
+    message: str
+    # キャッシュから返した件数
+    cached: int = 0
+    # 取得できなかった候補者ID と理由
+    errors: Dict[int, str] = {}
+    # 処理時間の上限などで、一部の候補者を取得していない場合 True
+    partial: bool = False
 
 
 # ----------------------------------------
 # スカウトメッセージ送信用モデル
 # ----------------------------------------
-class ScoutMessageRequest(BaseModel):
+class ScoutMessageContent(BaseModel):
     """
-    スカウトメッセージ送信APIのリクエストボディ
+    スカウトメッセージ1通分の送信内容 (ログイン情報を除く)
+    一括送信ジョブの各アイテムとしても使用する
     """
-    username: str            # ログインユーザー
-    password: str            # パスワード
     UID: int                 # ユーザーID
     ScoutType: int           # スカウトタイプ
     attachedWorkIDs: List[int]  # 添付求人IDを複数指定できる
@@ -99,6 +156,18 @@ class ScoutMessageRequest(BaseModel):
     # 送信前に fetch_scout_list_frame() を呼ぶ際に使用
     search_id: Optional[int] = None
 
+    # 冪等性キー (任意)。同じキーの再送は記録済みの結果を返し、二重送信しない
+    # 未指定の場合は (アカウント, UID, ScoutType, 送信内容) から自動生成する
+    idempotency_key: Optional[str] = None
+
+
+class ScoutMessageRequest(ScoutMessageContent):
+    """
+    スカウトメッセージ送信APIのリクエストボディ
+    """
+    username: str            # ログインユーザー
+    password: str            # パスワード
+
 
 class ScoutMessageResponse(BaseModel):
     """
@@ -106,3 +175,104 @@ class ScoutMessageResponse(BaseModel):
     """
     status: str
     message: str
+    # 送信台帳に記録済みの結果を返した場合 True (AMBIへは送信していない)
+    replayed: bool = False
+
+
+# ----------------------------------------
+# 一括送信ジョブ用モデル
+# ----------------------------------------
+class ScoutJobRequest(BaseModel):
+    """
+    一括送信ジョブの登録リクエスト
+    """
+    username: str
+    password: str
+    items: List[ScoutMessageContent]
+
+
+class ScoutJobSubmitResponse(BaseModel):
+    status: str
+    job_id: Optional[str] = None
+    message: str
+
+
+class ScoutJobItemResult(BaseModel):
+    index: int
+    UID: int
+    state: str               # pending / running / success / error / unknown (送信結果不明)
+    message: Optional[str] = None
+    updated_at: Optional[str] = None
+
+
+class ScoutJobStatusResponse(BaseModel):
+    """
+    /jobs/{job_id} のレスポンス
+    """
+    status: str
+    job_id: str
+    state: Optional[str] = None   # queued / running / done
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    pending: int = 0
+    items: List[ScoutJobItemResult] = []
+    message: str = ""
+
+
+# ----------------------------------------
+# テンプレート送信用モデル
+# ----------------------------------------
+class ScoutTemplateRequest(BaseModel):
+    """
+    スカウト文面テンプレートの登録リクエスト
+    {{変数名}} の部分が送信時にアイテムごとの値で置換される
+    """
+    Title: str
+    Body: str
+    rescoutTitle: Optional[str] = None
+    rescoutBody: Optional[str] = None
+
+
+class ScoutTemplateResponse(BaseModel):
+    status: str
+    template_id: Optional[str] = None
+    variables: List[str] = []     # テンプレート中の変数名
+    message: str
+
+
+class ScoutTemplateItem(BaseModel):
+    """
+    テンプレート送信ジョブの1件分 (UIDと差し込み変数のみ)
+    """
+    UID: int
+    variables: Dict[str, str] = {}
+    idempotency_key: Optional[str] = None
+
+
+class ScoutTemplateJobSpec(BaseModel):
+    """
+    テンプレート送信ジョブの全アイテム共通の送信設定
+    """
+    template_id: str
+    ScoutType: int
+    attachedWorkIDs: List[int]
+
+    ReplyDeadline: Optional[str] = None
+    isScout: Optional[int] = None
+    sendPage: Optional[int] = None
+
+    rescout: Optional[int] = None
+    retransmission: Optional[int] = None
+    rescoutTransSelect: Optional[int] = None
+
+    search_id: Optional[int] = None
+
+
+class ScoutTemplateJobRequest(ScoutTemplateJobSpec):
+    """
+    テンプレート送信ジョブの登録リクエスト
+    """
+    username: str
+    password: str
+    items: List[ScoutTemplateItem]
@@ -0,0 +1,78 @@
+import logging
+import re
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+_PER_PAGE_RE = re.compile(r"per_page=(\d+)")
+
+
+class PagePlan(NamedTuple):
+    """
+    2ページ目以降に取得する per_page (オフセット) の一覧
+    - source: hit_count (ヒット件数から算出) / links (ページ下部のリンクのみ)
+    """
+    offsets: List[int]
+    total: Optional[int]
+    page_size: Optional[int]
+    source: str
+
+
+def parse_hit_count(soup) -> Optional[int]:
+    """
+    検索結果のヒット件数 (<p class="hitNum"><span class="num">1,234</span>件</p>) を返す
+    """
+    node = soup.select_one(".hitNum .num") or soup.select_one(".hitNum")
+    if node is None:
+        return None
+    m = re.search(r"\d[\d,]*", node.get_text(strip=True))
+    if m is None:
+        return None
+    return int(m.group(0).replace(",", ""))
+
+
+def link_offsets(soup) -> List[int]:
+    """
+    ページ下部のリンク (ul.pageList) に含まれる per_page= の値
+    """
+    offsets = set()
+    for link in soup.select("ul.pageList li a.link"):
+        m = _PER_PAGE_RE.search(link.get("href", ""))
+        if m and int(m.group(1)) > 0:
+            offsets.add(int(m.group(1)))
+    return sorted(offsets)
+
+
+def plan_pages(soup, first_page_count: int) -> PagePlan:
+    """
+    1ページ目のHTMLから、取得すべき全ページのオフセットを算出する。
+    ページ下部のリンクは現在ページ周辺しか表示されないことがあるため、
+    ヒット件数と1ページの件数から全ページ分を計算し、リンクとは突き合わせのみ行う。
+    ヒット件数が読めない場合はリンクに表示されたページのみを返す。
+    """
+    links = link_offsets(soup)
+    total = parse_hit_count(soup)
+
+    # 1ページの件数: 2ページ目へのリンクのオフセット (無ければ1ページ目の件数)
+    page_size = links[0] if links else first_page_count
+    if links and first_page_count and first_page_count != page_size and total and total > first_page_count:
+        logger.warning(
+            "1ページ目の件数 (%d) とページリンクから求めた1ページの件数 (%d) が一致しません",
+            first_page_count, page_size
+        )
+
+    if total is None or not page_size:
+        if links:
+            logger.warning("ヒット件数が読み取れないため、表示されているページリンクのみ取得します")
+        return PagePlan(links, total, page_size or None, "links")
+
+    offsets = list(range(page_size, total, page_size))
+    unexpected = sorted(set(links) - set(offsets))
+    if unexpected:
+        # 算出したページと食い違うリンクがあれば、取りこぼさないようそれも取得する
+        logger.warning(
+            "ヒット件数 (%d件, %d件/ページ) から算出したページに無いリンクがあります: %s",
+            total, page_size, unexpected
+        )
+        offsets = sorted(set(offsets) | set(unexpected))
+    return PagePlan(offsets, total, page_size, "hit_count")
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 起動時にChromiumを一度起動して閉じる (ブラウザ本体をページキャッシュに載せる)。
+# ログイン用ワーカープロセスを使う場合は、ワーカーを起動してブラウザを立ち上げておく
+PREWARM_BROWSER = os.getenv("AMBI_PREWARM_BROWSER", "1") == "1"
+# 起動時にAMBIへのHTTP接続を1本開いておく
+PREWARM_CONNECTION = os.getenv("AMBI_PREWARM_CONNECTION", "1") == "1"
+
+_SAMPLE_HTML = """
+<div class="userSet"><input class="js_sid" value="1"><div class="num">No.1</div>
+<div class="prof">男性 30歳 / 東京都</div></div>
+<ul class="pageList"><li><a class="link" href="?per_page=50">2</a></li></ul>
+"""
+
+
+def _warm_parser() -> None:
+    from scraper import extract_candidates_from_html
+    extract_candidates_from_html(_SAMPLE_HTML)
+
+
+def _import_http() -> None:
+    import aiohttp  # noqa: F401
+    import aiohttp.client  # noqa: F401
+
+
+async def _warm_http() -> None:
+    await asyncio.to_thread(_import_http)
+    if not PREWARM_CONNECTION:
+        return
+    import aiohttp
+    from hybrid_client import AmbiHybridClient, _new_session
+
+    # 共有コネクタでAMBIへのDNS解決とTCP/TLS接続を済ませておく (接続は次のリクエストで使い回される)
+    async with _new_session() as session:
+        async with session.head(
+            AmbiHybridClient.BASE_URL + "/", allow_redirects=False, timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            await response.read()
+
+
+async def _warm_browser() -> None:
+    from login_pool import LOGIN_ISOLATION, get_pool
+
+    if LOGIN_ISOLATION == "process":
+        # ログイン用ワーカーを起動し、ブラウザを立ち上げた状態で待機させる
+        await get_pool().warm()
+        return
+
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        await browser.close()
+
+
+class Prewarmer:
+    """
+    起動直後にバックグラウンドで重いモジュールの読み込みと初期化を済ませる。
+    各コンポーネントの状態は pending / ok / error で、/readyz はすべて終わるまで 503 を返す。
+    prewarm の失敗は致命的ではない (最初のリクエストで改めて読み込まれる) ため ready にはなる。
+    """
+
+    def __init__(self, browser: bool = PREWARM_BROWSER):
+        self.components: Dict[str, str] = {"parser": "pending", "http": "pending"}
+        if browser:
+            self.components["browser"] = "pending"
+        self.elapsed: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(state != "pending" for state in self.components.values())
+
+    async def _run_one(self, name: str, coro) -> None:
+        started = time.perf_counter()
+        try:
+            await coro
+            self.components[name] = "ok"
+        except Exception as e:
+            self.components[name] = f"error: {e}"
+            logger.warning("%s の事前準備に失敗しました: %s", name, e)
+        self.elapsed[name] = round(time.perf_counter() - started, 3)
+
+    async def _run(self) -> None:
+        jobs = [
+            self._run_one("parser", asyncio.to_thread(_warm_parser)),
+            self._run_one("http", _warm_http()),
+        ]
+        if "browser" in self.components:
+            jobs.append(self._run_one("browser", _warm_browser()))
+        await asyncio.gather(*jobs)
+        logger.info("事前準備が完了しました: %s", self.components)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
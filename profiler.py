@@ -0,0 +1,127 @@
+import datetime
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+# 指定なしのリクエストを自動でプロファイルする割合 (0 なら X-Profile ヘッダ / ?profile=1 のときのみ)
+PROFILE_SAMPLE_RATE = float(os.getenv("AMBI_PROFILE_SAMPLE_RATE", "0"))
+# スタックを採取する間隔 (秒)
+PROFILE_INTERVAL = float(os.getenv("AMBI_PROFILE_INTERVAL", "0.005"))
+# 保持するプロファイル件数
+PROFILE_BUFFER_SIZE = int(os.getenv("AMBI_PROFILE_BUFFER", "20"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    統計的プロファイラ。
+    別スレッドから一定間隔で対象スレッドのスタックを採取し、
+    folded 形式 ("親;子;孫 件数"、flamegraph.pl / speedscope で読める) で集計する。
+    対象スレッドの処理には手を入れないため、計測中も実行速度はほぼ変わらない。
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="ambi-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfileStore:
+    """
+    採取したプロファイルを直近 max_profiles 件だけ保持する
+    """
+
+    def __init__(self, max_profiles: int = PROFILE_BUFFER_SIZE):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float, profiler: SamplingProfiler) -> str:
+        profile_id = uuid.uuid4().hex
+        with self._lock:
+            self._profiles[profile_id] = {
+                "profile_id": profile_id,
+                "name": name,
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "duration_ms": round(duration * 1000, 3),
+                "samples": sum(profiler.samples.values()),
+                "folded": profiler.folded(),
+            }
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [
+            {k: v for k, v in p.items() if k != "folded"}
+            for p in reversed(profiles)
+        ]
+
+    def get_folded(self, profile_id: str) -> Optional[str]:
+        with self._lock:
+            profile = self._profiles.get(profile_id)
+        return None if profile is None else profile["folded"]
+
+
+_store = ProfileStore()
+# 同時に採取するプロファイルは1件のみ (サンプラーはスレッド単位なので、重ねても同じものが取れるだけ)
+_active = threading.Lock()
+
+
+def get_store() -> ProfileStore:
+    return _store
+
+
+def try_begin() -> Optional[SamplingProfiler]:
+    """
+    呼び出し元スレッドのプロファイルを開始する。ほかのプロファイルを採取中なら None
+    """
+    if not _active.acquire(blocking=False):
+        return None
+    profiler = SamplingProfiler(threading.get_ident())
+    profiler.start()
+    return profiler
+
+
+def finish(profiler: SamplingProfiler, name: str, started: float) -> str:
+    try:
+        profiler.stop()
+        return _store.add(name, time.perf_counter() - started, profiler)
+    finally:
+        _active.release()
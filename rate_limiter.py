@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 1アカウントあたりの定常リクエストレート (回/秒)
+RATE_PER_SEC = float(os.getenv("AMBI_RATE_PER_SEC", "1.0"))
+# バースト許容数 (バケット容量)
+RATE_BURST = float(os.getenv("AMBI_RATE_BURST", "2"))
+# バックオフ時の下限レート (回/秒)
+RATE_MIN = float(os.getenv("AMBI_RATE_MIN", "0.2"))
+# エラー時にレートへ掛ける係数 (乗算的減少)
+RATE_BACKOFF_FACTOR = float(os.getenv("AMBI_RATE_BACKOFF", "0.5"))
+# 正常応答1回ごとに戻すレート (加算的増加)
+RATE_RECOVERY_STEP = float(os.getenv("AMBI_RATE_RECOVERY", "0.1"))
+# これより遅い応答は「混雑」とみなしてレートを下げる (秒)
+SLOW_RESPONSE_SEC = float(os.getenv("AMBI_SLOW_RESPONSE_SEC", "5.0"))
+# shared: 送信枠を同じホストの全ワーカープロセスで共有する (uvicorn --workers N でもアカウントあたりのレートは変わらない)
+# local: プロセスごとに制御する (アカウントあたりのレートはワーカー数倍になる)
+RATE_SCOPE = os.getenv("AMBI_RATE_SCOPE", "shared")
+# 送信枠を共有するローカル状態DB (ログインCookieなどと同じ)
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ambi_rate_schedule (
+    username      TEXT PRIMARY KEY,
+    tat           REAL NOT NULL,
+    blocked_until REAL NOT NULL
+);
+"""
+
+
+class SharedSchedule:
+    """
+    アカウントごとの送信枠をワーカープロセス間で共有する (GCRA: 次の送信枠の時刻をDBに持つ)。
+    reserve() は1つのUPSERT文で送信枠を1つ予約し、その時刻までの待ち時間を返す。
+    429 の Retry-After による停止も共有し、全プロセスがその時刻まで送らない。
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def reserve(self, account: str, interval: float, burst: float, blocked_until: float = 0.0) -> float:
+        """
+        interval 秒に1回 (burst 回までまとめて可) のペースで送信枠を予約し、送ってよい時刻までの秒数を返す
+        """
+        now = time.time()
+        with self._lock:
+            tat, blocked = self._conn.execute(
+                "INSERT INTO ambi_rate_schedule VALUES (?, MAX(?, ?) + ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET "
+                "blocked_until = MAX(ambi_rate_schedule.blocked_until, excluded.blocked_until), "
+                "tat = MAX(ambi_rate_schedule.tat, ?, "
+                "MAX(ambi_rate_schedule.blocked_until, excluded.blocked_until)) + ? "
+                "RETURNING tat, blocked_until",
+                (account, now, blocked_until, interval, blocked_until, now, interval)
+            ).fetchone()
+        allowed_at = max(tat - interval - (burst - 1) * interval, blocked)
+        return max(0.0, allowed_at - now)
+
+
+_schedule: Optional[SharedSchedule] = None
+_schedule_lock = threading.Lock()
+
+
+def get_schedule() -> SharedSchedule:
+    global _schedule
+    if _schedule is None:
+        with _schedule_lock:
+            if _schedule is None:
+                _schedule = SharedSchedule()
+    return _schedule
+
+
+class AdaptiveRateLimiter:
+    """
+    トークンバケット方式のレートリミッタ。
+    - acquire() でトークンを1つ消費し、足りなければ補充されるまで待機する
+    - record() で応答結果をフィードバックし、429/5xx/通信エラー/遅延応答ではレートを下げ、
+      正常応答が続けば設定レートまで徐々に戻す (AIMD)
+    - 429 の Retry-After が指定されていれば、その間は全リクエストを止める
+    account を指定し RATE_SCOPE=shared の場合、トークンはワーカープロセス間で共有する送信枠 (SharedSchedule) から取る。
+    レートの増減 (AIMD) はプロセスごとに判断し、その時点のレートで枠を予約する。
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_PER_SEC,
+        burst: float = RATE_BURST,
+        min_rate: float = RATE_MIN,
+        slow_threshold: float = SLOW_RESPONSE_SEC,
+        account: Optional[str] = None
+    ):
+        self.account = account if RATE_SCOPE == "shared" else None
+        # 429 で止めた時刻 (壁時計)。次の予約でほかのプロセスにも伝える
+        self._shared_blocked_until = 0.0
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.min_rate = min(min_rate, rate)
+        self.slow_threshold = slow_threshold
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self.account is not None:
+            async with self._lock:
+                wait = await asyncio.to_thread(
+                    get_schedule().reserve, self.account, 1 / self.rate, self.burst, self._shared_blocked_until
+                )
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            return
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def record(self, status: Optional[int], elapsed: float, retry_after: Optional[float] = None) -> None:
+        """
+        応答結果をフィードバックする。status=None は通信エラー(タイムアウト等)を表す。
+        """
+        if status is None or status == 429 or status >= 500:
+            self._slow_down(RATE_BACKOFF_FACTOR)
+            if status == 429:
+                pause = retry_after if retry_after is not None else 1 / self.rate
+                self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+                self._shared_blocked_until = max(self._shared_blocked_until, time.time() + pause)
+                self._tokens = 0
+            logger.warning("AMBI応答異常 (status=%s) のためレートを %.2f回/秒 に下げます", status, self.rate)
+        elif elapsed > self.slow_threshold:
+            self._slow_down((1 + RATE_BACKOFF_FACTOR) / 2)
+            logger.info("AMBI応答遅延 (%.1f秒) のためレートを %.2f回/秒 に下げます", elapsed, self.rate)
+        else:
+            self.rate = min(self.max_rate, self.rate + RATE_RECOVERY_STEP)
+
+    def _slow_down(self, factor: float) -> None:
+        # レート変更前に現在レートでトークンを補充しておく
+        self._refill(time.monotonic())
+        self.rate = max(self.min_rate, self.rate * factor)
+
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+
+
+def get_limiter(account: str) -> AdaptiveRateLimiter:
+    """
+    アカウントごとのレートリミッタを返す (検索・スカウト送信・トークン取得で共有)。
+    """
+    limiter = _limiters.get(account)
+    if limiter is None:
+        limiter = AdaptiveRateLimiter(account=account)
+        _limiters[account] = limiter
+    return limiter
+
+
+def forget_limiter(account: str) -> None:
+    """
+    使われなくなったアカウントのレートリミッタを破棄する
+    """
+    _limiters.pop(account, None)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After ヘッダ(秒数指定のみ対応)を秒に変換する。
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
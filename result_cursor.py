@@ -0,0 +1,198 @@
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from models import CandidateData
+from session_manager import hash_password, verify_password
+
+# 検索結果カーソルも他の状態と同じローカル状態DBに置く
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+# カーソルの有効期限 (秒)。最後に読まれてからこの時間が過ぎたものは削除する
+CURSOR_TTL_SEC = float(os.getenv("AMBI_CURSOR_TTL_SEC", "1800"))
+# 1回に返す件数の既定値と上限
+CURSOR_PAGE_SIZE = int(os.getenv("AMBI_CURSOR_PAGE_SIZE", "100"))
+CURSOR_MAX_PAGE_SIZE = int(os.getenv("AMBI_CURSOR_MAX_PAGE_SIZE", "1000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_cursors (
+    cursor_id     TEXT PRIMARY KEY,
+    username      TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    total      INTEGER NOT NULL,
+    partial    INTEGER NOT NULL,
+    message    TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_cursor_rows (
+    cursor_id TEXT NOT NULL,
+    position  INTEGER NOT NULL,
+    candidate TEXT NOT NULL,
+    PRIMARY KEY (cursor_id, position)
+);
+"""
+
+
+class CursorPage:
+    """
+    カーソルから読み出した1回分の結果
+    """
+
+    def __init__(
+        self,
+        cursor_id: str,
+        candidates: List[CandidateData],
+        offset: int,
+        total: int,
+        partial: bool,
+        message: str
+    ):
+        self.cursor_id = cursor_id
+        self.candidates = candidates
+        self.offset = offset
+        self.total = total
+        self.partial = partial
+        self.message = message
+
+    @property
+    def next_offset(self) -> Optional[int]:
+        end = self.offset + len(self.candidates)
+        return end if end < self.total else None
+
+
+class CursorStore:
+    """
+    検索結果をサーバ側 (ローカル状態DB) に保存し、offset / limit で少しずつ返す。
+    大量の検索結果を1つのJSONで返さずに済むため、APIサーバとクライアントの両方でメモリを抑えられる。
+    カーソルは検索したアカウントのユーザー名とパスワードのハッシュを持ち、同じ認証情報でしか読み出し・削除できない。
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE, ttl: float = CURSOR_TTL_SEC):
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        # 照合済みの (カーソルID, 保存済みハッシュ) -> パスワードのHMAC (ページごとにPBKDF2を計算しないため)
+        self._verified: Dict[Tuple[str, str], bytes] = {}
+        self._memo_key = os.urandom(32)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # 持ち主を確認できない旧形式のカーソルは破棄する (有効期限付きの一時データのため)
+            columns = [r[1] for r in self._conn.execute("PRAGMA table_info(search_cursors)")]
+            if columns and "password_hash" not in columns:
+                self._conn.execute("DROP TABLE search_cursors")
+                self._conn.execute("DROP TABLE IF EXISTS search_cursor_rows")
+            self._conn.executescript(_SCHEMA)
+        self.purge_expired()
+
+    def create(
+        self,
+        username: str,
+        password: str,
+        candidates: List[CandidateData],
+        partial: bool,
+        message: str
+    ) -> str:
+        self.purge_expired()
+        cursor_id = uuid.uuid4().hex
+        password_hash = hash_password(password)
+        rows = [
+            (cursor_id, position, json.dumps(c.dict(), ensure_ascii=False))
+            for position, c in enumerate(candidates)
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO search_cursors VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (cursor_id, username, password_hash, len(candidates), int(partial), message, time.time() + self.ttl)
+                )
+                self._conn.executemany("INSERT INTO search_cursor_rows VALUES (?, ?, ?)", rows)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        # 作成したプロセスでは、以降の読み出しでパスワードを照合し直さない
+        self._verified[(cursor_id, password_hash)] = self._memo(password)
+        return cursor_id
+
+    def _memo(self, password: str) -> bytes:
+        return hmac.new(self._memo_key, password.encode("utf-8"), hashlib.sha256).digest()
+
+    def _owned(self, cursor_id: str, username: str, password: str, now: float) -> Optional[Tuple]:
+        """
+        カーソルが有効で認証情報が一致すれば (total, partial, message) を返す。
+        PBKDF2 の計算はカーソルごとに1回だけ行い、ロックの外で行う
+        """
+        with self._lock:
+            row: Optional[Tuple] = self._conn.execute(
+                "SELECT username, password_hash, total, partial, message FROM search_cursors "
+                "WHERE cursor_id = ? AND expires_at > ?",
+                (cursor_id, now)
+            ).fetchone()
+        if row is None or row[0] != username:
+            return None
+        memo = self._memo(password)
+        known = self._verified.get((cursor_id, row[1]))
+        if known is None or not hmac.compare_digest(known, memo):
+            if not verify_password(password, row[1]):
+                return None
+            self._verified[(cursor_id, row[1])] = memo
+        return row[2:]
+
+    def read(self, cursor_id: str, username: str, password: str, offset: int, limit: int) -> Optional[CursorPage]:
+        """
+        offset から最大 limit 件を返す。カーソルが無い・期限切れ・認証情報が一致しない場合は None。
+        読むたびに有効期限を延長する。
+        """
+        now = time.time()
+        row = self._owned(cursor_id, username, password, now)
+        if row is None:
+            return None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE search_cursors SET expires_at = ? WHERE cursor_id = ?", (now + self.ttl, cursor_id)
+            )
+            rows = self._conn.execute(
+                "SELECT candidate FROM search_cursor_rows "
+                "WHERE cursor_id = ? AND position >= ? AND position < ? ORDER BY position",
+                (cursor_id, offset, offset + limit)
+            ).fetchall()
+        candidates = [CandidateData(**json.loads(r[0])) for r in rows]
+        return CursorPage(cursor_id, candidates, offset, row[0], bool(row[1]), row[2])
+
+    def delete(self, cursor_id: str, username: str, password: str) -> bool:
+        if self._owned(cursor_id, username, password, time.time()) is None:
+            return False
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM search_cursors WHERE cursor_id = ?", (cursor_id,))
+            self._conn.execute("DELETE FROM search_cursor_rows WHERE cursor_id = ?", (cursor_id,))
+        self._forget({cursor_id})
+        return cur.rowcount > 0
+
+    def _forget(self, cursor_ids) -> None:
+        for memo_key in [k for k in self._verified if k[0] in cursor_ids]:
+            self._verified.pop(memo_key, None)
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            expired = {
+                r[0] for r in self._conn.execute(
+                    "DELETE FROM search_cursors WHERE expires_at <= ? RETURNING cursor_id", (time.time(),)
+                ).fetchall()
+            }
+            self._conn.execute(
+                "DELETE FROM search_cursor_rows WHERE cursor_id NOT IN (SELECT cursor_id FROM search_cursors)"
+            )
+        self._forget(expired)
+        return len(expired)
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if limit is None or limit <= 0:
+        return CURSOR_PAGE_SIZE
+    return min(limit, CURSOR_MAX_PAGE_SIZE)
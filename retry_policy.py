@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Awaitable, Callable, Dict, FrozenSet, Optional, TypeVar
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ----------------------------------------
+# 失敗の分類
+# ----------------------------------------
+AUTH_EXPIRED = "auth_expired"            # セッション切れ (ログイン画面へリダイレクト等)
+CSRF_REJECTED = "csrf_rejected"          # C13CT が拒否された
+TRANSIENT_NETWORK = "transient_network"  # 接続エラー・タイムアウト
+SERVER_ERROR = "server_error"            # 429 / 5xx
+PARSE_ERROR = "parse_error"              # HTML解析の失敗
+DEADLINE = "deadline"                    # リクエストの処理時間の上限に達した
+CIRCUIT_OPEN = "circuit_open"            # AMBIの障害が続いているため呼び出しを止めている
+FATAL = "fatal"                          # 再試行しても解決しないもの
+
+
+class AmbiError(Exception):
+    """
+    AMBIとの通信で発生した、分類済みのエラー
+    """
+    kind = FATAL
+
+
+class AuthExpiredError(AmbiError):
+    kind = AUTH_EXPIRED
+
+
+class CsrfRejectedError(AmbiError):
+    kind = CSRF_REJECTED
+
+
+class TransientError(AmbiError):
+    kind = TRANSIENT_NETWORK
+
+
+class UpstreamServerError(AmbiError):
+    kind = SERVER_ERROR
+
+
+class ParseError(AmbiError):
+    kind = PARSE_ERROR
+
+
+class DeadlineExceeded(AmbiError):
+    kind = DEADLINE
+
+
+class SendOutcomeUnknown(AmbiError):
+    """
+    送信リクエストをAMBIに送った後で失敗し、AMBIが処理したかどうか分からない (再送すると二重送信になりうる)
+    """
+    kind = FATAL
+
+
+class CredentialsUnavailableError(AmbiError):
+    """
+    パスワードを保持しておらず、再開に使えるログインセッションも無い (ログインし直せない)
+    """
+    kind = FATAL
+
+
+class RetryExhaustedError(AmbiError):
+    """
+    ステップを最大回数まで再試行しても成功しなかった
+    """
+    kind = FATAL
+
+
+class CircuitOpenError(AmbiError):
+    """
+    サーキットブレーカーが遮断中のため、AMBIに送らずに失敗させた (retry_after 秒後に再開)
+    """
+    kind = CIRCUIT_OPEN
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def classify(exc: BaseException) -> str:
+    if isinstance(exc, AmbiError):
+        return exc.kind
+    import aiohttp  # 起動時間短縮のため使う時点で読み込む
+
+    if isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)):
+        return TRANSIENT_NETWORK
+    return FATAL
+
+
+# ----------------------------------------
+# 利用者に返すエラーメッセージ
+# ----------------------------------------
+LOGIN_FAILED_MESSAGE = "ログインに失敗しました。認証情報を確認してください。"
+RETRY_LATER = "しばらく時間をおいて再試行してください。"
+
+
+def is_login_failure(exc: BaseException) -> bool:
+    """
+    認証情報の誤りによるログイン失敗か (何度試しても同じ結果になる)
+    """
+    return "ログイン認証に失敗" in str(exc)
+
+
+def error_message(exc: BaseException, prefix: str = "エラーが発生しました", deadline_hint: str = RETRY_LATER) -> str:
+    """
+    各APIと一括送信ジョブが返すエラーメッセージ。失敗の分類ごとの文言はここで決める。
+    prefix は分類に当てはまらない失敗の前置き、deadline_hint は処理時間の上限に達した場合の対処。
+    """
+    message = str(exc)
+    if is_login_failure(exc):
+        return LOGIN_FAILED_MESSAGE
+    if isinstance(exc, CircuitOpenError):
+        return message
+    if isinstance(exc, DeadlineExceeded):
+        return f"{message}。{deadline_hint}"
+    if isinstance(exc, RetryExhaustedError):
+        return f"一時的なエラーが発生しました。{RETRY_LATER}"
+    return f"{prefix}: {message}"
+
+
+# ----------------------------------------
+# リトライポリシー
+# ----------------------------------------
+class RetryPolicy:
+    """
+    ステップ単位のリトライ設定。
+    - max_attempts: 1ステップあたりの最大試行回数 (初回を含む)
+    - base_delay / max_delay: 指数バックオフの初期値と上限 (秒)
+    - jitter: 待ち時間に掛けるゆらぎの割合 (0.5 なら ±50%)
+    - retry_on: 再試行対象とする失敗の分類
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 10.0,
+        jitter: float = 0.5,
+        retry_on: FrozenSet[str] = frozenset(
+            {AUTH_EXPIRED, CSRF_REJECTED, TRANSIENT_NETWORK, SERVER_ERROR, PARSE_ERROR}
+        )
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    @classmethod
+    def from_env(cls, **overrides) -> "RetryPolicy":
+        params = dict(
+            max_attempts=int(os.getenv("AMBI_RETRY_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("AMBI_RETRY_BASE_DELAY", "1.0")),
+            max_delay=float(os.getenv("AMBI_RETRY_MAX_DELAY", "10.0")),
+            jitter=float(os.getenv("AMBI_RETRY_JITTER", "0.5")),
+        )
+        params.update(overrides)
+        return cls(**params)
+
+    def delay(self, attempt: int) -> float:
+        """
+        attempt 回目 (1始まり) の失敗後の待ち時間
+        """
+        base = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+async def run_step(
+    step: str,
+    fn: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    recover: Optional[Dict[str, Callable[[], Awaitable[None]]]] = None
+) -> T:
+    """
+    1ステップ (トークン取得・1ページ取得など) を、失敗したステップだけ再試行しながら実行する。
+    recover には失敗の分類ごとの復旧処理 (再ログイン・トークン再取得など) を指定でき、
+    待機後・再試行の前に実行される。再試行対象外の失敗はそのまま送出する。
+    """
+    import deadline
+
+    recover = recover or {}
+    attempt = 0
+    while True:
+        attempt += 1
+        deadline.check(step)
+        try:
+            return await fn()
+        except Exception as e:
+            kind = classify(e)
+            if kind not in policy.retry_on:
+                raise
+            if attempt >= policy.max_attempts:
+                raise RetryExhaustedError(f"最大リトライ回数に達しました ({step}): {str(e)}") from e
+
+            wait = policy.delay(attempt)
+            metrics.RETRIES.inc(kind=kind)
+            logger.warning(
+                "%s が失敗しました (%s, 試行 %d/%d): %s -> %.1f秒後に再試行します",
+                step, kind, attempt, policy.max_attempts, e, wait
+            )
+            with tracing.span("retry_wait", step=step, kind=kind, attempt=attempt):
+                # 待っている間に処理時間の上限を過ぎる場合は待たずに打ち切る
+                await deadline.sleep(wait, step)
+            handler = recover.get(kind)
+            if handler is not None:
+                await handler()
@@ -0,0 +1,129 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Set
+
+from models import ScoutTemplateRequest
+
+# ジョブと同じローカル状態DBにテンプレートを保存する (再起動後のジョブ再開で必要)
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scout_templates (
+    template_id TEXT PRIMARY KEY,
+    payload     TEXT NOT NULL,
+    created_at  TEXT NOT NULL
+);
+"""
+
+# {{変数名}} 形式のプレースホルダ
+# (本文中の {NAME} はAMBI側の置換仕様なので、二重波括弧のみを対象にする)
+_PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+# テンプレート化する項目
+TEMPLATE_FIELDS = ("Title", "Body", "rescoutTitle", "rescoutBody")
+
+
+class CompiledText:
+    """
+    テンプレート文字列を「固定文字列」と「変数名」の列に分解したもの。
+    描画時は正規表現を使わず、分解済みの列を連結するだけで済む。
+    """
+
+    def __init__(self, text: str):
+        self.parts: List[str] = []
+        self.variables: Set[str] = set()
+        pos = 0
+        for m in _PLACEHOLDER.finditer(text):
+            self.parts.append(text[pos:m.start()])
+            self.parts.append(m.group(1))
+            self.variables.add(m.group(1))
+            pos = m.end()
+        self.parts.append(text[pos:])
+
+    def render(self, variables: Dict[str, str]) -> str:
+        # parts は [固定, 変数名, 固定, 変数名, ..., 固定] の並び
+        out = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                out.append(part)
+            else:
+                if part not in variables:
+                    raise Exception(f"テンプレート変数が不足しています: {part}")
+                out.append(variables[part])
+        return "".join(out)
+
+
+class CompiledScoutTemplate:
+    """
+    件名・本文・再スカウト件名/本文をまとめてコンパイルしたテンプレート
+    """
+
+    def __init__(self, template: ScoutTemplateRequest):
+        self.fields: Dict[str, CompiledText] = {}
+        for name in TEMPLATE_FIELDS:
+            text = getattr(template, name)
+            if text is not None:
+                self.fields[name] = CompiledText(text)
+
+    @property
+    def variables(self) -> List[str]:
+        names: Set[str] = set()
+        for compiled in self.fields.values():
+            names |= compiled.variables
+        return sorted(names)
+
+    def render(self, variables: Dict[str, str]) -> Dict[str, Optional[str]]:
+        return {name: compiled.render(variables) for name, compiled in self.fields.items()}
+
+
+def template_id_for(template: ScoutTemplateRequest) -> str:
+    """
+    テンプレート内容から決まるID (同じ内容の再登録は同じIDになる)
+    """
+    payload = json.dumps(template.dict(), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class TemplateStore:
+    """
+    テンプレートの保存と、コンパイル済みテンプレートのキャッシュ
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._compiled: Dict[str, CompiledScoutTemplate] = {}
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def register(self, template: ScoutTemplateRequest) -> str:
+        template_id = template_id_for(template)
+        # 登録時にコンパイルしておく
+        self._compiled[template_id] = CompiledScoutTemplate(template)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO scout_templates VALUES (?, ?, ?)",
+                (template_id, template.json(), datetime.datetime.now().isoformat(timespec="seconds"))
+            )
+        return template_id
+
+    def get(self, template_id: str) -> Optional[CompiledScoutTemplate]:
+        compiled = self._compiled.get(template_id)
+        if compiled is not None:
+            return compiled
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM scout_templates WHERE template_id = ?", (template_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        compiled = CompiledScoutTemplate(ScoutTemplateRequest.parse_raw(row[0]))
+        self._compiled[template_id] = compiled
+        return compiled
@@ -1,101 +1,165 @@
-from typing import List
-from bs4 import BeautifulSoup
-from models import CandidateData
+import re
+from typing import Any, Dict, List
+
+from models import CandidateData, CandidateDetail
+
+def _parse_profile(us) -> Dict[str, Any]:
+    """
+    候補者1人分の要素 (一覧の <div class="userSet">、詳細ページの本体) から一覧と共通の項目を取り出す
+    """
+    # 1) ID
+    input_id = us.find("input", class_="js_sid")
+    cid = None
+    if input_id and input_id.has_attr("value"):
+        try:
+            cid = int(input_id["value"])
+        except:
+            cid = None
+
+    # 2) 性別/年齢/住所
+    gender, age, location = None, None, None
+    prof_div = us.find("div", class_="prof")
+    if prof_div:
+        txt = prof_div.get_text(strip=True)
+        if "女性" in txt:
+            gender = "女性"
+        elif "男性" in txt:
+            gender = "男性"
+
+        m_age = re.search(r'(\d+)歳', txt)
+        if m_age:
+            age = int(m_age.group(1))
+        m_loc = re.search(r'歳\s*/\s*(\S+)', txt)
+        if m_loc:
+            location = m_loc.group(1)
+
+    # 3) UserNo
+    user_no = None
+    num_div = us.find("div", class_="num")
+    if num_div:
+        tmp = num_div.get_text(strip=True)
+        if tmp.startswith("No."):
+            try:
+                user_no = int(tmp.replace("No.", ""))
+            except:
+                pass
+
+    # 4) 企業情報
+    company, sub_info = None, None
+    comp_div = us.find("div", class_="companyData")
+    if comp_div:
+        name_div = comp_div.find("div", class_="name")
+        if name_div:
+            company = name_div.get_text(strip=True)
+        sub_div = comp_div.find("div", class_="sub")
+        if sub_div:
+            sub_info = sub_div.get_text(strip=True)
+
+    # 5) 学歴/転職回数/職種/言語
+    edu, change_times, language = None, None, None
+    past_jobs = []
+    data_li = us.find_all("li", class_="data")
+    for li in data_li:
+        cls = li.get("class", [])
+        text_li = li.get_text(strip=True)
+        if "school" in cls:
+            edu = text_li
+        elif "change" in cls:
+            change_times = text_li.replace("転職回数：", "")
+        elif "pastjob" in cls:
+            past_jobs.append(text_li)
+        elif "language" in cls:
+            language = text_li
+
+    # 6) 自己PR/summary
+    summary = None
+    summary_div = us.find("div", class_="resumeContent")
+    if summary_div:
+        summary = summary_div.get_text(strip=True)
+
+    return dict(
+        id=cid,
+        gender=gender,
+        age=age,
+        location=location,
+        no=user_no,
+        company=company,
+        sub=sub_info,
+        education=edu,
+        change_times=change_times,
+        past_jobs=past_jobs,
+        language=language,
+        summary=summary
+    )
+
 
 def extract_candidates_from_html(html: str) -> List[CandidateData]:
     """
     結果ページの <div class="userSet"> を解析し、候補者情報を抽出
     """
+    from bs4 import BeautifulSoup  # 起動時間短縮のため使う時点で読み込む
+
     soup = BeautifulSoup(html, "html.parser")
     user_sets = soup.find_all("div", class_="userSet")
 
-    results = []
-    for us in user_sets:
-        # 1) ID
-        input_id = us.find("input", class_="js_sid")
-        cid = None
-        if input_id and input_id.has_attr("value"):
-            try:
-                cid = int(input_id["value"])
-            except:
-                cid = None
-
-        # 2) 性別/年齢/住所
-        gender, age, location = None, None, None
-        prof_div = us.find("div", class_="prof")
-        if prof_div:
-            txt = prof_div.get_text(strip=True)
-            if "女性" in txt:
-                gender = "女性"
-            elif "男性" in txt:
-                gender = "男性"
-
-            import re
-            m_age = re.search(r'(\d+)歳', txt)
-            if m_age:
-                age = int(m_age.group(1))
-            m_loc = re.search(r'歳\s*/\s*(\S+)', txt)
-            if m_loc:
-                location = m_loc.group(1)
-
-        # 3) UserNo
-        user_no = None
-        num_div = us.find("div", class_="num")
-        if num_div:
-            tmp = num_div.get_text(strip=True)
-            if tmp.startswith("No."):
-                try:
-                    user_no = int(tmp.replace("No.", ""))
-                except:
-                    pass
-
-        # 4) 企業情報
-        company, sub_info = None, None
-        comp_div = us.find("div", class_="companyData")
-        if comp_div:
-            name_div = comp_div.find("div", class_="name")
-            if name_div:
-                company = name_div.get_text(strip=True)
-            sub_div = comp_div.find("div", class_="sub")
-            if sub_div:
-                sub_info = sub_div.get_text(strip=True)
-
-        # 5) 学歴/転職回数/職種/言語
-        edu, change_times, language = None, None, None
-        past_jobs = []
-        data_li = us.find_all("li", class_="data")
-        for li in data_li:
-            cls = li.get("class", [])
-            text_li = li.get_text(strip=True)
-            if "school" in cls:
-                edu = text_li
-            elif "change" in cls:
-                change_times = text_li.replace("転職回数：", "")
-            elif "pastjob" in cls:
-                past_jobs.append(text_li)
-            elif "language" in cls:
-                language = text_li
-
-        # 6) 自己PR/summary
-        summary = None
-        summary_div = us.find("div", class_="resumeContent")
-        if summary_div:
-            summary = summary_div.get_text(strip=True)
-
-        candidate = CandidateData(
-            id=cid,
-            gender=gender,
-            age=age,
-            location=location,
-            no=user_no,
-            company=company,
-            sub=sub_info,
-            education=edu,
-            change_times=change_times,
-            past_jobs=past_jobs,
-            language=language,
-            summary=summary
-        )
-        results.append(candidate)
-
-    return results
+    return [CandidateData(**_parse_profile(us)) for us in user_sets]
+
+
+# 詳細ページの見出しと CandidateDetail の項目の対応 (見出しに含まれる語で判定)
+_DETAIL_HEADINGS = (
+    ("職務経歴", "resume"),
+    ("職務要約", "resume"),
+    ("自己PR", "self_pr"),
+    ("職歴", "careers"),
+    ("資格", "qualifications"),
+)
+
+
+def _detail_sections(root) -> Dict[str, Any]:
+    """
+    見出し付きのブロック (<section> の h2〜h4、<dl> の dt/dd) を {見出し: 本文要素} にまとめる
+    """
+    sections: Dict[str, Any] = {}
+    for section in root.find_all("section"):
+        heading = section.find(["h2", "h3", "h4"])
+        if heading is None:
+            continue
+        title = heading.get_text(strip=True)
+        heading.extract()
+        sections.setdefault(title, section)
+    for dl in root.find_all("dl"):
+        for dt in dl.find_all("dt"):
+            dd = dt.find_next_sibling("dd")
+            if dd is not None:
+                sections.setdefault(dt.get_text(strip=True), dd)
+    return sections
+
+
+def extract_candidate_detail_from_html(html: str) -> CandidateDetail:
+    """
+    候補者詳細ページを解析する。
+    一覧と共通の項目に加えて、一覧では省略される職務経歴の全文・自己PR・職歴・資格と、
+    すべての見出し付き項目 (sections) を取り出す。候補者情報が無いページは ValueError
+    """
+    from bs4 import BeautifulSoup  # 起動時間短縮のため使う時点で読み込む
+
+    soup = BeautifulSoup(html, "html.parser")
+    root = soup.find("div", class_="userDetail") or soup.find("div", class_="userSet")
+    if root is None:
+        raise ValueError("候補者詳細が見つかりません")
+
+    fields: Dict[str, Any] = _parse_profile(root)
+    # 見出し付きの項目は、一覧と共通の項目を取り出した後で切り出す (resumeContent の重複を避ける)
+    sections = _detail_sections(root)
+    fields["sections"] = {title: node.get_text(" ", strip=True) for title, node in sections.items()}
+    for title, node in sections.items():
+        for keyword, field in _DETAIL_HEADINGS:
+            if keyword not in title or field in fields:
+                continue
+            if field in ("careers", "qualifications"):
+                items = [li.get_text(" ", strip=True) for li in node.find_all("li")]
+                fields[field] = items or [node.get_text(" ", strip=True)]
+            else:
+                fields[field] = node.get_text("\n", strip=True)
+            break
+    return CandidateDetail(**fields)
@@ -0,0 +1,203 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from models import ScoutMessageContent, ScoutMessageResponse
+
+# ジョブと同じローカル状態DBに台帳テーブルを置く
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+# 台帳の保持期間 (日)。これより古い記録は起動時に削除する
+LEDGER_RETENTION_DAYS = int(os.getenv("AMBI_LEDGER_RETENTION_DAYS", "30"))
+# 送信処理中 (pending) の記録を保持するリースの期間 (秒)。1件の送信の処理時間の上限より長く、
+# 一括送信ジョブのリース (AMBI_JOB_LEASE_SEC) より短くする (引き継いだアイテムが pending のまま拒否されないように)。
+# リースが切れた pending (送信中にプロセスが停止したもの) は送信結果不明 (unknown) とみなす
+SEND_LEASE_SEC = float(os.getenv("AMBI_SEND_LEASE_SEC", "180"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scout_send_ledger (
+    send_key   TEXT PRIMARY KEY,
+    username   TEXT NOT NULL,
+    uid        INTEGER NOT NULL,
+    scout_type INTEGER NOT NULL,
+    state      TEXT NOT NULL,
+    message    TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    owner      TEXT,
+    lease_until REAL
+);
+"""
+
+# 送信中にプロセスが停止した (リースが切れた) pending を unknown にしたときのメッセージ
+_STALE_MESSAGE = "送信処理中にサーバが停止したため、送信されたかどうか分かりません"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def _sha256(value) -> str:
+    return hashlib.sha256(
+        json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def send_key(username: str, content: ScoutMessageContent) -> str:
+    """
+    送信の同一性を表すキー。
+    idempotency_key が指定されていれば (アカウント, キー)、
+    無ければ (アカウント, UID, ScoutType, 送信内容のハッシュ) から生成する。
+    """
+    if content.idempotency_key:
+        return _sha256([username, "key", content.idempotency_key])
+
+    content_hash = _sha256([
+        content.Title,
+        content.Body,
+        content.rescoutTitle,
+        content.rescoutBody,
+        content.attachedWorkIDs,
+    ])
+    return _sha256([username, content.UID, content.ScoutType, content_hash])
+
+
+class SendLedger:
+    """
+    スカウト送信の台帳 (冪等性の担保用)。
+    - pending: 送信処理中。送信する処理 (owner) がリース付きで保持し、リースが切れたら unknown とみなす
+    - success: 送信成功。同じキーの再送は記録済みの結果を返し、AMBIには送らない
+    - error:   送信前の失敗 (AMBIに送っていないことが確実)。同じキーで再試行できる
+    - unknown: 送信リクエストを送った後で失敗し、送信されたかどうか分からない。
+               二重送信を避けるため、同じキーでは自動で再送しない
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # 列が足りない旧スキーマのDBを移行
+            columns = [r[1] for r in self._conn.execute("PRAGMA table_info(scout_send_ledger)")]
+            for column, definition in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE scout_send_ledger ADD COLUMN {column} {definition}")
+            expire = datetime.datetime.now() - datetime.timedelta(days=LEDGER_RETENTION_DAYS)
+            self._conn.execute(
+                "DELETE FROM scout_send_ledger WHERE updated_at < ?",
+                (expire.isoformat(timespec="seconds"),)
+            )
+
+    def begin(
+        self,
+        key: str,
+        username: str,
+        content: ScoutMessageContent,
+        owner: str,
+        lease: float = SEND_LEASE_SEC
+    ) -> Optional[ScoutMessageResponse]:
+        """
+        送信前に台帳を確認する。
+        未記録(または前回失敗)なら owner の pending で登録して None を返し、呼び出し側は送信を行う。
+        記録済みなら、その結果をレスポンスとして返す (AMBIへの送信は行わない)。
+        リースが切れた pending は unknown に変えてから、その結果を返す。
+        """
+        now = _now()
+        lease_until = time.time() + lease
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT state, message, lease_until FROM scout_send_ledger WHERE send_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT INTO scout_send_ledger VALUES (?, ?, ?, ?, 'pending', NULL, ?, ?, ?, ?)",
+                        (key, username, content.UID, content.ScoutType, now, now, owner, lease_until)
+                    )
+                elif row[0] == "error":
+                    self._conn.execute(
+                        "UPDATE scout_send_ledger SET state = 'pending', owner = ?, lease_until = ?, updated_at = ?"
+                        " WHERE send_key = ?",
+                        (owner, lease_until, now, key)
+                    )
+                elif row[0] == "pending" and (row[2] is None or row[2] < time.time()):
+                    self._conn.execute(
+                        "UPDATE scout_send_ledger SET state = 'unknown', message = ?, owner = NULL,"
+                        " lease_until = NULL, updated_at = ? WHERE send_key = ?",
+                        (_STALE_MESSAGE, now, key)
+                    )
+                    row = ("unknown", _STALE_MESSAGE, None)
+            finally:
+                self._conn.execute("COMMIT")
+
+        if row is None or row[0] == "error":
+            return None
+        if row[0] == "success":
+            return ScoutMessageResponse(
+                status="success",
+                message=row[1] or "スカウトメッセージの送信に成功しました。",
+                replayed=True
+            )
+        if row[0] == "unknown":
+            return ScoutMessageResponse(
+                status="error",
+                message=(
+                    "前回の送信結果が不明です（送信後に応答を受け取れなかった、または送信中にサーバが停止しました）。"
+                    "二重送信を避けるため送信しませんでした。AMBIの送信履歴を確認してください。"
+                ),
+                replayed=True
+            )
+        return ScoutMessageResponse(
+            status="error",
+            message="同じ内容のスカウトが送信処理中です。二重送信を避けるため送信しませんでした。",
+            replayed=True
+        )
+
+    def finish(self, key: str, owner: str, response: ScoutMessageResponse) -> None:
+        """
+        送信結果を記録する (ほかの処理が同じキーで送信し直している場合は記録しない)
+        """
+        state = "success" if response.status == "success" else "error"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scout_send_ledger SET state = ?, message = ?, owner = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE send_key = ? AND owner = ?",
+                (state, response.message, _now(), key, owner)
+            )
+
+    def finish_unknown(self, key: str, owner: str, error_message: str) -> ScoutMessageResponse:
+        """
+        送信リクエストを送った後で失敗した (送信されたかどうか分からない) ことを記録し、返すレスポンスを返す
+        """
+        response = ScoutMessageResponse(
+            status="error",
+            message=(
+                f"送信結果が不明です: {error_message}。"
+                "二重送信を避けるため自動では再送しません。AMBIの送信履歴を確認してください。"
+            )
+        )
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scout_send_ledger SET state = 'unknown', message = ?, owner = NULL, lease_until = NULL,"
+                " updated_at = ? WHERE send_key = ? AND owner = ?",
+                (response.message, _now(), key, owner)
+            )
+        return response
+
+    def abandon(self, key: str, owner: str, in_doubt: bool) -> ScoutMessageResponse:
+        """
+        送信処理が取り消された (タスクのキャンセル・シャットダウン) ことを記録し、pending のまま残さない。
+        送信リクエストを送った後 (in_doubt) なら unknown、送る前なら再試行できる error にする
+        """
+        message = "送信処理が取り消されました"
+        if in_doubt:
+            return self.finish_unknown(key, owner, message)
+        response = ScoutMessageResponse(status="error", message=message)
+        self.finish(key, owner, response)
+        return response
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import deadline
+import metrics
+from logging_setup import set_account_id, set_request_id
+from retry_policy import AmbiError, AuthExpiredError, CircuitOpenError, is_login_failure
+from session_manager import get_store as get_session_store
+
+logger = logging.getLogger(__name__)
+
+# on: 使用中のアカウントのセッションをバックグラウンドで維持する / off: 維持しない
+KEEPALIVE_MODE = os.getenv("AMBI_KEEPALIVE", "on")
+# セッションを確認する間隔 (秒)。AMBIのセッションが無操作で切れるまでの時間より短くする
+KEEPALIVE_INTERVAL_SEC = float(os.getenv("AMBI_KEEPALIVE_INTERVAL_SEC", "600"))
+# この時間 (秒) 使われなかったアカウントは維持の対象から外す
+KEEPALIVE_IDLE_SEC = float(os.getenv("AMBI_KEEPALIVE_IDLE_SEC", "3600"))
+# Cookieを保存してからこの時間 (秒) を過ぎたら、切れる前にログインし直す (0 なら切れるまで使う)
+KEEPALIVE_RELOGIN_SEC = float(os.getenv("AMBI_KEEPALIVE_RELOGIN_SEC", "0"))
+# 同時に確認するアカウント数
+KEEPALIVE_CONCURRENCY = max(1, int(os.getenv("AMBI_KEEPALIVE_CONCURRENCY", "2")))
+
+
+class _Account:
+    def __init__(self, password: str):
+        self.password = password
+        now = time.monotonic()
+        self.last_used = now
+        # 使われた時点でセッションは有効だったので、次の確認は1間隔後でよい
+        self.last_checked = now
+
+
+class SessionKeepalive:
+    """
+    ユーザー向けのリクエストでログインせずに済むよう、使用中のアカウントのセッションを
+    リクエストの合間にバックグラウンドで維持する。
+    - ensure_login で使われたアカウントを記録する (パスワードはプロセス内にのみ保持し、
+      KEEPALIVE_IDLE_SEC 使われなければ破棄する)
+    - KEEPALIVE_INTERVAL_SEC ごとにindex画面 (C13CTトークン取得) へアクセスしてセッションを延長し、
+      トークンも取り直して共有キャッシュに置く
+    - セッションが切れていた場合や、Cookieが KEEPALIVE_RELOGIN_SEC より古い場合はその場でログインし直し、
+      Cookieを保存する (以降のリクエストはそのCookieを使う)
+    同じアカウントの確認はワーカープロセス間でも1間隔に1回だけ行う。
+    """
+
+    def __init__(
+        self,
+        interval: float = KEEPALIVE_INTERVAL_SEC,
+        idle: float = KEEPALIVE_IDLE_SEC,
+        relogin_after: float = KEEPALIVE_RELOGIN_SEC,
+        concurrency: int = KEEPALIVE_CONCURRENCY
+    ):
+        self.interval = interval
+        self.idle = idle
+        self.relogin_after = relogin_after
+        self.concurrency = max(1, concurrency)
+        self._accounts: Dict[str, _Account] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, username: str, password: str) -> None:
+        """
+        アカウントが使われたことを記録する (維持の対象にする)
+        """
+        if KEEPALIVE_MODE != "on":
+            return
+        account = self._accounts.get(username)
+        if account is None or account.password != password:
+            self._accounts[username] = _Account(password)
+        else:
+            account.last_used = time.monotonic()
+
+    def forget(self, username: str) -> None:
+        self._accounts.pop(username, None)
+
+    @property
+    def accounts(self) -> List[str]:
+        return sorted(self._accounts)
+
+    def _due(self) -> List[str]:
+        now = time.monotonic()
+        for username, account in list(self._accounts.items()):
+            if now - account.last_used > self.idle:
+                logger.info("しばらく使われていないためセッション維持の対象から外します: %s", username)
+                self.forget(username)
+        return [
+            username for username, account in self._accounts.items()
+            if now - account.last_checked >= self.interval
+        ]
+
+    async def refresh(self, username: str) -> str:
+        """
+        1アカウント分のセッションを確認し、必要ならログインし直す。結果 (metrics の result) を返す
+        """
+        from hybrid_client import AmbiHybridClient
+
+        account = self._accounts.get(username)
+        if account is None:
+            return "skipped"
+        account.last_checked = time.monotonic()
+        store = get_session_store()
+        if not await asyncio.to_thread(store.claim_keepalive, username, self.interval):
+            # ほかのワーカーが確認済み
+            return "skipped"
+
+        set_request_id("keepalive")
+        set_account_id(username)
+        # 確認には一時的なクライアントを使う (使い回しているクライアントの使用時刻を更新しない)
+        client = AmbiHybridClient(username)
+        client._password = account.password
+        result = await self._check(client, username)
+        self._share_cookies(username, client.cookies)
+        return result
+
+    async def _check(self, client, username: str) -> str:
+        from hybrid_client import _has_required_cookies
+
+        store = get_session_store()
+        cookies = await asyncio.to_thread(store.load_cookies, username, client._password)
+        if not _has_required_cookies(cookies):
+            await deadline.run(client.relogin(), deadline.REQUEST_DEADLINE_SEC)
+            return "login"
+        client.cookies = cookies
+
+        age = await asyncio.to_thread(store.cookies_age, username)
+        if self.relogin_after > 0 and age is not None and age >= self.relogin_after:
+            logger.info("Cookieが古くなったため事前にログインし直します (%.0f秒経過)", age)
+            await deadline.run(client.relogin(), deadline.REQUEST_DEADLINE_SEC)
+            return "relogin"
+
+        try:
+            await deadline.run(client.refresh_session(), deadline.REQUEST_DEADLINE_SEC)
+            return "ok"
+        except AuthExpiredError:
+            logger.info("セッションが切れていたためバックグラウンドでログインし直します")
+            await deadline.run(client.relogin(), deadline.REQUEST_DEADLINE_SEC)
+            return "relogin"
+
+    def _share_cookies(self, username: str, cookies: Dict[str, str]) -> None:
+        # リクエストで使い回しているクライアントにも、更新したCookieを反映する
+        import client_registry
+
+        cached = client_registry.get_registry().peek(username)
+        if cached is not None:
+            cached.cookies = dict(cookies)
+
+    async def _refresh_one(self, username: str, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                result = await self.refresh(username)
+            except CircuitOpenError as e:
+                # AMBIの障害中は何もしない (次の間隔で改めて確認する)
+                logger.info("AMBIの障害中のためセッションの確認を見送ります: %s", e)
+                result = "skipped"
+            except AmbiError as e:
+                result = "error"
+                if is_login_failure(e):
+                    # 認証情報が誤っている (パスワード変更など) アカウントは維持しない
+                    logger.warning("ログインに失敗したためセッション維持の対象から外します: %s", username)
+                    self.forget(username)
+                else:
+                    logger.warning("セッションの維持に失敗しました: %s", e)
+            except Exception as e:
+                result = "error"
+                logger.warning("セッションの維持に失敗しました: %s", e)
+            metrics.KEEPALIVES.inc(result=result)
+
+    async def run_once(self) -> None:
+        due = self._due()
+        if not due:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._refresh_one(username, semaphore) for username in due))
+
+    async def _run(self) -> None:
+        # 確認の間隔より十分細かく、期限の来たアカウントを探す
+        tick = max(1.0, min(60.0, self.interval / 4))
+        while True:
+            await asyncio.sleep(tick)
+            await self.run_once()
+
+    def start(self) -> None:
+        if KEEPALIVE_MODE != "on":
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+_keepalive: Optional[SessionKeepalive] = None
+
+
+def get_keepalive() -> SessionKeepalive:
+    global _keepalive
+    if _keepalive is None:
+        _keepalive = SessionKeepalive()
+    return _keepalive
+
+
+def track(username: str, password: str) -> None:
+    get_keepalive().track(username, password)
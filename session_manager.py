@@ -1,41 +1,287 @@
+import datetime
+import hashlib
+import hmac
 import json
 import os
-from typing import Dict, Optional
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
 
-SESSION_FILE = "session_store.json"
+# ログインCookie・C13CTトークン・ログインロックは、同じホストの全ワーカープロセス
+# (uvicorn --workers N) で共有するためローカル状態DB (SQLite WAL) に置く
+STATE_DB_FILE = os.getenv("AMBI_STATE_DB", "ambi_state.sqlite3")
+# 保存するパスワードハッシュ (PBKDF2-SHA256) の反復回数
+PASSWORD_HASH_ITERATIONS = int(os.getenv("AMBI_PASSWORD_HASH_ITERATIONS", "100000"))
+# C13CTトークンを再利用する期間 (秒)。拒否された場合は期間内でも取り直す
+TOKEN_TTL_SEC = float(os.getenv("AMBI_TOKEN_TTL_SEC", "300"))
+# ログインロックの有効期限 (秒)。ロックを持ったプロセスが落ちてもこの時間で解放される
+LOGIN_LOCK_LEASE_SEC = float(os.getenv("AMBI_LOGIN_LOCK_LEASE_SEC", "120"))
 
-def load_cookies(username: str) -> Optional[Dict[str, str]]:
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ambi_sessions (
+    username   TEXT PRIMARY KEY,
+    cookies    TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    password_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS ambi_tokens (
+    username   TEXT NOT NULL,
+    phpsessid  TEXT NOT NULL,
+    token      TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (username, phpsessid)
+);
+CREATE TABLE IF NOT EXISTS ambi_login_locks (
+    username   TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ambi_keepalive (
+    username   TEXT PRIMARY KEY,
+    checked_at REAL NOT NULL
+);
+"""
+
+
+def hash_password(password: str, salt: Optional[bytes] = None, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
     """
-    ユーザー名をキーに、session_store.json からクッキー情報を読み込み。
-    見つからない場合は None を返す。
+    パスワードのソルト付きハッシュ ("pbkdf2_sha256$反復回数$ソルト$ハッシュ")
     """
-    if not os.path.exists(SESSION_FILE):
-        return None
+    salt = os.urandom(16) if salt is None else salt
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
 
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    if not stored:
+        return False
     try:
-        with open(SESSION_FILE, "r", encoding="utf-8") as f:
-            store = json.load(f)
-        cookies = store.get(username)
-        if isinstance(cookies, dict):
-            return cookies
-        else:
-            return None
-    except Exception:
-        return None
+        algorithm, iterations, salt, _ = stored.split("$")
+        if algorithm != "pbkdf2_sha256":
+            return False
+        expected = hash_password(password, bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(expected, stored)
+
 
-def save_cookies(username: str, cookies: Dict[str, str]) -> None:
+class SessionStore:
     """
-    ユーザー名をキーに、クッキー辞書を session_store.json に上書き保存。
+    ワーカープロセス間で共有するログイン状態。
+    - Cookie: アカウントごとの最新のログインCookie。ログインに成功したパスワードのハッシュと共に保存し、
+      同じパスワードが指定された場合のみ再利用する (ユーザー名だけではセッションを使えない)
+    - トークン: (アカウント, PHPSESSID) ごとのC13CT (TTL付き)
+    - ログインロック: 同じアカウントのログインを同時に1つだけにするためのリース
+    - セッション維持: アカウントごとに最後にセッションを確認した時刻 (ワーカー間で重複させないため)
     """
-    store = {}
-    if os.path.exists(SESSION_FILE):
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        # 照合済みの (ユーザー名, 保存済みハッシュ) -> パスワードのHMAC (毎回PBKDF2を計算しないため)
+        self._verified: Dict[Tuple[str, str], bytes] = {}
+        self._memo_key = os.urandom(32)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # password_hash 列が無い旧スキーマのDBを移行 (ハッシュの無いCookieは再利用しない)
+            columns = [r[1] for r in self._conn.execute("PRAGMA table_info(ambi_sessions)")]
+            if "password_hash" not in columns:
+                self._conn.execute("ALTER TABLE ambi_sessions ADD COLUMN password_hash TEXT")
+            self._conn.execute("DELETE FROM ambi_tokens WHERE expires_at < ?", (time.time(),))
+
+    def _check_password(self, username: str, password: str, stored: Optional[str]) -> bool:
+        if not stored:
+            return False
+        memo = hmac.new(self._memo_key, password.encode("utf-8"), hashlib.sha256).digest()
+        known = self._verified.get((username, stored))
+        if known is not None and hmac.compare_digest(known, memo):
+            return True
+        if not verify_password(password, stored):
+            return False
+        self._verified[(username, stored)] = memo
+        return True
+
+    # ----------------------------------------
+    # Cookie
+    # ----------------------------------------
+    def load_cookies(self, username: str, password: str) -> Optional[Dict[str, str]]:
+        """
+        保存済みのCookieを返す。保存時 (ログイン成功時) のパスワードと一致しない場合は None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cookies, password_hash FROM ambi_sessions WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None or not self._check_password(username, password, row[1]):
+            return None
+        try:
+            cookies = json.loads(row[0])
+        except ValueError:
+            return None
+        return cookies if isinstance(cookies, dict) else None
+
+    def password_hash(self, username: str, password: str) -> Optional[str]:
+        """
+        保存済みのCookieが password でのログインによるものなら、保存済みのハッシュを返す
+        (一括送信ジョブが、パスワードを失った後の再開に使うセッションを記録するため)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT password_hash FROM ambi_sessions WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None or not self._check_password(username, password, row[0]):
+            return None
+        return row[0]
+
+    def load_cookies_by_hash(self, username: str, password_hash: str) -> Optional[Dict[str, str]]:
+        """
+        保存済みのハッシュが password_hash と一致する (同じパスワードでのログインによる) 場合のみCookieを返す
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cookies, password_hash FROM ambi_sessions WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None or not row[1] or not hmac.compare_digest(row[1], password_hash):
+            return None
         try:
-            with open(SESSION_FILE, "r", encoding="utf-8") as f:
-                store = json.load(f)
-        except Exception:
-            # JSONが壊れていた場合などは新規作成
-            store = {}
-
-    store[username] = cookies
-    with open(SESSION_FILE, "w", encoding="utf-8") as f:
-        json.dump(store, f, ensure_ascii=False, indent=2)
+            cookies = json.loads(row[0])
+        except ValueError:
+            return None
+        return cookies if isinstance(cookies, dict) else None
+
+    def save_cookies(self, username: str, cookies: Dict[str, str], password: Optional[str] = None) -> None:
+        """
+        Cookieを保存する。password はログインに成功した場合に指定し、ハッシュを保存する
+        (省略時はセッション更新によるCookieの差し替えとして、保存済みのハッシュを残す)。
+        同じパスワードでログインし直した場合は保存済みのハッシュをそのまま使う (ジョブが記録したハッシュと一致させるため)
+        """
+        password_hash = None
+        if password is not None:
+            password_hash = self.password_hash(username, password) or hash_password(password)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ambi_sessions VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET cookies = excluded.cookies, updated_at = excluded.updated_at, "
+                "password_hash = COALESCE(excluded.password_hash, ambi_sessions.password_hash)",
+                (username, json.dumps(cookies, ensure_ascii=False), _now(), password_hash)
+            )
+
+    def cookies_age(self, username: str) -> Optional[float]:
+        """
+        Cookieを保存してからの経過秒数 (保存されていなければ None)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM ambi_sessions WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            saved_at = datetime.datetime.fromisoformat(row[0])
+        except ValueError:
+            return None
+        return (datetime.datetime.now() - saved_at).total_seconds()
+
+    # ----------------------------------------
+    # C13CTトークン
+    # ----------------------------------------
+    def load_token(self, username: str, phpsessid: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT token FROM ambi_tokens WHERE username = ? AND phpsessid = ? AND expires_at > ?",
+                (username, phpsessid, time.time())
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def save_token(self, username: str, phpsessid: str, token: str, ttl: float = TOKEN_TTL_SEC) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ambi_tokens VALUES (?, ?, ?, ?)",
+                (username, phpsessid, token, time.time() + ttl)
+            )
+
+    def invalidate_token(self, username: str, phpsessid: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM ambi_tokens WHERE username = ? AND phpsessid = ?", (username, phpsessid)
+            )
+
+    # ----------------------------------------
+    # ログインロック
+    # ----------------------------------------
+    def try_lock_login(self, username: str, owner: str, lease: float = LOGIN_LOCK_LEASE_SEC) -> bool:
+        """
+        ログインロックの取得を1回試みる (未取得または期限切れなら取得できる)
+        """
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO ambi_login_locks VALUES (?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE ambi_login_locks.expires_at < ?",
+                (username, owner, now + lease, now)
+            )
+            return cur.rowcount == 1
+
+    def unlock_login(self, username: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM ambi_login_locks WHERE username = ? AND owner = ?", (username, owner)
+            )
+
+
+    # ----------------------------------------
+    # セッション維持
+    # ----------------------------------------
+    def claim_keepalive(self, username: str, interval: float) -> bool:
+        """
+        セッションの確認を1回分引き受ける。interval 秒以内にほかのワーカーが確認済みなら False
+        """
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO ambi_keepalive VALUES (?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET checked_at = excluded.checked_at "
+                "WHERE ambi_keepalive.checked_at <= ?",
+                (username, now, now - interval)
+            )
+            return cur.rowcount == 1
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SessionStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore()
+    return _store
+
+
+def new_lock_owner() -> str:
+    return f"{os.getpid()}-{uuid.uuid4().hex}"
+
+
+def load_cookies(username: str, password: str) -> Optional[Dict[str, str]]:
+    """
+    ユーザー名をキーに、共有DBからクッキー情報を読み込み。
+    見つからない場合・ログイン時のパスワードと一致しない場合は None を返す。
+    """
+    return get_store().load_cookies(username, password)
+
+
+def save_cookies(username: str, cookies: Dict[str, str], password: Optional[str] = None) -> None:
+    """
+    ユーザー名をキーに、クッキー辞書を共有DBに上書き保存。
+    """
+    get_store().save_cookies(username, cookies, password)
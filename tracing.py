@@ -0,0 +1,206 @@
+import contextvars
+import functools
+import inspect
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# on: トレースを記録する / off: 記録しない (span() はほぼコストなし)
+TRACING_MODE = os.getenv("AMBI_TRACING", "on")
+# 保持する直近のトレース件数 (リングバッファ)
+TRACE_BUFFER_SIZE = int(os.getenv("AMBI_TRACE_BUFFER", "200"))
+# 1トレースあたりのスパン数の上限 (超えた分は記録しない)
+TRACE_MAX_SPANS = int(os.getenv("AMBI_TRACE_MAX_SPANS", "500"))
+
+# W3C Trace Context (OpenTelemetry の既定の伝搬形式) の traceparent ヘッダ
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _Trace:
+    def __init__(self, root: Span):
+        self.root = root
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+
+class TraceBuffer:
+    """
+    完了したトレースを直近 max_traces 件だけ保持するリングバッファ
+    """
+
+    def __init__(self, max_traces: int = TRACE_BUFFER_SIZE):
+        self._traces: Deque[_Trace] = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def add(self, trace: _Trace) -> None:
+        with self._lock:
+            self._traces.append(trace)
+
+    def list(self, min_duration_ms: float = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self._traces)
+        summaries = []
+        for trace in reversed(traces):
+            root = trace.root.to_dict()
+            if (root["duration_ms"] or 0) < min_duration_ms:
+                continue
+            summaries.append({
+                "trace_id": trace.root.trace_id,
+                "name": root["name"],
+                "start": root["start"],
+                "duration_ms": root["duration_ms"],
+                "spans": len(trace.spans),
+                "error": root["error"],
+            })
+            if len(summaries) >= limit:
+                break
+        return summaries
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            traces = [t for t in self._traces if t.root.trace_id == trace_id]
+        if not traces:
+            return None
+        trace = traces[-1]
+        return {
+            "trace_id": trace_id,
+            "dropped_spans": trace.dropped,
+            "root": _build_tree(trace),
+        }
+
+
+def _build_tree(trace: _Trace) -> Dict[str, Any]:
+    nodes = {span.span_id: {**span.to_dict(), "children": []} for span in trace.spans}
+    for span in trace.spans:
+        if span is trace.root:
+            continue
+        parent = nodes.get(span.parent_id)
+        if parent is not None:
+            parent["children"].append(nodes[span.span_id])
+    for node in nodes.values():
+        node["children"].sort(key=lambda n: n["start"])
+    return nodes[trace.root.span_id]
+
+
+_buffer = TraceBuffer()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_current_trace: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def get_buffer() -> TraceBuffer:
+    return _buffer
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Dict[str, str]]:
+    if not value:
+        return None
+    m = _TRACEPARENT.match(value.strip().lower())
+    if not m or m.group(1) == "0" * 32 or m.group(2) == "0" * 16:
+        return None
+    return {"trace_id": m.group(1), "parent_id": m.group(2)}
+
+
+@contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    with ブロックをスパンとして記録する。
+    実行中のスパンがあればその子になり、無ければ新しいトレースを開始する
+    (traceparent が渡されれば呼び出し元のトレースに繋げる)。
+    最上位のスパンが終わった時点でトレース全体をリングバッファに格納する。
+    """
+    if TRACING_MODE != "on":
+        yield None
+        return
+
+    parent = _current_span.get()
+    trace = _current_trace.get()
+    if parent is None or trace is None:
+        remote = parse_traceparent(traceparent)
+        trace_id = remote["trace_id"] if remote else secrets.token_hex(16)
+        parent_id = remote["parent_id"] if remote else None
+        current = Span(name, trace_id, parent_id, attributes)
+        trace = _Trace(current)
+        is_root = True
+    else:
+        current = Span(name, parent.trace_id, parent.span_id, attributes)
+        is_root = False
+
+    if len(trace.spans) < TRACE_MAX_SPANS:
+        trace.spans.append(current)
+    else:
+        trace.dropped += 1
+
+    span_token = _current_span.set(current)
+    trace_token = _current_trace.set(trace)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - current._started
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        if is_root:
+            _buffer.add(trace)
+
+
+def traced(name: str) -> Callable:
+    """
+    関数 (同期・非同期どちらも可) の実行を span(name) で記録するデコレータ
+    """
+    def decorator(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator